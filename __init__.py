@@ -18,7 +18,7 @@ bl_info = {
     "name": "Vertex Oven",
     "description": "Bake ambient occlusion straight to vertex colors",
     "author": "Forest Katsch",
-    "version": (0, 1, 9),
+    "version": (0, 2, 0),
     "blender": (2, 80, 0),
     "location": "3D View > Object > Vertex Oven",
     "warning": "Warning: this addon is still young, and problems may occur. If you're concerned about this addon, make sure you've backed up your Blender file first.",
@@ -32,13 +32,25 @@ import math
 import mathutils
 
 import time
+import os
+import json
+import shutil
+import hashlib
+import tempfile
 
 from mathutils.bvhtree import BVHTree
 from bpy.props import StringProperty, EnumProperty, FloatProperty
 from bpy.types import Operator
+from bpy.app.handlers import persistent
 
 import bpy
 
+from . import engines
+from . import kernels
+from . import jobs
+from . import snapshot
+from . import api
+
 class BakeError(Exception):
 
     def __init__(self, message):
@@ -86,21 +98,486 @@ class BakeOptionsAO(BakeOptions):
             "power",
             "seed",
             "sample_count",
+            "sample_mode",
+            "time_budget",
 
             "jitter",
             "jitter_fraction",
 
             "ignore_small_objects",
             "small_object_size",
+
+            "bake_animation",
+            "use_scene_frame_range",
+            "frame_start",
+            "frame_end",
+            "frame_step",
+            "animation_output",
+            "animation_cache_directory",
+
+            "engine",
+            "kernel_backend",
+            "voxel_resolution",
+            "disk_accuracy",
+
+            "use_checkpoints",
+            "checkpoint_interval",
+
+            "bake_location",
+            "job_directory",
+            "snapshot_path",
+
+            "denoise",
+            "denoise_strength",
+            "denoise_iterations",
+
+            "use_symmetry",
+            "symmetry_axis",
+            "symmetry_tolerance",
+
+            "bake_mask",
+            "mask_group_name",
+            "mask_threshold",
         ]
 
-class BakeVertexPoint:
+def format_duration(seconds):
+    """Returns `seconds` as "m:ss", or "h:mm:ss" if it's an hour or more."""
+
+    seconds = int(math.ceil(max(0, seconds)))
+
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+
+    if hours:
+        return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+    return "{}:{:02d}".format(minutes, seconds)
+
+def get_hash(data):
+    """Returns a short hex digest of `data` (bytes.) Unlike `hash()`, this is the same in every Blender session."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+class BakePoints:
+    """Every point to be baked on one object, as parallel arrays with one entry per point (loop.)"""
+
+    def __init__(self, positions, normals, vertex_indices, loop_indices):
+        # Object-space positions and normals (N×3.)
+        self.positions = positions
+        self.normals = normals
+
+        self.vertex_indices = vertex_indices
+        self.loop_indices = loop_indices
+
+    def __len__(self):
+        return len(self.loop_indices)
+
+    def subset(self, indices):
+        """Returns new `BakePoints` with only the points at `indices`."""
+        return BakePoints(self.positions[indices], self.normals[indices], self.vertex_indices[indices], self.loop_indices[indices])
+
+    def to_world(self, matrix):
+        """Returns `(positions, normals)` in world space, given the object's `matrix_world`."""
+        return engines.to_world(self.positions, self.normals, matrix)
+
+class CachedCaster:
+    """A BVH tree for a single piece of geometry, along with enough information to tell when it needs to be rebuilt."""
+
+    def __init__(self, key):
+        self.key = key
+
+        self.bvh = None
+
+        # (vertex count, loop count, polygon count, hash of each loop's vertex index)
+        self.topology = None
+
+        # A list of vertex index lists, one per polygon. Kept around so deforming meshes don't have to re-read them.
+        self.polygons = None
+
+        # Vertex positions (V×3) and triangle vertex indices (T×3), for the engines that don't use the BVH tree.
+        self.coords = None
+        self.triangles = None
+
+        self.coords_hash = None
+
+        # The local-space bounding box as `(min, max)`.
+        self.local_bounds = None
+
+        # Changes whenever the geometry changes.
+        self.signature = None
+
+        # The `CasterCache.generation` this entry was last updated in.
+        self.generation = -1
+
+class CasterInstance:
+    """One placement of a `CachedCaster` in the world. Linked duplicates and instances all share the same tree."""
+
+    def __init__(self, caster, matrix, obj=None):
+        self.caster = caster
+
+        # The original object, if this isn't an instance; used to tell when an object is casting onto itself.
+        self.object = obj
+
+        self.matrix = matrix
+        self.matrix_inverse = matrix.inverted()
+        self.matrix_inverse_3x3 = self.matrix_inverse.to_3x3()
+
+        local_min, local_max = caster.local_bounds
+
+        corners = [matrix @ mathutils.Vector((x, y, z)) for x in (local_min.x, local_max.x) for y in (local_min.y, local_max.y) for z in (local_min.z, local_max.z)]
+
+        # The world-space bounding box as `(min, max)`.
+        self.bounds = (
+            mathutils.Vector([min(corner[i] for corner in corners) for i in range(3)]),
+            mathutils.Vector([max(corner[i] for corner in corners) for i in range(3)])
+        )
+
+        # Changes whenever the geometry or the transform changes.
+        self.signature = (caster.signature, tuple(tuple(row) for row in matrix))
+
+    def get_world_triangles(self):
+        """Returns this instance's triangles in world space, as a T×3×3 array."""
+
+        matrix = np.array(self.matrix, dtype=np.float64)
+
+        coords = (self.caster.coords @ matrix[:3, :3].T) + matrix[:3, 3]
+
+        return coords[self.caster.triangles]
+
+class CasterCache:
+    """
+Keeps a BVH tree for every piece of casting geometry around for the entire bake. Trees are only rebuilt when the
+evaluated geometry changes; objects that only move just get new matrices, since rays are transformed into object space
+anyway. Objects without modifiers share their mesh's tree, so linked duplicates and instances only cost one tree.
+"""
+
+    def __init__(self):
+        # {geometry key: CachedCaster}
+        self.entries = {}
+
+        # Bumped once per frame; entries are updated at most once per generation.
+        self.generation = 0
+
+        # Just for the console summary.
+        self.built_count = 0
+        self.refit_count = 0
+        self.reused_count = 0
+
+    def new_frame(self):
+        """
+Starts a new generation, so every tree gets checked again (once.) Entries that nothing asked for during the last one
+are dropped; their geometry is gone, or has a new key (mesh pointers change after undo, for one.)
+"""
+
+        self.entries = {key: entry for key, entry in self.entries.items() if entry.generation == self.generation}
+
+        self.generation += 1
+
+    @classmethod
+    def get_geometry_key(cls, obj_eval):
+        """Returns a key that's the same for every evaluated object with identical geometry."""
+
+        # Without modifiers, the evaluated geometry is just the (shared) mesh datablock. These pointers are only
+        # stable for a single depsgraph evaluation, but that's fine: entries are always checked against the geometry.
+        if len(obj_eval.modifiers) == 0:
+            return ("mesh", obj_eval.data.as_pointer())
+
+        return ("object", obj_eval.name)
+
+    def update(self, obj_eval):
+        """Returns the up-to-date `CachedCaster` for the evaluated object `obj_eval`."""
+
+        key = CasterCache.get_geometry_key(obj_eval)
+
+        entry = self.entries.get(key)
+
+        if entry == None:
+            entry = CachedCaster(key)
+            self.entries[key] = entry
+
+        if entry.generation == self.generation:
+            return entry
+
+        entry.generation = self.generation
+
+        mesh = obj_eval.to_mesh()
+
+        try:
+            coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+            mesh.vertices.foreach_get("co", coords)
+
+            loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+            mesh.loops.foreach_get("vertex_index", loop_vertices)
+
+            topology = (len(mesh.vertices), len(mesh.loops), len(mesh.polygons), get_hash(loop_vertices.tobytes()))
+
+            coords_hash = get_hash(coords.tobytes())
+
+            if topology != entry.topology:
+                loop_starts = np.empty(len(mesh.polygons), dtype=np.int32)
+                loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+
+                mesh.polygons.foreach_get("loop_start", loop_starts)
+                mesh.polygons.foreach_get("loop_total", loop_totals)
+
+                entry.polygons = [loop_vertices[start:start + total].tolist() for start, total in zip(loop_starts, loop_totals)]
+
+                mesh.calc_loop_triangles()
+
+                entry.triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+                mesh.loop_triangles.foreach_get("vertices", entry.triangles)
+                entry.triangles = entry.triangles.reshape((-1, 3))
+
+                entry.topology = topology
+                entry.coords_hash = None
+
+                self.built_count += 1
+            elif coords_hash != entry.coords_hash:
+                self.refit_count += 1
+            else:
+                self.reused_count += 1
+
+            if coords_hash != entry.coords_hash:
+                coords = coords.reshape((-1, 3))
+
+                # `mathutils` can't refit a tree in place, but with the same topology we keep the polygon lists and
+                # only feed in the new vertex positions.
+                entry.bvh = BVHTree.FromPolygons(coords.tolist(), entry.polygons)
+                entry.coords = coords
+                entry.coords_hash = coords_hash
+
+                if len(coords):
+                    entry.local_bounds = (mathutils.Vector(coords.min(axis=0)), mathutils.Vector(coords.max(axis=0)))
+                else:
+                    entry.local_bounds = (mathutils.Vector(), mathutils.Vector())
+        finally:
+            obj_eval.to_mesh_clear()
+
+        entry.signature = (entry.topology, entry.coords_hash)
+
+        return entry
+
+    def get_instance(self, obj, depsgraph):
+        """Returns a `CasterInstance` for the (original) object `obj`."""
+
+        obj_eval = obj.evaluated_get(depsgraph)
+
+        return CasterInstance(self.update(obj_eval), obj.matrix_world.copy(), obj)
+
+    @classmethod
+    def bounds_overlap(cls, a, b, margin=0):
+        """Returns `True` if the bounding boxes `a` and `b` (both `(min, max)`) are within `margin` of each other."""
+        return all(a[0][i] - margin <= b[1][i] and b[0][i] <= a[1][i] + margin for i in range(3))
+
+class BakeCheckpoint:
+    """
+Saves finished (and partly-finished) results to a directory next to the .blend file while a bake runs, so a cancelled
+or crashed bake can pick up where it left off. Each checkpoint is keyed by a fingerprint of the options that change the
+raw results, and kept in its own subdirectory, so baking with different settings never throws another one away. Each
+receiving object's results are keyed by a fingerprint of its geometry and everything within reach of it.
+"""
+
+    # Options that change the raw results. Everything else (where the results go, inverting them, which channels,
+    # denoising, and so on) happens after results are checkpointed, so changing it doesn't lose any work.
+    result_keys = [
+        "bake_cast_objects",
+        "include_self",
+
+        "max_distance",
+        "power",
+        "seed",
+        "sample_count",
+        "sample_mode",
+        "time_budget",
+
+        "jitter",
+        "jitter_fraction",
+
+        "ignore_small_objects",
+        "small_object_size",
+
+        "engine",
+        "kernel_backend",
+        "voxel_resolution",
+        "disk_accuracy",
+
+        "use_symmetry",
+        "symmetry_axis",
+        "symmetry_tolerance",
+
+        "bake_mask",
+        "mask_group_name",
+        "mask_threshold",
+    ]
+
+    def __init__(self, directory, fingerprint):
+        self.directory = directory
+        self.fingerprint = fingerprint
+
+        self.path = os.path.join(directory, fingerprint)
+
+        # {key: {"signature": str, "file": str, "last_point_index": int}}
+        self.entries = {}
+
+        # Whether manifest.json has been written for this bake; after that, entries are only appended to the journal.
+        self.has_manifest = False
+
+        # How many times results were saved during this bake.
+        self.save_count = 0
+
+        manifest = self.read_manifest()
+
+        if manifest != None and manifest.get("fingerprint") == fingerprint:
+            self.entries = manifest["entries"]
+
+            print("Found a checkpoint with {} object(s) at '{}'".format(len(self.entries), self.path))
+
+            # Fold the previous bake's journal into the manifest, so the journal only ever has this bake's saves in it.
+            self.write_manifest()
+
+        others = [name for name in self.get_fingerprints() if name != fingerprint]
+
+        if len(others) > 0:
+            print("Keeping {} checkpoint(s) made with different settings in '{}'; bake with those settings again to resume them, or delete them".format(len(others), directory))
+
+    @classmethod
+    def get_path(cls):
+        """Returns the directory checkpoints go in for the current .blend file (or a temporary directory if it isn't saved.)"""
+
+        if bpy.data.filepath:
+            return bpy.data.filepath + ".vertex_oven_checkpoint"
+
+        return os.path.join(tempfile.gettempdir(), "vertex_oven_checkpoint")
+
+    def get_fingerprints(self):
+        """Returns the fingerprint of every checkpoint in the directory, including this one if it's been saved."""
+
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+
+        return [name for name in names if os.path.isfile(os.path.join(self.directory, name, "manifest.json"))]
+
+    @classmethod
+    def get_fingerprint(cls, options, frames):
+        """Returns a fingerprint of every option that affects the raw results, and the `frames` being baked."""
+
+        items = [("frames", list(frames))]
+
+        for key in cls.result_keys:
+            if key not in options.options:
+                continue
+
+            value = options.options[key]
+
+            # Enum flags are sets, which don't have a stable order.
+            if isinstance(value, set):
+                value = sorted(value)
+
+            items.append((key, value))
+
+        return get_hash(repr(items).encode("utf-8"))
+
+    @classmethod
+    def write_atomic(cls, path, write):
+        """Calls `write(file)` on a temporary file, then moves it over `path`, so a crash never leaves half a file behind."""
+
+        temporary_path = path + ".tmp"
+
+        with open(temporary_path, "wb") as f:
+            write(f)
+
+        os.replace(temporary_path, path)
+
+    def read_manifest(self):
+        """Returns the manifest, with every entry from the journal after it applied, or `None` if there isn't one."""
+
+        try:
+            with open(os.path.join(self.path, "manifest.json"), "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            with open(os.path.join(self.path, "journal.jsonl"), "r") as f:
+                for line in f:
+                    try:
+                        key, entry = json.loads(line)
+                    except ValueError:
+                        # A crash in the middle of writing leaves half a line at the end.
+                        continue
+
+                    manifest["entries"][key] = entry
+        except OSError:
+            pass
 
-    def __init__(self, position, normal, vertex_index, loop_index):
-        self.position = position
-        self.normal = normal
-        self.vertex_index = vertex_index
-        self.loop_index = loop_index
+        return manifest
+
+    def write_manifest(self):
+        os.makedirs(self.path, exist_ok=True)
+
+        manifest = json.dumps({"fingerprint": self.fingerprint, "entries": self.entries}, indent=1)
+
+        BakeCheckpoint.write_atomic(os.path.join(self.path, "manifest.json"), lambda f: f.write(manifest.encode("utf-8")))
+
+        # Everything in the journal is in the manifest now.
+        try:
+            os.remove(os.path.join(self.path, "journal.jsonl"))
+        except OSError:
+            pass
+
+        self.has_manifest = True
+
+    def load(self, key, signature):
+        """Returns `(ao_data, last_point_index)` for `key`, or `None` if there isn't a matching checkpoint."""
+
+        entry = self.entries.get(key)
+
+        if entry == None or entry["signature"] != signature:
+            return None
+
+        try:
+            return np.load(os.path.join(self.path, entry["file"])), entry["last_point_index"]
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key, signature, ao_data, last_point_index):
+        os.makedirs(self.path, exist_ok=True)
+
+        filename = get_hash(key.encode("utf-8")) + ".npy"
+
+        BakeCheckpoint.write_atomic(os.path.join(self.path, filename), lambda f: np.save(f, ao_data))
+
+        self.entries[key] = {
+            "signature": signature,
+            "file": filename,
+            "last_point_index": int(last_point_index),
+        }
+
+        self.save_count += 1
+
+        if not self.has_manifest:
+            self.write_manifest()
+
+            return
+
+        # Rewriting the whole manifest every time would cost more and more with every object; a line in the journal
+        # doesn't. The results file is already in place, so the entry never points at a file that isn't there yet.
+        with open(os.path.join(self.path, "journal.jsonl"), "a") as f:
+            f.write(json.dumps([key, self.entries[key]]) + "\n")
+
+    def remove(self):
+        """Removes this checkpoint, and the directory too if there aren't any others left in it."""
+
+        shutil.rmtree(self.path, ignore_errors=True)
+
+        self.entries = {}
+        self.has_manifest = False
+
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass
 
 # This never worked right.
 #class ProgressWidget(object):
@@ -177,6 +654,19 @@ class BakeVertexPoint:
 class BakeAO:
     """The primary bake class. Users must run `bake(vertices=<>)` and `finish()` manually."""
 
+    # When baking to a time budget, no point gets more samples than this.
+    max_budget_samples = 1024
+
+    # When baking to a time budget, the number of samples added to every point in each pass. Smaller passes waste less
+    # time when the deadline cuts one short.
+    budget_pass_size = 4
+
+    # The number of samples in the first pass of a progressive bake; every pass after that doubles the total.
+    progressive_pass_size = 4
+
+    # How long to spend measuring how fast we can cast samples, in seconds.
+    calibration_time = 0.25
+
     def __init__(self, options, context):
         self.options = options
         self.context = context
@@ -187,18 +677,90 @@ class BakeAO:
         # The objects that receive ambient occlusion
         self.bake_receive_objects = []
 
-        # The objects that contribute to ambient occlusion on the receiving objects
+        # The `CasterInstance`s that contribute to ambient occlusion on the receiving objects
         self.bake_cast_objects = []
 
         # The point we're on. This goes up until it reaches `len(self.points_to_bake)`.
         self.last_point_index = 0
 
-        # self.ao_data is a dictionary of {vertex_index: ambient occlusion}
-        self.ao_data = []
+        # The `BakePoints` for the object we're baking at the moment.
+        self.points_to_bake = None
+
+        # self.ao_data is an array with the ambient occlusion for each of `self.points_to_bake`.
+        self.ao_data = None
+
+        # The vectorized engine for the object we're baking; `None` when ray casting.
+        self.engine = None
+
+        # The `engines.ComputeThread` running the engine over the current pass, when baking in the background.
+        self.worker = None
+
+        # BVH trees for casting objects, shared between receivers and frames.
+        self.caster_cache = CasterCache()
+
+        # {object name: boolean array or `None`}; see `get_vertex_mask()`. Selections and weights don't change during a
+        # bake, so each object's mask is only worked out once.
+        self.vertex_masks = {}
+
+        # The frames we're baking, and the index of the one we're on.
+        self.frames = []
+        self.frame_index = 0
+
+        # When baking animation: {object name: (neighborhood signature, points_to_bake, ao_data)} from the previous frame.
+        self.previous_results = {}
+
+        # The `BakeCheckpoint`, or `None` if checkpoints are turned off.
+        self.checkpoint = None
+        self.last_checkpoint_time = 0
+
+        # Ray casting happens in passes, each over every point with a few more samples. `self.ao_data` holds the pass
+        # we're on; finished passes are added up in `self.ao_sum`, `self.completed_samples` samples per point so far.
+        self.pass_samples = []
+        self.pass_directions = None
+        self.planned_samples = 0
+        self.completed_samples = 0
+        self.ao_sum = None
+        self.passes_finished = False
+
+        # When baking to a time budget: when the whole bake and the object we're baking have to be done by, how many
+        # samples per second we can cast, and each receiver's share of the budget.
+        self.deadline = None
+        self.receiver_deadline = None
+        self.receiver_start_time = 0
+        self.sample_rate = None
+        self.receiver_weights = None
+
+        # If the object we're baking is symmetric, `(all points, baked point indices, mirrored point indices, mirror)`;
+        # `self.points_to_bake` is then only the baked half. See `get_symmetry()`.
+        self.symmetry = None
 
     # Returns a value within the range 0..100
     def get_progress_percentage(self):
-        return (self.last_point_index / len(self.points_to_bake)) * 100
+        if len(self.points_to_bake) == 0:
+            return 100
+
+        point_progress = self.last_point_index / len(self.points_to_bake)
+
+        if self.options.engine != "raycast" or self.planned_samples == 0 or self.passes_finished:
+            return point_progress * 100
+
+        return ((self.completed_samples + (point_progress * len(self.pass_samples))) / self.planned_samples) * 100
+
+    def get_time_left(self):
+        """Returns the number of seconds until the time budget runs out, or `None` if there's no time budget."""
+
+        if self.deadline == None:
+            return None
+
+        return max(0, self.deadline - time.time())
+
+    def is_time_budget(self):
+        """Returns `True` if we're picking sample counts to fit a time budget. Only ray casting takes samples."""
+        return self.options.sample_mode == "time" and self.options.engine == "raycast"
+
+    def is_progressive(self):
+        """Returns `True` if results are written out after every pass, getting less noisy as more samples come in."""
+        return self.options.sample_mode == "progressive" and self.options.engine == "raycast"
 
     @classmethod
     def random_vector(cls):
@@ -291,10 +853,10 @@ class BakeAO:
     def get_vertex_loop_id(self, vertex_index, loop_index):
         return str(vertex_index) + ":" + str(loop_index)
 
-    def calculate_vertex_ao(self, position, normal):
+    def calculate_vertex_ao(self, position, normal, samples=None):
         """
-Returns a value, 0-1, of how occluded this `vertex` is. Samples are taken for each object; the count is
-determined by `self.options.sample_count`.
+Returns a value, 0-1, of how occluded this `vertex` is. Samples are taken for each object; by default, every sample
+in `self.sample_distribution` is used, but a smaller list of directions can be given with `samples`.
 """
         obj = self.active_object
 
@@ -308,7 +870,10 @@ determined by `self.options.sample_count`.
         sample_position = position
         sample_position_object = position
 
-        for i, sample_point in enumerate(self.sample_distribution):
+        if samples == None:
+            samples = self.sample_distribution
+
+        for i, sample_point in enumerate(samples):
 
             if self.options.jitter:
                 sample_position = sample_position + self.jitter_vertex(vertex, i)
@@ -334,7 +899,7 @@ determined by `self.options.sample_count`.
 
             occlusion += self.occlusion_from_distance(distance, self.options.max_distance, self.options.power)
 
-        return occlusion / len(self.sample_distribution)
+        return occlusion / len(samples)
 
     @classmethod
     def vertex_color_layer_exists(cls, obj, name):
@@ -400,14 +965,27 @@ determined by `self.options.sample_count`.
 
         return objects
 
+    def get_target_name(self, name):
+        """Returns the name of the layer or group to write to; when baking animation, each frame gets its own."""
+
+        if not self.options.bake_animation:
+            return name
+
+        return "{} {:04d}".format(name, self.frames[self.frame_index])
+
     def get_vertex_color_layer(self):
         """Returns Blender's `VertexColors` object."""
 
         mesh = self.active_mesh
-        name = self.options.color_layer_name
+        name = self.get_target_name(self.options.color_layer_name)
 
         if not mesh.vertex_colors or name not in mesh.vertex_colors:
             layer = mesh.vertex_colors.new()
+
+            # Meshes can only have a handful of vertex color layers.
+            if layer == None:
+                raise BakeError("Couldn't create vertex color layer '{}' on '{}'; there are too many layers already. To bake long frame ranges, use cached arrays instead".format(name, self.active_object.name))
+
             layer.name = name
 
             mesh.vertex_colors.active = layer
@@ -419,9 +997,7 @@ determined by `self.options.sample_count`.
     def get_vertex_group(self):
         """Returns Blender's `VertexGroup` object."""
         obj = self.active_object
-        name = self.options.group_name
-
-        print(obj.vertex_groups)
+        name = self.get_target_name(self.options.group_name)
 
         if not obj.vertex_groups or name not in obj.vertex_groups:
             group = obj.vertex_groups.new()
@@ -436,70 +1012,148 @@ determined by `self.options.sample_count`.
     def apply_vertex_colors(self):
         """Apply `self.ao_data` to the vertex color layer."""
 
-        mesh = self.active_mesh
         layer = self.get_vertex_color_layer()
+        points = self.points_to_bake
 
-        for index, point in enumerate(self.points_to_bake):
-            brightness = self.ao_data[index]
+        brightness = self.ao_data
 
-            if self.options.color_invert:
-                brightness = 1 - brightness
+        if self.options.color_invert:
+            brightness = 1 - brightness
 
-            color = list(layer.data[point.loop_index].color)
+        # Read and write the whole layer at once; going through `layer.data[i].color` is very slow.
+        colors = np.empty(len(layer.data) * 4, dtype=np.float32)
+        layer.data.foreach_get("color", colors)
+        colors = colors.reshape((-1, 4))
 
-            if "r" in self.options.color_channels:
-                color[0] = brightness
-            if "g" in self.options.color_channels:
-                color[1] = brightness
-            if "b" in self.options.color_channels:
-                color[2] = brightness
-            if "a" in self.options.color_channels:
-                color[3] = brightness
+        for channel_index, channel in enumerate("rgba"):
+            if channel in self.options.color_channels:
+                colors[points.loop_indices, channel_index] = brightness
 
-            layer.data[point.loop_index].color = tuple(color)
+        layer.data.foreach_set("color", colors.ravel())
 
     def apply_vertex_groups(self):
         """Apply `self.ao_data` to the vertex group."""
         group = self.get_vertex_group()
 
-        for index, point in enumerate(self.points_to_bake):
-            weight = self.ao_data[index]
+        weights = self.ao_data
 
-            if self.options.weight_invert:
-                weight = 1 - weight
+        if self.options.weight_invert:
+            weights = 1 - weights
 
-            group.add([point.vertex_index], weight, "REPLACE")
+        points = self.points_to_bake
 
-    def start(self):
-        print("Baking vertex AO...")
+        # Several loops share each vertex, and the last one in the mesh wins. Points are baked in Morton order, so put
+        # them back in loop order first.
+        order = np.argsort(points.loop_indices, kind="stable")
 
-        self.start_time = time.time()
+        vertex_weights = dict(zip(points.vertex_indices[order].tolist(), weights[order].tolist()))
+
+        for vertex_index, weight in vertex_weights.items():
+            group.add([vertex_index], weight, "REPLACE")
+
+    def apply_cache_arrays(self):
+        """Saves `self.ao_data` as a per-loop NumPy array for the current frame. Values are unmodified (1 is fully occluded.)"""
+
+        directory = bpy.path.abspath(self.options.animation_cache_directory)
+
+        os.makedirs(directory, exist_ok=True)
+
+        ao = np.zeros(len(self.active_mesh.loops), dtype=np.float32)
+        ao[self.points_to_bake.loop_indices] = self.ao_data
+
+        filename = "{}_{:04d}.npy".format(bpy.path.clean_name(self.active_object.name), self.frames[self.frame_index])
+
+        np.save(os.path.join(directory, filename), ao)
+
+        return filename
+
+    def get_frames(self):
+        """Returns the list of frames to bake; just the current frame, unless we're baking animation."""
 
         options = self.options
-        context = self.context
+        scene = self.context.scene
 
-        depsgraph = context.evaluated_depsgraph_get()
+        if not options.bake_animation:
+            return [scene.frame_current]
+
+        if options.use_scene_frame_range:
+            frame_start, frame_end = scene.frame_start, scene.frame_end
+        else:
+            frame_start, frame_end = options.frame_start, options.frame_end
+
+        return list(range(frame_start, frame_end + 1, max(1, options.frame_step)))
+
+    def create_sample_distribution(self, sample_count):
+        """Creates a set of random samples. This dramatically speeds up baking."""
 
-        # Create a set of random samples. This dramatically speeds up baking.
         self.sample_distribution = []
 
         self.random_values = []
 
-        print("Creating sample distribution...")
-
         # Set our seed.
         np.random.seed(self.options.seed)
 
-        for i in range(options.sample_count):
+        for i in range(sample_count):
             self.sample_distribution.append(BakeAO.random_vector())
 
             self.random_values.append((np.random.uniform(), np.random.uniform()))
 
+    def start(self):
+        print("Baking vertex AO...")
+
+        self.start_time = time.time()
+
+        options = self.options
+        context = self.context
+
+        print("Creating sample distribution...")
+
+        # With a time budget, we don't know how many samples we'll get to; every point uses the first however-many.
+        self.create_sample_distribution(BakeAO.max_budget_samples if self.is_time_budget() else options.sample_count)
+
         print("Getting receiving objects...")
 
         self.bake_receive_objects = BakeAO.get_bake_objects(context, options.bake_receive_objects, True)
 
-        self.start_object(self.bake_receive_objects[0])
+        # Set first, so `restore_frame()` works even if starting fails.
+        self.original_frame = context.scene.frame_current
+
+        self.frames = self.get_frames()
+
+        if len(self.frames) == 0:
+            raise BakeError("The frame range is empty; nothing to bake")
+
+        if self.is_time_budget():
+            self.deadline = self.start_time + options.time_budget
+            self.receiver_weights = self.get_receiver_weights()
+
+        if options.use_checkpoints:
+            self.checkpoint = BakeCheckpoint(BakeCheckpoint.get_path(), BakeCheckpoint.get_fingerprint(options, self.frames))
+
+            self.last_checkpoint_time = time.time()
+
+        self.start_frame(0)
+
+    def start_frame(self, frame_index):
+        self.frame_index = frame_index
+
+        if self.options.bake_animation:
+            print("Baking frame {} ({}/{})...".format(self.frames[frame_index], frame_index + 1, len(self.frames)))
+
+            self.context.scene.frame_set(self.frames[frame_index])
+
+        # Anything could have moved; every cached tree gets checked again (once) this frame.
+        self.caster_cache.new_frame()
+
+        self.active_object = None
+
+        return self.start_object(self.bake_receive_objects[0])
+
+    def restore_frame(self):
+        """Puts the scene back on the frame it was on before an animation bake."""
+
+        if self.options.bake_animation and self.context.scene.frame_current != self.original_frame:
+            self.context.scene.frame_set(self.original_frame)
 
     @classmethod
     def get_cast_objects(cls, context, options):
@@ -512,46 +1166,591 @@ determined by `self.options.sample_count`.
 
         return objects
 
-    def start_object(self, obj):
+    @classmethod
+    def get_cast_instances(cls, context, options, depsgraph, caster_cache):
+        """
+Returns a list of `CasterInstance`s for everything that casts occlusion, including collection instances, instanced
+empties and geometry node instances. Instances of the same geometry share a single BVH tree from `caster_cache`.
+"""
 
-        options = self.options
-        context = self.context
+        active_object = context.active_object
 
-        depsgraph = context.evaluated_depsgraph_get()
+        small_object_size = 0
+        if options.ignore_small_objects:
+            small_object_size = options.small_object_size
 
-        # The object to bake.
-        self.active_object = obj
-        self.active_mesh = self.active_object.data
+        # The objects that are allowed to cast (or instance something that casts); `None` means everything.
+        if options.bake_cast_objects == "scene":
+            allowed = None
+        elif options.bake_cast_objects == "selected":
+            allowed = set(obj.name for obj in context.scene.objects if obj.select_get())
+        else:
+            allowed = set([active_object.name])
 
-        # Objects that we'll check AO on.
-        self.bake_cast_objects = BakeAO.get_cast_objects(self.context, self.options)
+        instances = []
 
-        print("{} object(s) contributing to bake of '{}'".format(len(self.bake_cast_objects), self.active_object.name))
+        for object_instance in depsgraph.object_instances:
+            obj_eval = object_instance.object
 
-        print("Creating BVH trees...")
+            if obj_eval.type != "MESH":
+                continue
 
-        # Finally, get all the BVH tree objects from each object.
-        self.bake_object_cache = [(bake_obj, BVHTree.FromObject(bake_obj, depsgraph), bake_obj.matrix_world.inverted(), bake_obj.matrix_world.inverted().to_3x3()) for bake_obj in self.bake_cast_objects]
+            if object_instance.is_instance:
+                source = object_instance.parent.original
+            else:
+                source = obj_eval.original
 
-        # Make sure to set our seed here, too.
-        np.random.seed(self.options.seed)
+            if allowed != None and source.name not in allowed:
+                continue
 
-        self.points_to_bake = []
+            if not options.include_self and not object_instance.is_instance and source == active_object:
+                continue
 
-        mesh = self.active_mesh
-        mesh.calc_normals_split()
+            if not source.visible_get():
+                continue
 
-        print("Finding all points to be baked...")
-        for poly in mesh.polygons:
+            matrix = object_instance.matrix_world.copy()
 
-            for poly_vertex_index in range(len(poly.vertices)):
-                vertex_index = poly.vertices[poly_vertex_index]
-                loop_index = poly.loop_indices[poly_vertex_index]
+            # The same as `Object.dimensions.length`, but for this instance's transform.
+            bound_box = [mathutils.Vector(corner) for corner in obj_eval.bound_box]
 
-                self.points_to_bake.append(BakeVertexPoint(mesh.vertices[vertex_index].co, mesh.loops[loop_index].normal, vertex_index, loop_index))
+            if ((bound_box[6] - bound_box[0]) * matrix.to_scale()).length <= small_object_size:
+                continue
+
+            # Instance objects are only valid while we're iterating, so the tree has to be built right now.
+            instances.append(CasterInstance(caster_cache.update(obj_eval), matrix, None if object_instance.is_instance else source))
+
+        return instances
+
+    def get_neighborhood_signature(self, receiver, casters):
+        """Returns a value that only changes if `receiver` or anything within `max_distance` of it changed."""
+
+        nearby = [instance.signature for instance in casters if CasterCache.bounds_overlap(receiver.bounds, instance.bounds, self.options.max_distance)]
+
+        return (receiver.signature, tuple(sorted(nearby)))
+
+    @classmethod
+    def get_receiver_points(cls, obj, depsgraph):
+        """Returns the `BakePoints` to bake on `obj`, one per loop."""
+
+        # Bake from the evaluated mesh, so deforming receivers line up with their own (evaluated) BVH tree. Modifiers
+        # that change the topology mean the loops won't match up with the original mesh, so we fall back to that.
+        obj_eval = obj.evaluated_get(depsgraph)
+        mesh = obj_eval.to_mesh()
+
+        try:
+            if len(mesh.loops) != len(obj.data.loops):
+                mesh = obj.data
+
+            return BakeAO.get_points(mesh)
+        finally:
+            obj_eval.to_mesh_clear()
+
+    def get_vertex_mask(self, obj):
+        """Returns which of `obj`'s vertices to bake as a boolean array, or `None` to bake all of them."""
+
+        if obj.name not in self.vertex_masks:
+            self.vertex_masks[obj.name] = self.create_vertex_mask(obj)
+
+        return self.vertex_masks[obj.name]
+
+    def create_vertex_mask(self, obj):
+        options = self.options
+        mesh = obj.data
+
+        if options.bake_mask == "selected":
+            mask = np.empty(len(mesh.vertices), dtype=bool)
+            mesh.vertices.foreach_get("select", mask)
+
+            return mask
+
+        if options.bake_mask == "group":
+            mask = np.zeros(len(mesh.vertices), dtype=bool)
+
+            group = obj.vertex_groups.get(options.mask_group_name)
+
+            # Objects without the group don't have anything to bake.
+            if group == None:
+                return mask
+
+            group_index = group.index
+            threshold = options.mask_threshold
+
+            # There's no `foreach_get()` for weights, which is why masks are cached.
+            for vertex in mesh.vertices:
+                for element in vertex.groups:
+                    if element.group == group_index:
+                        mask[vertex.index] = element.weight > threshold
+                        break
+
+            return mask
+
+        return None
+
+    def get_bake_points(self, obj, depsgraph):
+        """Returns the `BakePoints` to bake on `obj`; one per loop, or just the masked vertices' loops."""
+
+        points = BakeAO.get_receiver_points(obj, depsgraph)
+
+        mask = self.get_vertex_mask(obj)
+
+        if mask is not None:
+            points = points.subset(np.nonzero(mask[points.vertex_indices])[0])
+
+        return points
+
+    @classmethod
+    def get_points(cls, mesh):
+        """Returns `BakePoints` with one point per loop in `mesh`."""
+
+        mesh.calc_normals_split()
+
+        loop_count = len(mesh.loops)
+
+        vertex_indices = np.empty(loop_count, dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", vertex_indices)
+
+        coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", coords)
+
+        normals = np.empty(loop_count * 3, dtype=np.float32)
+        mesh.loops.foreach_get("normal", normals)
+
+        return BakePoints(coords.reshape((-1, 3))[vertex_indices], normals.reshape((-1, 3)), vertex_indices, np.arange(loop_count, dtype=np.int32))
+
+    def create_voxel_engine(self, receiver):
+        """Voxelizes every caster within `max_distance` of `receiver` (a `CasterInstance`) and returns the engine."""
+
+        options = self.options
+
+        triangles = [instance.get_world_triangles() for instance in self.bake_cast_objects if CasterCache.bounds_overlap(receiver.bounds, instance.bounds, options.max_distance)]
+
+        if len(triangles):
+            triangles = np.concatenate(triangles)
+        else:
+            triangles = np.zeros((0, 3, 3))
+
+        # The grids are voxelized a tile at a time while baking, so huge receivers don't need a huge grid.
+        tiles = engines.VoxelTiles(triangles, options.max_distance / options.voxel_resolution, options.max_distance, (np.array(receiver.bounds[0]), np.array(receiver.bounds[1])))
+
+        print("Voxelizing {} triangles in tiles of {:.3g} units, with {:.3g} unit voxels".format(len(triangles), tiles.get_tile_size(), tiles.voxel_size))
+
+        return engines.VoxelConeEngine(tiles, options.max_distance, options.power)
+
+    def create_disk_engine(self, receiver):
+        """Turns every caster within `max_distance` of `receiver` (a `CasterInstance`) into disks and returns the engine."""
+
+        options = self.options
+
+        triangles = [instance.get_world_triangles() for instance in self.bake_cast_objects if CasterCache.bounds_overlap(receiver.bounds, instance.bounds, options.max_distance)]
+
+        if len(triangles):
+            triangles = np.concatenate(triangles)
+        else:
+            triangles = np.zeros((0, 3, 3))
+
+        tree = engines.DiskOcclusionEngine.create_tree(triangles, options.max_distance)
+
+        print("Clustered {} disks into {} nodes".format(len(tree.areas), len(tree.node_areas)))
+
+        return engines.DiskOcclusionEngine(tree, options.max_distance, options.power, options.disk_accuracy)
+
+    def create_ray_cast_engine(self, receiver):
+        """Flattens every caster within `max_distance` of `receiver` (a `CasterInstance`) into one tree for a kernel backend."""
+
+        options = self.options
+
+        triangles = [instance.get_world_triangles() for instance in self.bake_cast_objects if CasterCache.bounds_overlap(receiver.bounds, instance.bounds, options.max_distance)]
+
+        if len(triangles):
+            triangles = np.concatenate(triangles)
+        else:
+            triangles = np.zeros((0, 3, 3))
+
+        backend = kernels.get_backend(BakeAO.get_kernel_backend_name(options.kernel_backend))
+
+        bvh = kernels.TriangleBVH(triangles)
+
+        print("Casting rays against {} triangles with the {} backend".format(len(bvh), backend.label))
+
+        return kernels.RayCastEngine(bvh, options.max_distance, options.power, backend)
+
+    @classmethod
+    def get_kernel_backend_name(cls, kernel_backend):
+        """Returns the name of the `kernels` backend to use for the `kernel_backend` option, or "blender"."""
+
+        if kernel_backend != "auto":
+            return kernel_backend
+
+        # Without a JIT compiler, Blender's own trees are faster than walking a tree with NumPy.
+        if kernels.NumbaBackend.is_available():
+            return "numba"
+
+        return "blender"
+
+    def get_chunk_size(self):
+        """Returns the number of points to bake each time the operator updates."""
+
+        if self.options.engine in ["voxel", "disks"]:
+            return 20000
+
+        if self.engine != None:
+            return self.engine.backend.rays_per_update / self.get_pass_size()
+
+        return 50000 / self.get_pass_size()
+
+    def get_pass_size(self):
+        """Returns the number of samples each ray casting pass adds to every point."""
+
+        if self.is_time_budget():
+            return BakeAO.budget_pass_size
+
+        # Each pass doubles the sample count, so the first result shows up right away, and there aren't too many rewrites.
+        if self.is_progressive():
+            return max(BakeAO.progressive_pass_size, self.completed_samples)
+
+        # Without a time budget, everything is done in a single pass.
+        return self.options.sample_count
+
+    def get_receiver_weights(self):
+        """Returns each receiving object's share of the time budget, from its loop count and surface area."""
+
+        loop_counts = []
+        areas = []
+
+        for obj in self.bake_receive_objects:
+            mesh = obj.data
+
+            polygon_areas = np.empty(len(mesh.polygons), dtype=np.float32)
+            mesh.polygons.foreach_get("area", polygon_areas)
+
+            mask = self.get_vertex_mask(obj)
+
+            # Only the masked part of the object counts.
+            if mask is not None:
+                loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+                mesh.loops.foreach_get("vertex_index", loop_vertices)
+
+                loop_mask = mask[loop_vertices]
+
+                loop_starts = np.empty(len(mesh.polygons), dtype=np.int32)
+                mesh.polygons.foreach_get("loop_start", loop_starts)
+
+                loop_counts.append(int(loop_mask.sum()))
+
+                # A polygon counts if any of its corners are being baked.
+                if len(loop_starts):
+                    polygon_areas = polygon_areas[np.add.reduceat(loop_mask, loop_starts) > 0]
+
+            else:
+                loop_counts.append(len(mesh.loops))
+
+            # Polygon areas are in object space.
+            scale = obj.matrix_world.to_scale()
+            areas.append(float(polygon_areas.sum()) * (abs(scale.x * scale.y * scale.z) ** (2 / 3)))
+
+        loop_counts = np.array(loop_counts, dtype=np.float64)
+        areas = np.array(areas, dtype=np.float64)
+
+        # The cost is mostly the loop count; area keeps sparse, large objects from getting too few samples.
+        return (loop_counts / max(1, loop_counts.sum())) * 0.5 + (areas / max(1e-9, areas.sum())) * 0.5
+
+    def calibrate(self):
+        """Returns how many samples (each cast against every caster) per second we can cast for the object we're baking."""
+
+        points = self.points_to_bake
+        samples = self.sample_distribution[:self.get_pass_size()]
+
+        indices = np.random.RandomState(self.options.seed).randint(0, len(points), 64)
+
+        if self.engine != None:
+            positions, normals = self.world_positions[indices], self.world_normals[indices]
+            directions = np.array(samples)
+
+            # Kernel backends might compile themselves the first time they're used; that shouldn't count.
+            self.engine.compute(positions[:1], normals[:1], directions)
+
+        sample_count = 0
+        start_time = time.time()
+
+        while True:
+            if self.engine != None:
+                self.engine.compute(positions, normals, directions)
+
+                sample_count += len(indices) * len(samples)
+
+            else:
+                for index in indices:
+                    self.calculate_vertex_ao(mathutils.Vector(points.positions[index]), mathutils.Vector(points.normals[index]), samples)
+
+                    sample_count += len(samples)
+
+            elapsed = time.time() - start_time
+
+            if elapsed >= BakeAO.calibration_time:
+                return sample_count / elapsed
+
+    def get_receiver_time(self):
+        """Returns how long the object we're baking can take, given how much of the time budget is left."""
+
+        weights = self.receiver_weights
+        receiver_index = self.bake_receive_objects.index(self.active_object)
+
+        # Everything we haven't baked yet, including every receiver on the frames after this one.
+        remaining_weight = weights[receiver_index:].sum() + (weights.sum() * (len(self.frames) - self.frame_index - 1))
+
+        return self.get_time_left() * (weights[receiver_index] / max(1e-9, remaining_weight))
+
+    def start_passes(self):
+        """Works out how many samples the object we're baking gets, and starts the first ray casting pass."""
+
+        points = self.points_to_bake
+
+        self.planned_samples = len(self.sample_distribution)
+        self.receiver_deadline = None
+
+        if self.is_time_budget() and len(points):
+            if self.sample_rate == None:
+                self.sample_rate = self.calibrate()
+
+                print("Calibrated at {:,.0f} samples per second".format(self.sample_rate))
+
+            receiver_time = self.get_receiver_time()
+
+            self.planned_samples = int(min(len(self.sample_distribution), max(1, (self.sample_rate * receiver_time) / len(points))))
+            self.receiver_deadline = time.time() + receiver_time
+
+            print("Budgeting {:.1f} seconds for '{}': up to {} samples per point".format(receiver_time, self.active_object.name, self.planned_samples))
+
+        self.completed_samples = 0
+        self.ao_sum = np.zeros(len(points), dtype=np.float64)
+        self.receiver_start_time = time.time()
+
+        self.start_pass()
+
+    def start_pass(self):
+        start = self.completed_samples
+
+        self.pass_samples = self.sample_distribution[start:min(self.planned_samples, start + self.get_pass_size())]
+        self.pass_directions = np.array(self.pass_samples, dtype=np.float64).reshape((-1, 3))
+
+        self.ao_data[:] = 0
+        self.last_point_index = 0
+
+    def start_next_pass(self):
+        """Adds the pass we just finished to the running totals. Returns `True` if another pass was started."""
+
+        # Vectorized engines other than ray casting only ever take one pass.
+        if self.options.engine != "raycast":
+            return False
+
+        self.ao_sum += self.ao_data * len(self.pass_samples)
+        self.completed_samples += len(self.pass_samples)
+
+        if self.completed_samples >= self.planned_samples or self.is_out_of_time():
+            return False
+
+        if self.is_progressive():
+            self.write_preview()
+
+        self.start_pass()
+
+        return True
+
+    def write_preview(self):
+        """Writes the passes finished so far out for the object we're baking, without finishing it."""
+
+        options = self.options
+
+        # Cached arrays are only read once the bake is done.
+        if options.bake_animation and options.animation_output == "cache":
+            return
+
+        points, ao_data = self.points_to_bake, self.ao_data
+
+        self.ao_data = (self.ao_sum / self.completed_samples).astype(np.float32)
+
+        if self.symmetry != None:
+            self.points_to_bake, self.ao_data = self.symmetry[0], self.expand_symmetry(self.ao_data)
+
+        try:
+            self.write_results()
+        finally:
+            self.points_to_bake, self.ao_data = points, ao_data
+
+        # Otherwise, the viewport doesn't notice the new colors until something else changes.
+        self.active_mesh.update()
+
+        print("Wrote '{}' with {} samples per point".format(self.active_object.name, self.completed_samples))
+
+    def stop_early(self):
+        """
+Stops a progressive bake, keeping the passes finished so far on the object we're baking (everything before it is
+already done.) Returns `True` if there was anything to keep.
+"""
+
+        self.stop_worker()
+
+        if not self.is_progressive() or self.ao_data is None or self.completed_samples == 0:
+            return False
+
+        self.finish_passes()
+        self.finish_object()
+
+        return True
+
+    def is_out_of_time(self):
+        """Returns `True` if the object we're baking has used up its share of the time budget."""
+
+        # Every point gets at least one finished pass, even if that runs over.
+        if self.receiver_deadline == None or self.completed_samples == 0:
+            return False
+
+        return time.time() >= self.receiver_deadline
+
+    def finish_passes(self):
+        """Turns the finished passes into `self.ao_data`. Anything from a pass cut short by the deadline is dropped."""
+
+        if self.completed_samples > 0:
+            self.ao_data = (self.ao_sum / self.completed_samples).astype(np.float32)
+
+            # The more we actually get done, the better the next object's budget will be.
+            if self.is_time_budget():
+                elapsed = time.time() - self.receiver_start_time
+
+                sample_count = self.completed_samples * len(self.points_to_bake)
+
+                # A pass the deadline cut short still did work.
+                if self.last_point_index < len(self.points_to_bake):
+                    sample_count += self.last_point_index * len(self.pass_samples)
+
+                if elapsed > BakeAO.calibration_time:
+                    self.sample_rate = sample_count / elapsed
+
+                print("Baked '{}' with {} samples per point".format(self.active_object.name, self.completed_samples))
+
+        self.last_point_index = len(self.points_to_bake)
+        self.passes_finished = True
+
+    def start_object(self, obj):
+
+        options = self.options
+        context = self.context
+
+        depsgraph = context.evaluated_depsgraph_get()
+
+        # The object to bake.
+        self.active_object = obj
+        self.active_mesh = self.active_object.data
+
+        print("Updating BVH trees...")
+
+        # Objects (and instances) that we'll check AO on. Unchanged trees are reused from earlier receivers or frames.
+        self.bake_cast_objects = BakeAO.get_cast_instances(context, options, depsgraph, self.caster_cache)
+
+        print("{} object(s) and instance(s) contributing to bake of '{}'".format(len(self.bake_cast_objects), self.active_object.name))
+
+        # Finally, get all the BVH tree objects from each instance.
+        self.bake_object_cache = [(instance.object, instance.caster.bvh, instance.matrix_inverse, instance.matrix_inverse_3x3) for instance in self.bake_cast_objects]
+
+        print("BVH trees: {} built, {} refit, {} reused".format(self.caster_cache.built_count, self.caster_cache.refit_count, self.caster_cache.reused_count))
 
         self.last_point_index = 0
 
+        self.completed_samples = 0
+        self.passes_finished = False
+
+        self.symmetry = None
+
+        self.neighborhood_signature = None
+
+        receiver = self.caster_cache.get_instance(obj, depsgraph)
+
+        if options.bake_animation or self.checkpoint != None:
+            self.neighborhood_signature = self.get_neighborhood_signature(receiver, self.bake_cast_objects)
+
+        if options.bake_animation:
+            previous = self.previous_results.get(obj.name)
+
+            # Nothing near this object changed since the last frame, so the results can't have either.
+            if previous != None and previous[0] == self.neighborhood_signature:
+                print("Nothing near '{}' changed since the last frame; reusing its results".format(obj.name))
+
+                self.points_to_bake = previous[1]
+                self.ao_data = previous[2].copy()
+                self.last_point_index = len(self.points_to_bake)
+
+                return False
+
+        # Make sure to set our seed here, too.
+        np.random.seed(self.options.seed)
+
+        print("Finding all points to be baked...")
+
+        self.points_to_bake = self.get_bake_points(obj, depsgraph)
+
+        # Everything else on the object is left alone.
+        if len(self.points_to_bake) == 0:
+            print("Nothing to bake on '{}'".format(obj.name))
+
+            self.ao_data = np.zeros(0, dtype=np.float32)
+
+            return False
+
+        # Loops are in polygon order, which jumps all over the mesh on imported (or boolean'd) meshes. Baking nearby points
+        # one after another means consecutive rays walk the same parts of the casters' trees. Every point keeps its loop
+        # index, so the results still land in the right place.
+        self.points_to_bake = self.points_to_bake.subset(engines.get_morton_order(self.points_to_bake.positions, self.points_to_bake.normals))
+
+        if options.use_symmetry and len(self.points_to_bake):
+            symmetry = self.get_symmetry(receiver, self.points_to_bake)
+
+            if symmetry != None:
+                self.symmetry = (self.points_to_bake,) + symmetry
+                self.points_to_bake = self.points_to_bake.subset(symmetry[0])
+
+                print("'{}' is symmetric; baking {} of {} points".format(obj.name, len(self.points_to_bake), len(self.symmetry[0])))
+
+        self.ao_data = np.zeros(len(self.points_to_bake), dtype=np.float32)
+
+        self.engine = None
+
+        saved = None
+
+        if self.checkpoint != None:
+            saved = self.checkpoint.load(self.get_checkpoint_key(), self.get_checkpoint_signature())
+
+            if saved != None and len(saved[0]) != len(self.points_to_bake):
+                saved = None
+
+            # Nothing left to do, so don't bother setting up an engine.
+            if saved != None and saved[1] >= len(self.points_to_bake):
+                print("'{}' was already baked; using the results from the checkpoint".format(obj.name))
+
+                self.ao_data[:] = saved[0]
+                self.last_point_index = saved[1]
+
+                return False
+
+        if options.engine == "voxel":
+            self.engine = self.create_voxel_engine(receiver)
+        elif options.engine == "disks":
+            self.engine = self.create_disk_engine(receiver)
+        elif options.kernel_backend != "blender":
+            self.engine = self.create_ray_cast_engine(receiver)
+
+        if self.engine != None:
+            self.world_positions, self.world_normals = self.points_to_bake.to_world(obj.matrix_world)
+
+        if options.engine == "raycast":
+            self.start_passes()
+
+        if saved != None:
+            self.ao_data[:] = saved[0]
+            self.last_point_index = saved[1]
+
+            print("Resuming '{}' from the checkpoint ({}/{} points already baked)".format(obj.name, self.last_point_index, len(self.points_to_bake)))
+
         return False
 
     # If possible, switch to baking the next object; returns `True` if no next object exists.
@@ -562,61 +1761,951 @@ determined by `self.options.sample_count`.
         new_index = self.bake_receive_objects.index(self.active_object) + 1
 
         if new_index >= len(self.bake_receive_objects):
-            return True
+            if self.frame_index + 1 >= len(self.frames):
+                return True
+
+            return self.start_frame(self.frame_index + 1)
 
         return self.start_object(self.bake_receive_objects[new_index])
 
-    def bake(self, vertices=-1):
-        """Bakes `vertices` number of vertices. If `vertices` is negative, bakes to completion. This function should be called until it returns `True`."""
+    def compute_points(self, start, end):
+        """Returns the results of the current pass for points `start` to `end`, from the vectorized engine."""
+
+        if self.options.engine == "raycast":
+            return self.engine.compute(self.world_positions[start:end], self.world_normals[start:end], self.pass_directions)
+
+        return self.engine.compute(self.world_positions[start:end], self.world_normals[start:end])
+
+    def bake(self, vertices=-1, background=False):
+        """
+Bakes `vertices` number of vertices. If `vertices` is negative, bakes to completion. This function should be called
+until it returns `True`. With `background`, engines that can bake in the background (see `can_bake_in_background()`)
+run on a worker thread, and this just checks in on it.
+"""
 
         options = self.options
         context = self.context
         mesh = self.active_mesh
 
+        points = self.points_to_bake
+
+        if background and vertices >= 0 and self.can_bake_in_background():
+            if not self.bake_in_background(vertices):
+                return False
+
+            return self.finish_baking_object()
+
         i = 0
 
-        while self.last_point_index < len(self.points_to_bake):
+        while self.last_point_index < len(points):
+
+            if vertices >= 0 and i > vertices:
+                return False
+
+            # Out of time; whatever's in the unfinished pass gets dropped, so every point has the same sample count.
+            if self.is_out_of_time():
+                print("Ran out of time on '{}' after {} samples per point".format(self.active_object.name, self.completed_samples))
+                break
+
+            start = self.last_point_index
+
+            if self.engine == None:
+                self.ao_data[start] = self.calculate_vertex_ao(mathutils.Vector(points.positions[start]), mathutils.Vector(points.normals[start]), self.pass_samples)
 
-            point = self.points_to_bake[self.last_point_index]
+                end = start + 1
+
+            else:
+                # Vectorized engines do a whole chunk at once.
+                end = len(points) if vertices < 0 else min(len(points), start + max(1, int(vertices)))
+
+                self.ao_data[start:end] = self.compute_points(start, end)
+
+            self.last_point_index = end
+            i += end - start
+
+            if self.checkpoint != None and time.time() - self.last_checkpoint_time > self.options.checkpoint_interval:
+                self.save_checkpoint()
+
+            if self.last_point_index >= len(points):
+                self.start_next_pass()
+
+        return self.finish_baking_object()
+
+    def finish_baking_object(self):
+        """Finishes the object we're baking and moves on to the next one. Returns `True` if that was the last one."""
+
+        self.finish_passes()
+        self.finish_object()
+
+        self.last_point_index = 0
+
+        return self.start_next_object()
+
+    def can_bake_in_background(self):
+        """
+Returns `True` if the engine lets go of the GIL while it works, so running it on a worker thread keeps Blender
+responsive. That's only ray casting with the Numba backend: the NumPy backend, Voxel Cones and Disks spend most of
+their time in Python loops, so they're done in chunks between updates instead.
+"""
+
+        return isinstance(self.engine, kernels.RayCastEngine) and self.engine.backend.releases_gil
+
+    def bake_in_background(self, chunk_size):
+        """
+Keeps a worker thread running the engine over the current pass, starting a new one for each pass. Everything else
+(passes, checkpoints, and writing results) stays on this thread. Returns `True` once every pass is done.
+"""
+
+        points = self.points_to_bake
+
+        while True:
+            worker = self.worker
+
+            if worker == None:
+                if self.last_point_index >= len(points) or self.is_out_of_time():
+                    return True
+
+                self.engine.backend.prepare()
+
+                # The engine's arrays are all made before this, and nothing else touches `ao_data` until it's done.
+                worker = engines.ComputeThread(self.compute_points, self.ao_data, self.last_point_index, len(points), chunk_size)
+                worker.start()
+
+                self.worker = worker
+
+            self.last_point_index = worker.position
+
+            if worker.error != None:
+                self.worker = None
+
+                raise BakeError("Baking '{}' failed: {}".format(self.active_object.name, worker.error))
+
+            # Out of time; whatever's in the unfinished pass gets dropped, so every point has the same sample count.
+            if self.is_out_of_time():
+                self.stop_worker()
+
+                print("Ran out of time on '{}' after {} samples per point".format(self.active_object.name, self.completed_samples))
+                return True
+
+            if worker.is_running():
+                if self.checkpoint != None and time.time() - self.last_checkpoint_time > self.options.checkpoint_interval:
+                    self.save_checkpoint()
+
+                return False
+
+            self.worker = None
+
+            # On to the next pass right away; otherwise, this object is done.
+            if not self.start_next_pass():
+                return True
+
+    def stop_worker(self):
+        """Stops the worker thread, if there is one, keeping everything it finished."""
+
+        if self.worker == None:
+            return
+
+        self.worker.cancel()
+
+        self.last_point_index = self.worker.position
+
+        self.worker = None
+
+    def detect_symmetry_axis(self, points):
+        """Returns the object-space axis (0-2) `points` are most symmetric across, or `None` if there isn't one."""
+
+        sample = np.random.RandomState(self.options.seed).choice(len(points), min(len(points), 256), replace=False)
+
+        best_axis = None
+
+        # Almost everything has to have a mirror image; a few points along a seam can be missing one.
+        best_fraction = 0.9
+
+        for axis in range(3):
+            fraction = np.mean(engines.get_mirror_points(points.positions, points.normals, points.vertex_indices, axis, self.options.symmetry_tolerance, sample) >= 0)
+
+            if fraction > best_fraction:
+                best_axis = axis
+                best_fraction = fraction
+
+        return best_axis
+
+    def casters_are_symmetric(self, receiver, reflection):
+        """
+Returns `True` if every caster vertex near `receiver` (a `CasterInstance`) has a caster surface at its mirror image
+under `reflection` (a world-space `mathutils.Matrix`.)
+"""
+
+        margin = self.options.max_distance
+        tolerance = self.options.symmetry_tolerance
+
+        # Mirror images can land a little outside the bake region, so the surfaces come from a bit further out.
+        instances = [instance for instance in self.bake_cast_objects if CasterCache.bounds_overlap(receiver.bounds, instance.bounds, margin * 2)]
+
+        if len(instances) == 0:
+            return True
+
+        vertices = []
+
+        for instance in instances:
+            matrix = np.array(instance.matrix, dtype=np.float64)
+
+            # Loose vertices don't cast anything.
+            coords = instance.caster.coords[np.unique(instance.caster.triangles)]
+
+            vertices.append((coords @ matrix[:3, :3].T) + matrix[:3, 3])
+
+        vertices = np.concatenate(vertices)
+
+        # Only vertices close enough to cast onto the receiver matter.
+        inside = np.all((vertices >= np.array(receiver.bounds[0]) - margin) & (vertices <= np.array(receiver.bounds[1]) + margin), axis=1)
+
+        reflection = np.array(reflection, dtype=np.float64)
+
+        mirrored = (vertices[inside] @ reflection[:3, :3].T) + reflection[:3, 3]
+
+        # Symmetric geometry almost always has a vertex at every vertex's mirror image, and those are all found at once.
+        found = np.zeros(len(mirrored), dtype=bool)
+        found[engines.get_nearby_pairs(vertices, mirrored, tolerance)[0]] = True
+
+        # Anything else (a differently split face, say) has to land on a surface; the casters' own trees can tell.
+        for position in mirrored[~found]:
+            position = mathutils.Vector(position)
+
+            if not any(self.is_on_surface(instance, position, tolerance) for instance in instances):
+                return False
+
+        return True
+
+    @classmethod
+    def is_on_surface(cls, instance, position, tolerance):
+        """Returns `True` if `position` (world space) is within `tolerance` of the surface of `instance` (a `CasterInstance`.)"""
+
+        if not CasterCache.bounds_overlap(instance.bounds, (position, position), tolerance):
+            return False
+
+        location = instance.caster.bvh.find_nearest(instance.matrix_inverse @ position)[0]
+
+        return location != None and ((instance.matrix @ location) - position).length <= tolerance
+
+    def get_symmetry(self, receiver, points):
+        """
+If the object we're baking is mirror-symmetric and so is everything close enough to cast onto it, returns
+`(baked indices, mirrored indices, mirror)`: only the points at `baked indices` need baking, and the points at
+`mirrored indices` copy the result from `mirror[mirrored indices]`. Points without a mirror image are baked as usual.
+Returns `None` if there's no symmetry to take advantage of.
+"""
+
+        options = self.options
+        obj = self.active_object
+
+        if options.symmetry_axis == "auto":
+            axis = self.detect_symmetry_axis(points)
+
+            if axis == None:
+                print("'{}' isn't symmetric; baking every point".format(obj.name))
+                return None
+
+        else:
+            axis = "xyz".index(options.symmetry_axis)
+
+        # The object-space mirror, in world space.
+        reflection = mathutils.Matrix.Identity(4)
+        reflection[axis][axis] = -1
+
+        try:
+            reflection = obj.matrix_world @ reflection @ obj.matrix_world.inverted()
+        except ValueError:
+            return None
+
+        # Shear (or rotated non-uniform scale) means the two halves don't see the same world.
+        reflection_3x3 = np.array(reflection.to_3x3())
+
+        if not np.allclose(reflection_3x3 @ reflection_3x3.T, np.identity(3), atol=1e-4):
+            print("'{}' is skewed across its symmetry plane; baking every point".format(obj.name))
+            return None
+
+        if not self.casters_are_symmetric(receiver, reflection):
+            print("The surroundings of '{}' aren't symmetric; baking every point".format(obj.name))
+            return None
+
+        mirror = engines.get_mirror_points(points.positions, points.normals, points.vertex_indices, axis, options.symmetry_tolerance)
+
+        # Points on the negative side copy from their mirror images, as long as those are on the positive side.
+        sides = points.positions[:, axis]
+
+        mirrored = (sides < 0) & (mirror >= 0)
+        mirrored[mirrored] = sides[mirror[mirrored]] >= 0
+
+        return np.nonzero(~mirrored)[0], np.nonzero(mirrored)[0], mirror
+
+    def expand_symmetry(self, ao_data):
+        """Returns the results for every point, given `ao_data` for the half of the object we baked."""
+
+        points, baked_indices, mirrored_indices, mirror = self.symmetry
+
+        ao = np.zeros(len(points), dtype=np.float32)
+
+        ao[baked_indices] = ao_data
+        ao[mirrored_indices] = ao[mirror[mirrored_indices]]
+
+        return ao
+
+    def apply_symmetry(self):
+        """Copies the results from the half of the object we baked onto the other half."""
+
+        self.ao_data = self.expand_symmetry(self.ao_data)
+        self.points_to_bake = self.symmetry[0]
+
+        self.symmetry = None
+
+    def denoise(self):
+        """Smooths `self.ao_data` over the mesh, keeping hard edges sharp."""
+
+        mesh = self.active_mesh
+        points = self.points_to_bake
+
+        loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vertices)
+
+        loop_starts = np.empty(len(mesh.polygons), dtype=np.int32)
+        loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+
+        mesh.polygons.foreach_get("loop_start", loop_starts)
+        mesh.polygons.foreach_get("loop_total", loop_totals)
+
+        a, b = engines.get_mesh_edges(loop_vertices, loop_starts, loop_totals)
+
+        # Edges are between loops; we need them between points.
+        point_of_loop = np.full(len(mesh.loops), -1, dtype=np.int64)
+        point_of_loop[points.loop_indices] = np.arange(len(points))
+
+        a = point_of_loop[a]
+        b = point_of_loop[b]
+
+        keep = (a >= 0) & (b >= 0)
+
+        return engines.denoise(self.ao_data, points.positions, points.normals, (a[keep], b[keep]), self.options.denoise_strength, self.options.denoise_iterations)
+
+    def get_checkpoint_key(self):
+        return "{}:{}".format(self.frames[self.frame_index], self.active_object.name)
+
+    def get_checkpoint_signature(self):
+        signature = repr(self.neighborhood_signature).encode("utf-8")
+
+        # A different mask bakes different points, even if it happens to be the same number of them.
+        if self.options.bake_mask != "all":
+            signature += np.ascontiguousarray(self.points_to_bake.loop_indices).tobytes()
+
+        return get_hash(signature)
+
+    def save_checkpoint(self):
+        """Saves the results so far for the object we're baking. Returns `True` if anything was saved."""
+
+        if self.checkpoint == None or self.ao_data is None or len(self.ao_data) == 0:
+            return False
+
+        # Halfway through, a time budget bake is a mix of passes; only finished objects are worth keeping.
+        if self.is_time_budget() and not self.passes_finished:
+            return False
+
+        # A progressive bake stopped early has fewer samples than were asked for, so it can't be resumed from.
+        if self.is_progressive() and (not self.passes_finished or self.completed_samples < self.planned_samples):
+            return False
+
+        self.checkpoint.save(self.get_checkpoint_key(), self.get_checkpoint_signature(), self.ao_data, self.last_point_index)
+
+        self.last_checkpoint_time = time.time()
+
+        return True
+
+    def finish_object(self):
+        options = self.options
+        context = self.context
+
+        # The mask left nothing to bake, so the object is left exactly as it was: no layers or groups, and no checkpoint.
+        if len(self.points_to_bake) == 0:
+            self.ao_data = None
+            self.engine = None
+
+            return
+
+        self.save_checkpoint()
+
+        # Checkpoints only have the half we baked; everything after this needs every point.
+        if self.symmetry != None:
+            self.apply_symmetry()
+
+        if options.bake_animation:
+            self.previous_results[self.active_object.name] = (self.neighborhood_signature, self.points_to_bake, self.ao_data.copy())
+
+        # Checkpoints and previous frames keep the raw results; only what's written out is denoised.
+        if options.denoise:
+            print("Denoising ambient occlusion on '{}'...".format(self.active_object.name))
+
+            self.ao_data = self.denoise()
+
+        self.write_results()
+
+        self.ao_data = None
+        self.engine = None
+
+        print("Bake completed on '{}'".format(self.active_object.name))
+
+    def write_results(self):
+        """Writes `self.ao_data` out to the color layer and vertex group, or the cached arrays."""
+
+        options = self.options
+
+        if options.bake_animation and options.animation_output == "cache":
+            filename = self.apply_cache_arrays()
+
+            print("Saved ambient occlusion to '{}'".format(filename))
+
+        else:
+            if options.bake_to_color:
+                print("Applying ambient occlusion to vertex color layer '{}'".format(self.get_target_name(options.color_layer_name)))
+
+                self.apply_vertex_colors()
+
+            if options.bake_to_group:
+                print("Applying ambient occlusion to vertex group layer '{}'".format(self.get_target_name(options.group_name)))
+
+                self.apply_vertex_groups()
+
+    def get_snapshot_data(self):
+        """
+Returns the current frame's options, casters, instances, receivers and sample directions, in the form
+`snapshot.write_snapshot()` takes them.
+"""
+
+        options = self.options
+        context = self.context
+
+        depsgraph = context.evaluated_depsgraph_get()
+
+        self.create_sample_distribution(options.sample_count)
+
+        self.bake_receive_objects = BakeAO.get_bake_objects(context, options.bake_receive_objects, True)
+
+        # Every caster goes in; the engine picks out the ones near each receiver itself.
+        self.bake_cast_objects = BakeAO.get_cast_instances(context, options, depsgraph, self.caster_cache)
+
+        casters = []
+        instances = []
+
+        # Instances of the same geometry share a single copy of it.
+        caster_indices = {}
+
+        for instance in self.bake_cast_objects:
+            caster = instance.caster
+
+            if id(caster) not in caster_indices:
+                caster_indices[id(caster)] = len(casters)
+                casters.append((caster.coords, caster.triangles))
+
+            instances.append((caster_indices[id(caster)], [list(row) for row in instance.matrix]))
+
+        receivers = []
+
+        for obj in self.bake_receive_objects:
+            points = self.get_bake_points(obj, depsgraph)
+
+            receivers.append({
+                "name": obj.name,
+                "loop_count": len(obj.data.loops),
+                "positions": points.positions,
+                "normals": points.normals,
+                "vertex_indices": points.vertex_indices,
+                "loop_indices": points.loop_indices,
+                "matrix": [list(row) for row in obj.matrix_world],
+            })
+
+        # Sets don't survive JSON.
+        snapshot_options = {key: (sorted(value) if isinstance(value, set) else value) for key, value in options.options.items()}
+
+        directions = np.array(self.sample_distribution, dtype=np.float64).reshape((-1, 3))
+
+        print("Exporting {} receiver(s), and {} instance(s) of {} caster(s)".format(len(receivers), len(instances), len(casters)))
+
+        return snapshot_options, casters, instances, receivers, directions
+
+    def export_job(self, directory):
+        """
+Writes everything needed to bake the current frame to a job directory (see `jobs`), instead of baking it here.
+Returns the number of work units.
+"""
+
+        print("Exporting bake job to '{}'...".format(directory))
+
+        job = jobs.write_job(directory, *self.get_snapshot_data())
+
+        print("Exported {} work unit(s)".format(len(job["units"])))
+
+        return len(job["units"])
+
+    def export_snapshot(self, path):
+        """Writes everything needed to bake the current frame to a scene snapshot (see `snapshot`), instead of baking it here."""
+
+        print("Exporting scene snapshot to '{}'...".format(path))
+
+        directory = os.path.dirname(path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        snapshot.write_snapshot(path, *self.get_snapshot_data())
+
+    @classmethod
+    def create_import(cls, context, snapshot_options):
+        """Returns a `BakeAO` that writes imported results back with the options they were exported with."""
+
+        options = BakeOptionsAO()
+        options.options = dict(snapshot_options)
+
+        options.options["color_channels"] = set(options.options["color_channels"])
+
+        # Exports are a single frame.
+        options.options["bake_animation"] = False
+
+        bake = BakeAO(options, context)
+        bake.frames = [context.scene.frame_current]
+
+        return bake
+
+    def import_object(self, name, loop_count, get_results):
+        """
+Writes results for the object called `name` through the usual write-back. `get_results(obj)` returns its
+`(BakePoints, ao_data)`. Returns the object, or `None` if it's gone or its mesh changed since it was exported.
+"""
+
+        obj = self.context.scene.objects.get(name)
+
+        if obj == None or obj.type != "MESH" or len(obj.data.loops) != loop_count:
+            print("'{}' is missing or its mesh changed since it was exported; skipping it".format(name))
+            return None
+
+        self.active_object = obj
+        self.active_mesh = obj.data
+
+        self.points_to_bake, self.ao_data = get_results(obj)
+
+        self.finish_object()
+
+        return obj
+
+    @classmethod
+    def import_job(cls, context, directory):
+        """Applies the results of a finished job (see `jobs`) through the usual write-back. Returns the objects baked."""
+
+        job = jobs.read_job(directory)
+
+        missing = jobs.get_missing_units(directory, job)
+
+        if len(missing):
+            raise BakeError("{} of {} work unit(s) haven't been baked yet".format(len(missing), len(job["units"])))
+
+        scene = jobs.open_snapshot(directory)
+
+        bake = BakeAO.create_import(context, scene.options)
+
+        baked = []
+
+        for receiver_index, entry in enumerate(scene.receivers):
+            def get_results(obj):
+                receiver = scene.get_receiver(receiver_index)
+
+                points = BakePoints(np.array(receiver["positions"]), np.array(receiver["normals"]), np.array(receiver["vertex_indices"]), np.array(receiver["loop_indices"]))
+
+                return points, jobs.read_results(directory, job, receiver_index)
+
+            obj = bake.import_object(entry["name"], entry["loop_count"], get_results)
+
+            if obj != None:
+                baked.append(obj)
+
+        return baked
+
+    @classmethod
+    def import_snapshot_results(cls, context, path):
+        """Applies the per-loop arrays a snapshot was baked to (see `snapshot.main()`.) Returns the objects baked."""
+
+        try:
+            data = np.load(path)
+        except (OSError, ValueError):
+            raise BakeError("Can't read the baked snapshot '{}'".format(path))
+
+        with data:
+            if "options" not in data.files or "names" not in data.files:
+                raise BakeError("'{}' isn't a baked Vertex Oven snapshot".format(path))
+
+            bake = BakeAO.create_import(context, json.loads(str(data["options"])))
+
+            baked = []
+
+            for receiver_index, name in enumerate(data["names"].tolist()):
+                loop_ao = data["receiver_{}".format(receiver_index)]
+
+                def get_results(obj):
+                    # Loops that weren't baked (by a masked bake) are NaN; everything else is left alone.
+                    indices = np.nonzero(np.isfinite(loop_ao))[0]
+
+                    return BakeAO.get_points(obj.data).subset(indices), loop_ao[indices]
+
+                obj = bake.import_object(name, len(loop_ao), get_results)
+
+                if obj != None:
+                    baked.append(obj)
+
+        return baked
+
+    def finish(self):
+        end_time = time.time()
+
+        elapsed = end_time - self.start_time
+
+        self.restore_frame()
+
+        # The bake finished, so there's nothing left to resume.
+        if self.checkpoint != None:
+            self.checkpoint.remove()
+
+        print("Completed bake in {:.2f} seconds".format(elapsed))
+
+# Casters for `bake_ao()`; kept between calls, so asking again about unchanged objects doesn't rebuild anything.
+class BakeAOCasters:
+    """
+The casters `bake_ao()` was last called with. Reading and hashing every caster's mesh (and moving its triangles into
+world space) costs far more than casting rays from a few thousand points, so it's only done again once something in
+the scene has changed, or different objects are asked for.
+"""
+
+    def __init__(self):
+        self.caster_cache = CasterCache()
+
+        # The object names and depsgraph the casters below are for, or `None` if the scene changed since.
+        self.key = None
+
+        # `CasterInstance`s for the objects, and everything they instance.
+        self.instances = []
+
+        # Changes whenever any of the instances' geometry or transforms do.
+        self.signature = None
+
+        # Every instance's triangles in world space (T×3×3), once something asked for them.
+        self.triangles = None
+
+    def invalidate(self):
+        self.key = None
+
+    def clear(self):
+        """Forgets every tree; none of them are any use once another file is loaded."""
+
+        self.caster_cache = CasterCache()
+
+        self.key = None
+        self.instances = []
+        self.signature = None
+        self.triangles = None
+
+    def update(self, objects, depsgraph):
+        """Makes sure the instances are the ones for `objects` (original objects) in `depsgraph`."""
+
+        key = (tuple(obj.name for obj in objects), depsgraph.as_pointer())
+
+        if key == self.key:
+            return
+
+        # Geometry that didn't change keeps its tree.
+        self.caster_cache.new_frame()
+
+        names = set(key[0])
+
+        self.instances = []
+
+        # The same as `BakeAO.get_cast_instances()`, so collection instances, instanced empties and geometry node
+        # instances cast occlusion too.
+        for object_instance in depsgraph.object_instances:
+            obj_eval = object_instance.object
+
+            if obj_eval.type != "MESH":
+                continue
+
+            if object_instance.is_instance:
+                source = object_instance.parent.original
+            else:
+                source = obj_eval.original
+
+            if source.name not in names:
+                continue
+
+            # Instance objects are only valid while we're iterating, so the geometry has to be read right now.
+            self.instances.append(CasterInstance(self.caster_cache.update(obj_eval), object_instance.matrix_world.copy()))
+
+        self.signature = tuple(instance.signature for instance in self.instances)
+        self.triangles = None
+
+        self.key = key
+
+    def get_triangles(self):
+        if self.triangles is None:
+            if len(self.instances):
+                self.triangles = np.concatenate([instance.get_world_triangles() for instance in self.instances])
+            else:
+                self.triangles = np.zeros((0, 3, 3))
+
+        return self.triangles
+
+bake_ao_casters = BakeAOCasters()
+
+@persistent
+def invalidate_bake_ao_casters(*args):
+    bake_ao_casters.invalidate()
+
+def cast_rays_with_trees(positions, normals, trees, max_distance=3.0, power=0.5, sample_count=32, seed=0, engine="raycast", kernel_backend="auto", voxel_resolution=32, disk_accuracy=2.0):
+    """
+The "blender" kernel backend for `bake_ao()`: casts rays from each of `positions` (N×3) with `normals` (N×3) against
+`trees` (`[(BVHTree, matrix_inverse, matrix_inverse_3x3)]`) one ray at a time, just like the bake dialog does.
+"""
+
+    positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+    normals = engines.normalize(np.asarray(normals, dtype=np.float64).reshape((-1, 3)))
+
+    if len(positions) != len(normals):
+        raise ValueError("There are {} positions but {} normals".format(len(positions), len(normals)))
+
+    directions = [mathutils.Vector(direction) for direction in api.get_sample_directions(sample_count, seed)]
+
+    ao = np.zeros(len(positions), dtype=np.float32)
+
+    distances = np.empty(len(directions), dtype=np.float64)
+
+    for i in range(len(positions)):
+        normal = mathutils.Vector(normals[i])
+
+        # Start just off the surface, so the point's own face doesn't occlude it.
+        position = mathutils.Vector(positions[i]) + (normal * 0.00005)
+
+        for j, direction in enumerate(directions):
+            # Make sure the samples are in a hemisphere.
+            if direction.dot(normal) < 0:
+                direction = direction.reflect(normal)
+
+            distance = max_distance
+
+            for bvh, matrix_inverse, matrix_inverse_3x3 in trees:
+                hit = bvh.ray_cast(matrix_inverse @ position, matrix_inverse_3x3 @ direction, max_distance)
+
+                if hit[0] != None:
+                    distance = min(distance, hit[3])
+
+            distances[j] = distance
+
+        ao[i] = engines.occlusion_from_distance(distances, max_distance, power).mean()
+
+    return ao
+
+def bake_ao(positions, normals, objects=None, triangles=None, depsgraph=None, **settings):
+    """
+Returns the ambient occlusion (float32, from 0 for none to 1 for fully occluded) at each of `positions` (N×3) facing
+along `normals` (N×3), both in world space, without touching any mesh. Occlusion is cast by `objects` (with their
+modifiers; collection instances and other instancers cast whatever they instance), `triangles` (T×3×3, world space),
+or both. The rest of the settings are passed on to `api.compute_ao()`; for example,
+`bake_ao(points, normals, objects, max_distance=2.0, sample_count=64)`.
+
+The casters are only read again after the scene changes, so asking about more points only pays for the rays. Like the
+bake dialog, ray casting uses Blender's own BVH trees when Numba isn't installed, since they're faster than the NumPy
+backend; pass `kernel_backend="numpy"` to use that anyway.
+"""
+
+    key = []
+
+    if objects:
+        if depsgraph == None:
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+
+        bake_ao_casters.update(objects, depsgraph)
+
+        key.append(bake_ao_casters.signature)
+
+    if triangles is not None:
+        triangles = np.asarray(triangles, dtype=np.float64).reshape((-1, 3, 3))
+
+        key.append(api.get_triangles_key(triangles))
+
+    instances = bake_ao_casters.instances if objects else []
+
+    if settings.get("engine", "raycast") == "raycast" and BakeAO.get_kernel_backend_name(settings.get("kernel_backend", "auto")) == "blender":
+        positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+
+        trees = []
+
+        if len(positions):
+            max_distance = settings.get("max_distance", 3.0)
+
+            bounds = (positions.min(axis=0), positions.max(axis=0))
+
+            # Only the casters within reach of the points.
+            for instance in instances:
+                if CasterCache.bounds_overlap(bounds, instance.bounds, max_distance):
+                    trees.append((instance.caster.bvh, instance.matrix_inverse, instance.matrix_inverse_3x3))
+
+            if triangles is not None and len(triangles):
+                bvh = api.get_cached(("blender", key[-1]), lambda: BVHTree.FromPolygons(triangles.reshape((-1, 3)).tolist(), np.arange(len(triangles) * 3).reshape((-1, 3)).tolist()))
+
+                trees.append((bvh, mathutils.Matrix.Identity(4), mathutils.Matrix.Identity(3)))
+
+        return cast_rays_with_trees(positions, normals, trees, **settings)
+
+    buffers = []
+
+    if objects:
+        buffers.append(bake_ao_casters.get_triangles())
+
+    if triangles is not None:
+        buffers.append(triangles)
+
+    if len(buffers):
+        triangles = np.concatenate(buffers)
+    else:
+        triangles = np.zeros((0, 3, 3))
+
+    return api.compute_ao(positions, normals, triangles, triangles_key=tuple(key), **settings)
+
+class IndexedObject:
+    """Everything the bake dialog needs to know about one object, so it doesn't have to ask the object again."""
+
+    def __init__(self, obj):
+        self.name = obj.name
+
+        self.is_mesh = obj.type == "MESH"
+
+        self.selected = obj.select_get()
+        self.visible = obj.visible_get()
+
+        self.size = obj.dimensions.length
+
+        self.vertex_count = len(obj.data.vertices) if self.is_mesh else 0
+
+        # The sizes of the mesh instances this object creates (collection instances, geometry node instances, etc.)
+        self.instance_sizes = []
+
+class SceneObjectIndex:
+    """
+A cache of `IndexedObject`s for the whole scene. The bake dialog redraws on every mouse move, and walking every object
+in a large scene each time is far too slow; instead, this is rebuilt the first time it's needed after the depsgraph,
+the selection, the active object or the frame changes.
+"""
+
+    # {object name: IndexedObject}, or `None` if the index needs to be rebuilt.
+    objects = None
+
+    # The name of the scene `objects` was built from.
+    scene_name = None
+
+    @staticmethod
+    def invalidate():
+        SceneObjectIndex.objects = None
+
+    @staticmethod
+    def get(context):
+        """Returns the `{object name: IndexedObject}` dictionary for the current scene, rebuilding it if necessary."""
+
+        if SceneObjectIndex.objects != None and SceneObjectIndex.scene_name == context.scene.name:
+            return SceneObjectIndex.objects
+
+        # This might cause an evaluation (and so invalidate the index); that's fine, since we haven't built it yet.
+        depsgraph = context.evaluated_depsgraph_get()
+
+        objects = {obj.name: IndexedObject(obj) for obj in context.scene.objects}
+
+        for object_instance in depsgraph.object_instances:
+            if not object_instance.is_instance or object_instance.object.type != "MESH":
+                continue
+
+            parent = objects.get(object_instance.parent.original.name)
+
+            if parent == None:
+                continue
+
+            bound_box = [mathutils.Vector(corner) for corner in object_instance.object.bound_box]
+
+            parent.instance_sizes.append(((bound_box[6] - bound_box[0]) * object_instance.matrix_world.to_scale()).length)
+
+        SceneObjectIndex.objects = objects
+        SceneObjectIndex.scene_name = context.scene.name
+
+        return objects
+
+    @staticmethod
+    def get_receive_objects(context, bake_objects):
+        """The same as `BakeAO.get_bake_objects(context, bake_objects, True)`, but returns `IndexedObject`s."""
+
+        objects = SceneObjectIndex.get(context)
+
+        if bake_objects == "active":
+            indexed = [objects.get(context.active_object.name)] if context.active_object else []
+        elif bake_objects == "selected":
+            indexed = [indexed for indexed in objects.values() if indexed.selected]
+        else:
+            indexed = list(objects.values())
 
-            self.ao_data.append(self.calculate_vertex_ao(point.position, point.normal))
+        return [indexed for indexed in indexed if indexed != None and indexed.is_mesh and indexed.visible and indexed.size > 0]
 
-            self.last_point_index += 1
-            i += 1
+    @staticmethod
+    def get_cast_count(context, options):
+        """Returns the number of objects and instances `BakeAO.get_cast_instances()` would return."""
 
-            if i > vertices:
-                return False
+        objects = SceneObjectIndex.get(context)
 
-        self.finish_object()
+        active_name = context.active_object.name if context.active_object else None
 
-        self.last_point_index = 0
+        small_object_size = 0
+        if options.ignore_small_objects:
+            small_object_size = options.small_object_size
 
-        return self.start_next_object()
+        if options.bake_cast_objects == "scene":
+            sources = objects.values()
+        elif options.bake_cast_objects == "selected":
+            sources = [indexed for indexed in objects.values() if indexed.selected]
+        else:
+            sources = [objects[active_name]] if active_name in objects else []
 
-    def finish_object(self):
-        options = self.options
-        context = self.context
+        count = 0
 
-        if options.bake_to_color:
-            print("Applying ambient occlusion to vertex color layer '{}'".format(options.color_layer_name))
+        for indexed in sources:
+            if not indexed.visible:
+                continue
 
-            self.apply_vertex_colors()
+            if indexed.is_mesh and indexed.size > small_object_size and (options.include_self or indexed.name != active_name):
+                count += 1
 
-        if options.bake_to_group:
-            print("Applying ambient occlusion to vertex group layer '{}'".format(options.group_name))
+            count += len([size for size in indexed.instance_sizes if size > small_object_size])
 
-            self.apply_vertex_groups()
+        return count
 
-        self.ao_data = []
+@persistent
+def invalidate_scene_object_index(*args):
+    SceneObjectIndex.invalidate()
 
-        print("Bake completed on '{}'".format(self.active_object.name))
+# The message bus needs an owner to unsubscribe with.
+msgbus_owner = object()
 
-    def finish(self):
-        end_time = time.time()
+def subscribe_to_active_object():
+    bpy.msgbus.subscribe_rna(
+        key=(bpy.types.LayerObjects, "active"),
+        owner=msgbus_owner,
+        args=(),
+        notify=invalidate_scene_object_index
+    )
 
-        elapsed = end_time - self.start_time
+@persistent
+def on_load_post(*args):
+    SceneObjectIndex.invalidate()
+    bake_ao_casters.clear()
 
-        print("Completed bake in {:.2f} seconds".format(elapsed))
+    # Subscriptions are cleared when a file is loaded.
+    subscribe_to_active_object()
 
 class MESH_OT_bake_vertex_ao(bpy.types.Operator):
     bl_idname = "mesh.bake_vertex_ao"
@@ -706,6 +2795,45 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
 
     # Ambient Occlusion Options
 
+    engine: bpy.props.EnumProperty(
+        name="Engine",
+        description="How occlusion is computed",
+        items=[
+            ("raycast", "Ray Cast", "Cast rays against every contributing object. Accurate, but the cost grows with the sample count", "LIGHT_SUN", 0),
+            ("voxel", "Voxel Cones", "Voxelize the contributing objects and march a few wide cones through the grid. Much faster for very large scenes, but coarse", "MESH_GRID", 1),
+            ("disks", "Disks", "Approximate every face of the contributing objects with a disk, and add up how much of each vertex's view they cover. No rays are cast, so dense meshes bake much faster", "MESH_CIRCLE", 2),
+        ],
+        default="raycast"
+    )
+
+    kernel_backend: bpy.props.EnumProperty(
+        name="Backend",
+        description="What casts the rays",
+        items=[
+            ("auto", "Automatic", "Use the JIT-compiled kernel if Numba is installed in Blender's Python, and Blender's BVH trees otherwise", "AUTO", 0),
+            ("blender", "Blender", "Cast rays with Blender's BVH trees, one vertex at a time", "BLENDER", 1),
+            ("numba", "Numba", "Flatten the contributing objects into a single tree, and cast rays with a JIT-compiled kernel on every CPU core, in the background so Blender stays responsive. Numba has to be installed in Blender's Python, and its own threading settings are used; Python API bakes wait while a bake is running", "MEMORY", 2),
+            ("numpy", "NumPy", "Flatten the contributing objects into a single tree, and cast rays in batches with NumPy. Works everywhere, but it's usually slower than Blender's BVH trees", "LINENUMBERS_ON", 3),
+        ],
+        default="auto"
+    )
+
+    voxel_resolution: bpy.props.IntProperty(
+        name="Voxel Resolution",
+        description="The number of voxels across the bake distance. Higher is more detailed, but slower; big receivers are voxelized a piece at a time, so it doesn't depend on their size",
+        min=4,
+        max=64,
+        default=32
+    )
+
+    disk_accuracy: bpy.props.FloatProperty(
+        name="Accuracy",
+        description="Clusters of faces are approximated by a single disk once they're this many times their own size away. Higher is more accurate, but slower",
+        min=1.0,
+        soft_max=8.0,
+        default=2.0
+    )
+
     max_distance: bpy.props.FloatProperty(
         name="Distance",
         description="The maximum distance to cast rays to. Making this smaller will improve performance at the cost of less-accurate occlusion for distant faces",
@@ -731,6 +2859,25 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
         default=32
     )
 
+    sample_mode: bpy.props.EnumProperty(
+        name="Samples",
+        description="How the number of samples per vertex is chosen",
+        items=[
+            ("count", "Sample Count", "Cast a fixed number of samples per vertex", "LINENUMBERS_ON", 0),
+            ("time", "Time Budget", "Measure how fast samples can be cast, then pick the sample count for each object so the bake finishes in time", "TIME", 1),
+            ("progressive", "Progressive", "Write a rough result after a few samples, then keep refining it until the sample count is reached. Cancelling keeps the result so far", "RENDER_ANIMATION", 2),
+        ],
+        default="count"
+    )
+
+    time_budget: bpy.props.FloatProperty(
+        name="Time Budget",
+        description="How long the bake should take. Every vertex gets the same number of samples, however many fit",
+        unit="TIME_ABSOLUTE",
+        min=1.0,
+        default=60.0
+    )
+
     # Jitter is disabled because it's horrifically slow.
     jitter: bpy.props.BoolProperty(
         name="Jitter Samples",
@@ -759,6 +2906,180 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
         default=0.1
     )
 
+    # Animation
+
+    bake_animation: bpy.props.BoolProperty(
+        name="Bake Animation",
+        description="Bake every frame in a frame range. Casting objects that don't change between frames aren't rebuilt, and receiving objects with nothing changing nearby aren't re-baked",
+        default=False
+    )
+
+    use_scene_frame_range: bpy.props.BoolProperty(
+        name="Scene Frame Range",
+        description="Bake the scene's frame range; otherwise, use the start and end frames below",
+        default=True
+    )
+
+    frame_start: bpy.props.IntProperty(
+        name="Start",
+        description="The first frame to bake",
+        default=1
+    )
+
+    frame_end: bpy.props.IntProperty(
+        name="End",
+        description="The last frame to bake",
+        default=250
+    )
+
+    frame_step: bpy.props.IntProperty(
+        name="Step",
+        description="Bake every nth frame",
+        min=1,
+        default=1
+    )
+
+    animation_output: bpy.props.EnumProperty(
+        name="Output",
+        description="Where each frame's ambient occlusion is written",
+        items=[
+            ("layers", "Layer per Frame", "Write each frame to its own vertex color layer and/or vertex group, named with the frame number", "RENDERLAYERS", 0),
+            ("cache", "Cached Arrays", "Save each frame as a per-loop NumPy array (.npy) in the cache directory", "FILE_CACHE", 1),
+        ],
+        default="layers"
+    )
+
+    animation_cache_directory: bpy.props.StringProperty(
+        name="Cache Directory",
+        description="The directory to save per-frame ambient occlusion arrays in",
+        subtype="DIR_PATH",
+        default="//vertex_oven_cache/"
+    )
+
+    # Denoising
+
+    denoise: bpy.props.BoolProperty(
+        name="Denoise",
+        description="Smooth the results across the mesh after baking, so low sample counts still look clean. Hard edges are kept sharp",
+        default=False
+    )
+
+    denoise_strength: bpy.props.FloatProperty(
+        name="Strength",
+        description="How far each pass moves every vertex towards its neighbors",
+        min=0.0,
+        max=1.0,
+        subtype="FACTOR",
+        default=0.5
+    )
+
+    denoise_iterations: bpy.props.IntProperty(
+        name="Passes",
+        description="The number of smoothing passes. More passes smooth over larger areas",
+        min=1,
+        soft_max=32,
+        default=4
+    )
+
+    # Symmetry
+
+    use_symmetry: bpy.props.BoolProperty(
+        name="Symmetry",
+        description="Only bake one half of mirror-symmetric objects, and copy the results to the other half. Objects are only treated as symmetric if everything casting onto them is, too",
+        default=False
+    )
+
+    symmetry_axis: bpy.props.EnumProperty(
+        name="Axis",
+        description="The local axis objects are mirrored along",
+        items=[
+            ("auto", "Auto", "Find the axis each object is symmetric along, if any", 0),
+            ("x", "X", "Mirrored along the local X axis", 1),
+            ("y", "Y", "Mirrored along the local Y axis", 2),
+            ("z", "Z", "Mirrored along the local Z axis", 3),
+        ],
+        default="auto"
+    )
+
+    symmetry_tolerance: bpy.props.FloatProperty(
+        name="Tolerance",
+        description="How far a mirrored vertex can be from its counterpart. Vertices without a counterpart are baked as usual",
+        unit="LENGTH",
+        min=0.0,
+        default=0.001
+    )
+
+    # Masking
+
+    bake_mask: bpy.props.EnumProperty(
+        name="Bake Only",
+        description="Which vertices of the receiving objects to bake. Every other vertex keeps its current color or weight",
+        items=[
+            ("all", "Everything", "Bake every vertex", 0),
+            ("selected", "Selected Vertices", "Only bake the vertices selected in Edit Mode (or with the paint mask)", 1),
+            ("group", "Vertex Group", "Only bake the vertices weighted above a threshold in a vertex group", 2),
+        ],
+        default="all"
+    )
+
+    mask_group_name: bpy.props.StringProperty(
+        name="Mask Group",
+        description="The vertex group holding the vertices to bake",
+        default=""
+    )
+
+    mask_threshold: bpy.props.FloatProperty(
+        name="Above",
+        description="Only bake vertices weighted more than this in the mask group",
+        min=0.0,
+        max=1.0,
+        subtype="FACTOR",
+        default=0.0
+    )
+
+    # Checkpoints
+
+    use_checkpoints: bpy.props.BoolProperty(
+        name="Checkpoints",
+        description="Periodically save progress to a folder next to the .blend file, for long bakes. If a bake is cancelled or Blender crashes, baking again with the same settings picks up where it left off",
+        default=False
+    )
+
+    checkpoint_interval: bpy.props.FloatProperty(
+        name="Every",
+        description="How often to save progress",
+        unit="TIME_ABSOLUTE",
+        min=1.0,
+        default=60.0
+    )
+
+    # Sharded jobs
+
+    bake_location: bpy.props.EnumProperty(
+        name="Bake",
+        description="Where the baking happens",
+        items=[
+            ("here", "Here", "Bake in this Blender session", "BLENDER", 0),
+            ("job", "Export Job", "Export a job that worker processes (on this machine or others) bake in shards; import the results with Vertex Oven > Import Bake Job Results", "NETWORK_DRIVE", 1),
+            ("snapshot", "Export Snapshot", "Export a scene snapshot to bake outside Blender with snapshot.py; import the results with Vertex Oven > Import Baked Snapshot", "FILE", 2),
+        ],
+        default="here"
+    )
+
+    snapshot_path: bpy.props.StringProperty(
+        name="Snapshot",
+        description="The file to export the scene snapshot to",
+        subtype="FILE_PATH",
+        default="//vertex_oven.vosnap"
+    )
+
+    job_directory: bpy.props.StringProperty(
+        name="Job Directory",
+        description="The directory to export the bake job to. Every worker needs to be able to read and write it",
+        subtype="DIR_PATH",
+        default="//vertex_oven_job/"
+    )
+
     # The timer is used to call ourselves while the bake is in-progress.
     _timer = None
 
@@ -772,7 +3093,30 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
     def modal(self, context, event):
 
         if event.type in {"ESC"}:  # Cancel
-            self.report({"INFO"}, "Bake cancelled. No data was written.")
+            # Everything the worker thread finished is kept.
+            if self._bake != None:
+                self._bake.stop_worker()
+
+            # Progressive bakes are good enough whenever the artist says they are.
+            if self._bake != None and self._bake.stop_early():
+                self._bake.restore_frame()
+
+                self.report({"INFO"}, "Bake stopped. The results so far were kept on '{}'.".format(self._bake.active_object.name))
+
+                self.cancel(context)
+
+                return {"FINISHED"}
+
+            saved = self._bake != None and self._bake.save_checkpoint()
+
+            # Objects finished earlier in the bake were saved as they finished.
+            if saved or (self._bake != None and self._bake.checkpoint != None and self._bake.checkpoint.save_count > 0):
+                self.report({"INFO"}, "Bake cancelled. Progress was saved; bake again with the same settings to resume.")
+            else:
+                self.report({"INFO"}, "Bake cancelled. No data was written.")
+
+            if self._bake != None:
+                self._bake.restore_frame()
 
             self.cancel(context)
 
@@ -781,18 +3125,19 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
         elif event.type != "TIMER":
             return {"PASS_THROUGH"}
 
-        if self._bake == None:
+        try:
+            if self._bake == None:
 
-            options = BakeOptionsAO()
-            options.from_operator(self)
+                options = BakeOptionsAO()
+                options.from_operator(self)
 
-            # Start the bake.
-            self._bake = BakeAO(options, context)
-            self._bake.start()
+                # Start the bake.
+                self._bake = BakeAO(options, context)
+                self._bake.start()
 
-        try:
-            # Perform 50000 samples every time before updating.
-            is_completed = self._bake.bake(50000 / self.sample_count)
+            # Perform a chunk of samples (roughly 50000 rays' worth) every time before updating. Ray casting with Numba
+            # runs on a worker thread instead, so this only checks in on it and Blender stays responsive.
+            is_completed = self._bake.bake(self._bake.get_chunk_size(), background=True)
 
             # Appears in the lower-left corner.
             object_progress = ""
@@ -800,6 +3145,17 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
             if len(self._bake.bake_receive_objects) > 1:
                 object_progress = " ({}/{}) objects".format(self._bake.bake_receive_objects.index(self._bake.active_object), len(self._bake.bake_receive_objects))
 
+            if self.bake_animation:
+                object_progress += " on frame {} ({}/{})".format(self._bake.frames[self._bake.frame_index], self._bake.frame_index + 1, len(self._bake.frames))
+
+            time_left = self._bake.get_time_left()
+
+            if time_left != None:
+                object_progress += ", {} left".format(format_duration(time_left))
+
+            if self._bake.is_progressive() and self._bake.completed_samples > 0:
+                object_progress += ", {} samples so far".format(self._bake.completed_samples)
+
             message = "Baking vertex ambient occlusion: {:03.1f}%".format(self._bake.get_progress_percentage()) + object_progress
 
             self.update_status(context, message)
@@ -809,7 +3165,11 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
         except BakeError as e:
             self.report({"ERROR"}, e.message)
 
-            self.stopped(context)
+            if self._bake != None:
+                self._bake.restore_frame()
+
+            # Stops the worker, removes the timer, and puts the cursor back.
+            self.cancel(context)
 
             return {"CANCELLED"}
 
@@ -825,11 +3185,15 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
         # Send a nice message to the statusbar.
         destination = []
 
-        if self.bake_to_color:
-            destination.append(f"vertex color layer '{self.color_layer_name}'")
+        if self.is_caching_animation():
+            destination.append(f"cache directory '{self.animation_cache_directory}'")
+
+        else:
+            if self.bake_to_color:
+                destination.append(f"vertex color layer '{self.color_layer_name}'")
 
-        if self.bake_to_group:
-            destination.append(f"vertex group '{self.group_name}'")
+            if self.bake_to_group:
+                destination.append(f"vertex group '{self.group_name}'")
 
         destination = " and ".join(destination)
 
@@ -840,12 +3204,25 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
     def cancel(self, context):
         wm = context.window_manager
 
+        # Blender calls this when it's closing, too; the worker thread can't outlive the bake.
+        if self._bake != None:
+            self._bake.stop_worker()
+
         self.stopped(context)
 
         if self._timer != None:
             wm.event_timer_remove(self._timer)
             self._timer = None
 
+    # The number of frames an animation bake would bake.
+    def get_frame_count(self, context):
+        if self.use_scene_frame_range:
+            frame_start, frame_end = context.scene.frame_start, context.scene.frame_end
+        else:
+            frame_start, frame_end = self.frame_start, self.frame_end
+
+        return len(range(frame_start, frame_end + 1, max(1, self.frame_step)))
+
     # This must be called whenever the operation is stopped, or cursor status will be incorrect.
     def stopped(self, context):
         self.update_status(context, None)
@@ -924,7 +3301,8 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
         row = split.row(align=True)
         row.prop(self, "bake_receive_objects", text="")
 
-        bake_receive_objects = BakeAO.get_bake_objects(context, self.bake_receive_objects, True)
+        # These come from the cached index; walking every object on every redraw is far too slow in large scenes.
+        bake_receive_objects = SceneObjectIndex.get_receive_objects(context, self.bake_receive_objects)
 
         if len(bake_receive_objects) > 1:
             split = layout.split(factor=0.35)
@@ -932,6 +3310,18 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
 
             split.label(text="{} object{} receiving ambient occlusion bake".format(len(bake_receive_objects), "s" if len(bake_receive_objects) != 1 else ""))
 
+        split = layout.split(factor=0.35)
+        split.label(text="Only:")
+        split.prop(self, "bake_mask", text="")
+
+        if self.bake_mask == "group":
+            split = layout.split(factor=0.35)
+            split.label(text="")
+
+            row = split.row(align=True)
+            row.prop_search(self, "mask_group_name", context.active_object, "vertex_groups", text="")
+            row.prop(self, "mask_threshold")
+
         # Contributing objects
 
         layout.separator()
@@ -945,8 +3335,8 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
 
         split = layout.split(factor=0.35)
         split.label(text="")
-        bake_cast_objects = BakeAO.get_cast_objects(context, options)
-        split.label(text="{} object{} contributing to bake".format(len(bake_cast_objects), "s" if len(bake_cast_objects) != 1 else ""))
+        cast_count = SceneObjectIndex.get_cast_count(context, options)
+        split.label(text="{} object{} contributing to bake".format(cast_count, "s" if cast_count != 1 else ""))
 
         split = layout.split(factor=0.35, align=True)
         split.prop(self, "ignore_small_objects", toggle=True)
@@ -965,7 +3355,7 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
         # Vertex Group options
         self.draw_bake_target(layout, "Vertex Group", "bake_to_group", "group_name", "weight_invert", exists=BakeAO.vertex_group_exists(obj, self.group_name))
 
-        if not self.bake_to_color and not self.bake_to_group:
+        if not self.bake_to_color and not self.bake_to_group and not self.is_caching_animation():
             self.draw_warning_icon(layout, message="Select at least one of 'Vertex Color Layer' and 'Vertex Group'", alert=True)
         else:
             layout.separator()
@@ -973,24 +3363,122 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
 
         layout.label(text="Bake Options:")
 
+        layout.prop(self, "engine")
+
         layout.prop(self, "max_distance")
         layout.prop(self, "power")
-        layout.prop(self, "sample_count")
+
+        sample_name = "samples"
+
+        # Voxel cones don't take samples; they always use the same handful of cones.
+        if self.engine == "voxel":
+            layout.prop(self, "voxel_resolution")
+            samples_per_vertex = engines.VoxelConeEngine.get_cone_count()
+
+        # Disks don't take samples at all.
+        elif self.engine == "disks":
+            layout.prop(self, "disk_accuracy")
+            samples_per_vertex = 1
+            sample_name = "vertices"
+
+        else:
+            layout.prop(self, "kernel_backend")
+            layout.prop(self, "sample_mode")
+
+            if self.sample_mode == "time":
+                layout.prop(self, "time_budget")
+            else:
+                layout.prop(self, "sample_count")
+
+            samples_per_vertex = self.sample_count
 
         total_sample_count = 0
 
-        for obj in bake_receive_objects:
-            total_sample_count += self.sample_count * len(obj.data.vertices)
+        for indexed in bake_receive_objects:
+            total_sample_count += samples_per_vertex * indexed.vertex_count
 
         across_all = ""
 
         if len(bake_receive_objects) > 1:
             across_all = " across {} objects".format(len(bake_receive_objects))
 
-        layout.label(text="{:,} samples total".format(total_sample_count) + across_all)
+        frame_count = 1
+
+        if self.bake_animation:
+            frame_count = self.get_frame_count(context)
+
+            total_sample_count *= frame_count
+
+            across_all += " over {} frame{}".format(frame_count, "s" if frame_count != 1 else "")
+
+        # We won't know the sample count until the bake has measured how fast it can go.
+        if self.engine == "raycast" and self.sample_mode == "time":
+            layout.label(text="Finishes within {}".format(format_duration(self.time_budget)) + across_all)
+        else:
+            layout.label(text="{:,} {} total".format(total_sample_count, sample_name) + across_all)
+
+        layout.separator()
+
+        # Animation
+
+        box = layout.box()
+        box.prop(self, "bake_animation")
+
+        if self.bake_animation:
+            split = box.split(factor=0.35)
+            split.prop(self, "use_scene_frame_range")
+
+            row = split.row(align=True)
+            row.active = not self.use_scene_frame_range
+            row.prop(self, "frame_start")
+            row.prop(self, "frame_end")
+            row.prop(self, "frame_step")
+
+            box.prop(self, "animation_output")
+
+            if self.animation_output == "cache":
+                box.prop(self, "animation_cache_directory")
+            elif frame_count > 8 and self.bake_to_color:
+                self.draw_warning_icon(box, message="Meshes can only hold a few color layers; use cached arrays for long ranges")
+
+        split = layout.split(factor=0.35, align=True)
+        split.prop(self, "denoise", toggle=True)
+
+        row = split.row(align=True)
+        row.active = self.denoise
+        row.prop(self, "denoise_strength")
+        row.prop(self, "denoise_iterations")
+
+        split = layout.split(factor=0.35, align=True)
+        split.prop(self, "use_symmetry", toggle=True)
+
+        row = split.row(align=True)
+        row.active = self.use_symmetry
+        row.prop(self, "symmetry_axis", text="")
+        row.prop(self, "symmetry_tolerance")
+
+        split = layout.split(factor=0.35, align=True)
+        split.prop(self, "use_checkpoints", toggle=True)
+
+        row = split.row()
+        row.active = self.use_checkpoints
+        row.prop(self, "checkpoint_interval")
 
         layout.separator()
 
+        box = layout.box()
+        box.row().prop(self, "bake_location", expand=True)
+
+        if self.bake_location != "here":
+            if self.bake_location == "job":
+                box.prop(self, "job_directory")
+            else:
+                box.prop(self, "snapshot_path")
+
+            # Exports are ray cast with every sample for the current frame, and written back through the import.
+            if self.engine != "raycast" or self.sample_mode != "count" or self.bake_animation or self.use_symmetry:
+                self.draw_warning_icon(box, message="Exports always ray cast every sample, on the current frame only")
+
         #row = layout.split(factor=0.35)
         #row.prop(self, "jitter")
         #row.prop(self, "jitter_fraction")
@@ -1004,7 +3492,8 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
         if context.active_object not in context.selected_objects:
             return False
 
-        if context.mode != "OBJECT" and context.mode != "VERTEX":
+        # Vertex paint mode is fine too, so there's no need to leave it to bake just the masked vertices.
+        if context.mode not in ("OBJECT", "PAINT_VERTEX", "PAINT_WEIGHT"):
             return False
 
         return True
@@ -1014,13 +3503,28 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
 
         return wm.invoke_props_dialog(self, width=400)
 
+    # Animation bakes to cached arrays don't need a color layer or vertex group to write to.
+    def is_caching_animation(self):
+        return self.bake_animation and self.animation_output == "cache"
+
     def execute(self, context):
 
         # We need to bake to somewhere.
-        if not self.bake_to_color and not self.bake_to_group:
+        if not self.bake_to_color and not self.bake_to_group and not self.is_caching_animation():
             self.report({"ERROR"}, "Select at least one of 'Vertex Color Layer' and 'Vertex Group'; otherwise, there's nowhere to save the data!")
             return {"CANCELLED"}
 
+        # Caught here rather than when the bake starts, so there's no modal bake to clean up after.
+        if self.bake_animation and self.get_frame_count(context) == 0:
+            self.report({"ERROR"}, "The frame range is empty; nothing to bake")
+            return {"CANCELLED"}
+
+        if self.bake_location == "job":
+            return self.export_job(context)
+
+        if self.bake_location == "snapshot":
+            return self.export_snapshot(context)
+
         wm = context.window_manager
         wm.modal_handler_add(self)
 
@@ -1032,6 +3536,118 @@ class MESH_OT_bake_vertex_ao(bpy.types.Operator):
         #bpy.ops.wm.bake_vertex_ao_progress('INVOKE_DEFAULT')
         return {"RUNNING_MODAL"}
 
+    def export_job(self, context):
+        options = BakeOptionsAO()
+        options.from_operator(self)
+
+        directory = bpy.path.abspath(self.job_directory)
+
+        try:
+            unit_count = BakeAO(options, context).export_job(directory)
+        except (BakeError, jobs.JobError) as e:
+            self.report({"ERROR"}, e.message)
+            return {"CANCELLED"}
+
+        self.report({"INFO"}, "Exported a bake job with {} work unit(s) to '{}'. Run `python jobs.py <job directory> --shard <n> --shard-count <count>` from the addon directory on each worker".format(unit_count, directory))
+
+        return {"FINISHED"}
+
+    def export_snapshot(self, context):
+        options = BakeOptionsAO()
+        options.from_operator(self)
+
+        path = bpy.path.abspath(self.snapshot_path)
+
+        try:
+            BakeAO(options, context).export_snapshot(path)
+        except BakeError as e:
+            self.report({"ERROR"}, e.message)
+            return {"CANCELLED"}
+        except OSError as e:
+            self.report({"ERROR"}, "Couldn't write the snapshot: {}".format(e))
+            return {"CANCELLED"}
+
+        self.report({"INFO"}, "Exported a scene snapshot to '{}'. Run `python snapshot.py <snapshot> <output.npz>` from the addon directory to bake it".format(path))
+
+        return {"FINISHED"}
+
+class MESH_OT_import_vertex_ao_job(bpy.types.Operator):
+    bl_idname = "mesh.import_vertex_ao_job"
+    bl_label = "Import Bake Job Results"
+    bl_description = "Applies the results of a finished bake job to the objects it was exported from"
+    bl_options = {"UNDO"}
+
+    directory: bpy.props.StringProperty(
+        name="Job Directory",
+        description="The directory the bake job was exported to",
+        subtype="DIR_PATH"
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == "OBJECT"
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+
+        return {"RUNNING_MODAL"}
+
+    def execute(self, context):
+        try:
+            baked = BakeAO.import_job(context, bpy.path.abspath(self.directory))
+        except (BakeError, jobs.JobError) as e:
+            self.report({"ERROR"}, e.message)
+            return {"CANCELLED"}
+
+        if len(baked) == 0:
+            self.report({"WARNING"}, "None of the objects in the bake job could be found")
+            return {"CANCELLED"}
+
+        self.report({"INFO"}, "Imported bake job results for {} object(s)".format(len(baked)))
+
+        return {"FINISHED"}
+
+class MESH_OT_import_vertex_ao_snapshot(bpy.types.Operator):
+    bl_idname = "mesh.import_vertex_ao_snapshot"
+    bl_label = "Import Baked Snapshot"
+    bl_description = "Applies the per-loop arrays a scene snapshot was baked to (with snapshot.py) to the objects it was exported from"
+    bl_options = {"UNDO"}
+
+    filepath: bpy.props.StringProperty(
+        name="Baked Snapshot",
+        description="The .npz file snapshot.py wrote",
+        subtype="FILE_PATH"
+    )
+
+    filter_glob: bpy.props.StringProperty(
+        default="*.npz",
+        options={"HIDDEN"}
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == "OBJECT"
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+
+        return {"RUNNING_MODAL"}
+
+    def execute(self, context):
+        try:
+            baked = BakeAO.import_snapshot_results(context, bpy.path.abspath(self.filepath))
+        except BakeError as e:
+            self.report({"ERROR"}, e.message)
+            return {"CANCELLED"}
+
+        if len(baked) == 0:
+            self.report({"WARNING"}, "None of the objects in the snapshot could be found")
+            return {"CANCELLED"}
+
+        self.report({"INFO"}, "Imported baked snapshot results for {} object(s)".format(len(baked)))
+
+        return {"FINISHED"}
+
 # I was hoping to use this as a popup to display progress, but that didn't work out either.
 class WM_OT_bake_vertex_ao_progress(bpy.types.Operator):
     bl_idname = "wm.bake_vertex_ao_progress"
@@ -1056,6 +3672,8 @@ class MESH_MT_vertex_oven(bpy.types.Menu):
     def draw(self, context):
         layout = self.layout
         layout.operator(MESH_OT_bake_vertex_ao.bl_idname)
+        layout.operator(MESH_OT_import_vertex_ao_job.bl_idname)
+        layout.operator(MESH_OT_import_vertex_ao_snapshot.bl_idname)
 
 def menu_func(self, context):
     self.layout.separator()
@@ -1063,18 +3681,51 @@ def menu_func(self, context):
 
 register_classes = [
     MESH_OT_bake_vertex_ao,
+    MESH_OT_import_vertex_ao_job,
+    MESH_OT_import_vertex_ao_snapshot,
     MESH_MT_vertex_oven,
     #WM_OT_bake_vertex_ao_progress
 ]
 
+# Anything that can change what the bake dialog shows about the scene.
+index_handlers = [
+    bpy.app.handlers.depsgraph_update_post,
+    bpy.app.handlers.frame_change_post,
+    bpy.app.handlers.undo_post,
+    bpy.app.handlers.redo_post,
+]
+
 def register():
     for cls in register_classes:
         bpy.utils.register_class(cls)
 
     bpy.types.VIEW3D_MT_object.append(menu_func)
 
+    for handlers in index_handlers:
+        handlers.append(invalidate_scene_object_index)
+        handlers.append(invalidate_bake_ao_casters)
+
+    bpy.app.handlers.load_post.append(on_load_post)
+
+    subscribe_to_active_object()
+
 def unregister():
     for cls in register_classes:
         bpy.utils.unregister_class(cls)
 
     bpy.types.VIEW3D_MT_object.remove(menu_func)
+
+    for handlers in index_handlers:
+        if invalidate_scene_object_index in handlers:
+            handlers.remove(invalidate_scene_object_index)
+
+        if invalidate_bake_ao_casters in handlers:
+            handlers.remove(invalidate_bake_ao_casters)
+
+    if on_load_post in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(on_load_post)
+
+    bpy.msgbus.clear_by_owner(msgbus_owner)
+
+    SceneObjectIndex.invalidate()
+    bake_ao_casters.clear()
@@ -0,0 +1,149 @@
+# Blender Vertex Oven addon
+# Copyright (C) 2019 Forest Katsch (forestcgk@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Array-in, array-out ambient occlusion for pipeline tools: points and normals go in, an array comes out, and nothing
+# is written to any mesh. Like `engines`, nothing in here may import `bpy` or `mathutils`. For Blender objects, use
+# `bake_ao()` in the addon's module instead; it turns them into triangles and calls `compute_ao()`.
+#
+# The trees (or grids) built for a set of triangles are kept around, so asking about more points against the same
+# triangles only pays for the rays.
+
+import hashlib
+import collections
+
+import numpy as np
+
+try:
+    from . import engines
+    from . import kernels
+except ImportError:
+    import engines
+    import kernels
+
+# How many trees and grids to keep around between calls.
+cache_size = 8
+
+# {key: tree or grid}, least recently used first.
+structure_cache = collections.OrderedDict()
+
+# The number of points voxel cone and disk engines do at a time.
+chunk_size = 65536
+
+def clear_cache():
+    """Forgets every cached tree and grid."""
+    structure_cache.clear()
+
+def get_cached(key, build):
+    """Returns the cached structure for `key`, calling `build()` to make it if there isn't one."""
+
+    if key in structure_cache:
+        structure_cache.move_to_end(key)
+
+        return structure_cache[key]
+
+    structure = build()
+
+    structure_cache[key] = structure
+
+    while len(structure_cache) > cache_size:
+        structure_cache.popitem(last=False)
+
+    return structure
+
+def get_triangles_key(triangles):
+    """Returns a key that's the same for every identical triangle buffer."""
+    return (triangles.shape, hashlib.blake2b(np.ascontiguousarray(triangles).tobytes(), digest_size=16).hexdigest())
+
+def get_sample_directions(sample_count, seed=0):
+    """Returns `sample_count` directions (S×3) spread over the sphere; the same ones the operator uses for `seed`."""
+
+    random = np.random.RandomState(seed)
+
+    # The operator draws these one at a time, with two more values per sample that ray casting doesn't use.
+    values = random.random_sample((sample_count, 4))
+
+    phi = values[:, 0] * (np.pi * 2)
+    theta = np.arccos(-1 + (values[:, 1] * 2))
+
+    return np.stack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)], axis=1)
+
+def compute_ao(positions, normals, triangles, max_distance=3.0, power=0.5, sample_count=32, seed=0, engine="raycast", kernel_backend="auto", voxel_resolution=32, disk_accuracy=2.0, triangles_key=None):
+    """
+Returns the ambient occlusion (float32, from 0 for none to 1 for fully occluded) at each of `positions` (N×3) facing
+along `normals` (N×3), cast by `triangles` (T×3×3). Everything is in the same (world) space. The settings are the same
+as the bake dialog's; `engine` is "raycast", "voxel" or "disks", and `kernel_backend` picks the ray casting backend
+from `kernels.backends` ("auto" for the fastest one available.)
+
+`triangles_key` identifies the triangles for the cache; if it's `None`, the triangles are hashed instead.
+"""
+
+    positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+    normals = engines.normalize(np.asarray(normals, dtype=np.float64).reshape((-1, 3)))
+
+    if len(positions) != len(normals):
+        raise ValueError("There are {} positions but {} normals".format(len(positions), len(normals)))
+
+    triangles = np.asarray(triangles, dtype=np.float64).reshape((-1, 3, 3))
+
+    if triangles_key == None:
+        triangles_key = get_triangles_key(triangles)
+
+    ao = np.zeros(len(positions), dtype=np.float32)
+
+    if len(positions) == 0:
+        return ao
+
+    if engine == "voxel":
+        # Tiles are voxelized as points need them, and kept for the next call.
+        tiles = get_cached(("voxel", triangles_key, voxel_resolution, max_distance), lambda: engines.VoxelTiles(triangles, max_distance / voxel_resolution, max_distance))
+
+        ray_cast = engines.VoxelConeEngine(tiles, max_distance, power)
+
+        # Points that are close together share a tile, so do them together.
+        order = engines.get_morton_order(positions, normals)
+
+        for start in range(0, len(positions), chunk_size):
+            chunk = order[start:start + chunk_size]
+
+            ao[chunk] = ray_cast.compute(positions[chunk], normals[chunk])
+
+    elif engine == "disks":
+        tree = get_cached(("disks", triangles_key, max_distance), lambda: engines.DiskOcclusionEngine.create_tree(triangles, max_distance))
+
+        disks = engines.DiskOcclusionEngine(tree, max_distance, power, disk_accuracy)
+
+        for start in range(0, len(positions), chunk_size):
+            ao[start:start + chunk_size] = disks.compute(positions[start:start + chunk_size], normals[start:start + chunk_size])
+
+    elif engine == "raycast":
+        backend = kernels.get_backend(kernel_backend)
+
+        bvh = get_cached(("raycast", triangles_key), lambda: kernels.TriangleBVH(triangles))
+
+        ray_cast = kernels.RayCastEngine(bvh, max_distance, power, backend)
+
+        directions = get_sample_directions(sample_count, seed)
+
+        # Keep each call to the kernel to about as many rays as the backend likes to do at once.
+        point_count = max(1, backend.rays_per_update // max(1, sample_count))
+
+        for start in range(0, len(positions), point_count):
+            ao[start:start + point_count] = ray_cast.compute(positions[start:start + point_count], normals[start:start + point_count], directions)
+
+    else:
+        raise ValueError("There's no engine called '{}'".format(engine))
+
+    return ao
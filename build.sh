@@ -19,6 +19,11 @@ echo "Compressing addon files to" $ZIP_FILENAME "..."
 cd ..
 
 zip $ADDON_FILENAME $ADDON_DIR/__init__.py
+zip $ADDON_FILENAME $ADDON_DIR/engines.py
+zip $ADDON_FILENAME $ADDON_DIR/kernels.py
+zip $ADDON_FILENAME $ADDON_DIR/jobs.py
+zip $ADDON_FILENAME $ADDON_DIR/snapshot.py
+zip $ADDON_FILENAME $ADDON_DIR/api.py
 zip $ADDON_FILENAME $ADDON_DIR/README.md
 zip $ADDON_FILENAME $ADDON_DIR/LICENSE
 
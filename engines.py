@@ -0,0 +1,1037 @@
+# Blender Vertex Oven addon
+# Copyright (C) 2019 Forest Katsch (forestcgk@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Occlusion engines that only need NumPy. Nothing in here may import `bpy` or `mathutils`; everything works on plain
+# arrays of world-space positions, normals and triangles.
+
+import math
+import threading
+import collections
+
+import numpy as np
+
+def occlusion_from_distance(distance, max_distance=10, power=0.5):
+    """Array version of `BakeAO.occlusion_from_distance()`; 1 at distance 0, falling off to 0 at `max_distance`."""
+    return np.power(np.clip(1.0 - (distance / max_distance), 0.0, 1.0), power)
+
+def get_tangent_frames(normals):
+    """Returns `(tangents, bitangents)` perpendicular to each of `normals` (which must be normalized.)"""
+
+    # Any vector that isn't parallel to the normal will do.
+    helper = np.zeros_like(normals)
+    helper[:, 0] = 1.0
+    helper[np.abs(normals[:, 0]) > 0.9] = (0.0, 1.0, 0.0)
+
+    tangents = np.cross(normals, helper)
+    tangents /= np.linalg.norm(tangents, axis=1)[:, np.newaxis]
+
+    bitangents = np.cross(normals, tangents)
+
+    return tangents, bitangents
+
+def normalize(vectors):
+    """Returns `vectors` (N×3) scaled to unit length; zero-length vectors are left alone."""
+
+    length = np.linalg.norm(vectors, axis=1)
+    length[length == 0] = 1
+
+    return vectors / length[:, np.newaxis]
+
+def to_world(positions, normals, matrix):
+    """Returns `(positions, normals)` (N×3, object space) transformed by `matrix` (4×4) into world space."""
+
+    matrix = np.array(matrix, dtype=np.float64)
+
+    world_positions = (positions @ matrix[:3, :3].T) + matrix[:3, 3]
+
+    # Normals are transformed by the inverse transpose, so non-uniform scale doesn't skew them.
+    world_normals = normalize(normals @ np.linalg.inv(matrix[:3, :3]))
+
+    return world_positions, world_normals
+
+def spread_bits(values):
+    """Spreads the low 10 bits of each of `values` out so there are two zero bits between each one."""
+
+    values = values.astype(np.uint64) & 0x3ff
+
+    values = (values | (values << 16)) & 0x030000ff
+    values = (values | (values << 8)) & 0x0300f00f
+    values = (values | (values << 4)) & 0x030c30c3
+    values = (values | (values << 2)) & 0x09249249
+
+    return values
+
+def get_morton_order(positions, normals=None):
+    """
+Returns the indices that sort `positions` (N×3) along a Z-order (Morton) curve, so points that are next to each other
+in the result are next to each other in space too. Points at the same spot are grouped by which octant their normal
+points into, since they'll mostly cast rays into the same places.
+"""
+
+    if len(positions) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    low = positions.min(axis=0)
+    size = np.max(positions.max(axis=0) - low)
+
+    if size <= 0:
+        size = 1
+
+    # 10 bits per axis, over a cube so the curve isn't squashed on flat objects.
+    cells = np.clip(((positions - low) / size) * 1024, 0, 1023).astype(np.uint64)
+
+    codes = (spread_bits(cells[:, 0]) << 2) | (spread_bits(cells[:, 1]) << 1) | spread_bits(cells[:, 2])
+
+    if normals is not None:
+        octants = ((normals[:, 0] < 0) * 4) + ((normals[:, 1] < 0) * 2) + (normals[:, 2] < 0)
+
+        codes = (codes << 3) | octants.astype(np.uint64)
+
+    return np.argsort(codes, kind="stable")
+
+def get_run_indices(starts, counts):
+    """
+Returns `(runs, indices)`, with an entry for every element of every run: which run (an index into `starts`) it's in,
+and its index, from `starts[run]` to `starts[run] + counts[run] - 1`.
+"""
+
+    runs = np.repeat(np.arange(len(counts)), counts)
+
+    offsets = np.arange(len(runs)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    return runs, starts[runs] + offsets
+
+def hash_cells(cells):
+    """Returns a key (int64) for each grid cell in `cells` (N×3, int64.) Different cells can share a key, but rarely."""
+    return (cells[:, 0] * 73856093) ^ (cells[:, 1] * 19349663) ^ (cells[:, 2] * 83492791)
+
+def get_nearby_pairs(points, queries, radius):
+    """
+Returns `(query indices, point indices, distances)` for every pair of one of `queries` (Q×3) and one of `points` (N×3)
+that are within `radius` of each other. Points are sorted into a grid of cells twice as big as `radius`, so only the 8
+cells around each query need searching, for all queries at once.
+"""
+
+    points = np.asarray(points, dtype=np.float64).reshape((-1, 3))
+    queries = np.asarray(queries, dtype=np.float64).reshape((-1, 3))
+
+    pairs = ([], [], [])
+
+    if len(points) and len(queries):
+        cell_size = max(radius, 1e-9) * 2
+
+        # Only from the points, so the order pairs come out in doesn't depend on the queries.
+        low = points.min(axis=0) - cell_size
+
+        keys = hash_cells(np.floor((points - low) / cell_size).astype(np.int64))
+
+        order = np.argsort(keys, kind="stable")
+
+        # Each key once, and where its points are in `order`.
+        cell_keys, cell_starts, cell_counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+        # Everything within `radius` of a query is in this cell or the next one along, on each axis.
+        query_cells = np.floor((queries - low - radius) / cell_size).astype(np.int64)
+
+        for offset in np.stack(np.meshgrid([0, 1], [0, 1], [0, 1]), axis=-1).reshape((-1, 3)):
+            query_keys = hash_cells(query_cells + offset)
+
+            cells = np.minimum(np.searchsorted(cell_keys, query_keys), len(cell_keys) - 1)
+
+            found = np.nonzero(cell_keys[cells] == query_keys)[0]
+
+            runs, indices = get_run_indices(cell_starts[cells[found]], cell_counts[cells[found]])
+
+            query_indices = found[runs]
+            point_indices = order[indices]
+
+            distance = np.linalg.norm(points[point_indices] - queries[query_indices], axis=1)
+
+            # Cells that only share a key aren't neighbors at all.
+            close = distance <= radius
+
+            pairs[0].append(query_indices[close])
+            pairs[1].append(point_indices[close])
+            pairs[2].append(distance[close])
+
+    if len(pairs[0]) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    return tuple(np.concatenate(values) for values in pairs)
+
+def get_mirror_points(positions, normals, vertex_indices, axis, tolerance, indices=None):
+    """
+Returns, for each point in `positions` and `normals` (both N×3, object space; or just those at `indices`), the index
+of the point that's its mirror image across the plane perpendicular to `axis` (0-2), or -1 if there isn't one. Points
+with the same `vertex_indices` are at the same position (on either side of a hard edge), and are told apart by their
+normals.
+"""
+
+    positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+    normals = np.asarray(normals, dtype=np.float64).reshape((-1, 3))
+
+    if indices is None:
+        indices = np.arange(len(positions))
+
+    mirror = np.full(len(indices), -1, dtype=np.int64)
+
+    if len(indices) == 0:
+        return mirror
+
+    flip = np.ones(3)
+    flip[axis] = -1
+
+    # Vertices are matched first, since there are several points at each one.
+    vertices, first_points, point_vertices = np.unique(vertex_indices, return_index=True, return_inverse=True)
+    point_vertices = point_vertices.reshape(-1)
+
+    vertex_positions = positions[first_points]
+
+    wanted = np.unique(point_vertices[indices])
+
+    queries, candidates, distance = get_nearby_pairs(vertex_positions, vertex_positions[wanted] * flip, tolerance)
+
+    # `(vertex, vertex it mirrors onto)`, grouped by the first.
+    pair_order = np.argsort(wanted[queries], kind="stable")
+    pair_vertices, pair_candidates = wanted[queries][pair_order], candidates[pair_order]
+
+    pair_counts = np.bincount(pair_vertices, minlength=len(vertices))
+    pair_starts = np.cumsum(pair_counts) - pair_counts
+
+    # Each point's candidates are every point at every vertex its own vertex mirrors onto.
+    vertex_points = np.argsort(point_vertices, kind="stable")
+    point_counts = np.bincount(point_vertices, minlength=len(vertices))
+    point_starts = np.cumsum(point_counts) - point_counts
+
+    queries, pairs = get_run_indices(pair_starts[point_vertices[indices]], pair_counts[point_vertices[indices]])
+
+    runs, candidates = get_run_indices(point_starts[pair_candidates[pairs]], point_counts[pair_candidates[pairs]])
+
+    queries = queries[runs]
+    candidates = vertex_points[candidates]
+
+    alignment = np.sum(normals[candidates] * (normals[indices[queries]] * flip), axis=1)
+
+    aligned = alignment > 0.99
+
+    queries, candidates, alignment = queries[aligned], candidates[aligned], alignment[aligned]
+
+    if len(queries) == 0:
+        return mirror
+
+    # Candidates are grouped by point, so the best-aligned one in each group (the first, if there's a tie) is found
+    # without sorting.
+    starts = np.nonzero(np.r_[True, queries[1:] != queries[:-1]])[0]
+    counts = np.diff(np.r_[starts, len(queries)])
+
+    best = np.nonzero(alignment == np.repeat(np.maximum.reduceat(alignment, starts), counts))[0]
+    best = best[np.r_[True, queries[best][1:] != queries[best][:-1]]]
+
+    mirror[queries[best]] = candidates[best]
+
+    return mirror
+
+def get_edge_lengths(triangles):
+    """Returns the lengths (T×3) of the edges of `triangles` (T×3×3); edge `i` runs from corner `i` to the next one."""
+
+    return np.stack([
+        np.linalg.norm(triangles[:, 1] - triangles[:, 0], axis=1),
+        np.linalg.norm(triangles[:, 2] - triangles[:, 1], axis=1),
+        np.linalg.norm(triangles[:, 0] - triangles[:, 2], axis=1),
+    ], axis=1)
+
+def split_triangles(triangles, max_edge, bounds=None):
+    """
+Returns `triangles` (T×3×3), with every one that has an edge longer than `max_edge` split in half along its longest
+edge until none do. With `bounds` (`(min, max)` corners of a box), triangles outside the box are dropped along the way,
+so only the part of a huge triangle that's inside is split up.
+"""
+
+    triangles = np.asarray(triangles, dtype=np.float64).reshape((-1, 3, 3))
+
+    while True:
+        if bounds != None:
+            inside = np.all(triangles.max(axis=1) >= bounds[0], axis=1) & np.all(triangles.min(axis=1) <= bounds[1], axis=1)
+            triangles = triangles[inside]
+
+        edges = get_edge_lengths(triangles)
+
+        large = edges.max(axis=1) > max_edge
+
+        if not np.any(large):
+            return triangles
+
+        split = triangles[large]
+
+        # Rotate each triangle so its longest edge runs from the first corner to the second.
+        longest = np.argmax(edges[large], axis=1)
+        rotation = (np.arange(3)[np.newaxis, :] + longest[:, np.newaxis]) % 3
+        split = split[np.arange(len(split))[:, np.newaxis], rotation]
+
+        middle = (split[:, 0] + split[:, 1]) * 0.5
+
+        triangles = np.concatenate([
+            triangles[~large],
+            np.stack([split[:, 0], middle, split[:, 2]], axis=1),
+            np.stack([middle, split[:, 1], split[:, 2]], axis=1),
+        ])
+
+class VoxelGrid:
+    """
+An occupancy grid covering a box in world space, plus a mip pyramid of it. Each mip level combines 2×2×2 cells of
+the level below, so a cone can sample a whole cross-section of itself with a single lookup.
+"""
+
+    # The most times a triangle's edges are divided when sampling it.
+    max_subdivisions = 64
+
+    def __init__(self, bounds_min, bounds_max, voxel_size):
+        self.bounds_min = np.asarray(bounds_min, dtype=np.float64)
+
+        # Cubic cells, `voxel_size` world units across.
+        self.voxel_size = voxel_size
+
+        extent = np.maximum(np.asarray(bounds_max, dtype=np.float64) - self.bounds_min, voxel_size)
+
+        self.shape = tuple(int(n) for n in np.maximum(np.ceil(extent / self.voxel_size), 1))
+
+        self.occupancy = np.zeros(self.shape, dtype=np.float32)
+
+        self.levels = None
+
+    def add_triangles(self, triangles):
+        """Marks every cell touched by `triangles` (T×3×3, world space) as occupied."""
+
+        if len(triangles) == 0:
+            return
+
+        bounds_max = self.bounds_min + np.array(self.shape) * self.voxel_size
+
+        # Triangles much bigger than the grid would take forever to sample, and most of them would be outside it anyway.
+        triangles = split_triangles(triangles, self.voxel_size * self.max_subdivisions * 0.5, (self.bounds_min, bounds_max))
+
+        if len(triangles) == 0:
+            return
+
+        # Sample each triangle densely enough (half a cell apart) that no cell it passes through is missed.
+        subdivisions = np.clip(np.ceil(get_edge_lengths(triangles).max(axis=1) / (self.voxel_size * 0.5)), 1, self.max_subdivisions).astype(np.int32)
+
+        # Triangles with the same subdivision count are sampled together.
+        for count in np.unique(subdivisions):
+            group = triangles[subdivisions == count]
+
+            i, j = np.meshgrid(np.arange(count + 1), np.arange(count + 1), indexing="ij")
+            keep = (i + j) <= count
+
+            u = (i[keep] / count).astype(np.float32)
+            v = (j[keep] / count).astype(np.float32)
+            w = 1.0 - u - v
+
+            # Chunked, so huge triangle groups don't need a huge temporary array.
+            chunk = max(1, 4000000 // len(u))
+
+            for start in range(0, len(group), chunk):
+                part = group[start:start + chunk]
+
+                points = (part[:, np.newaxis, 0] * w[:, np.newaxis]) + (part[:, np.newaxis, 1] * u[:, np.newaxis]) + (part[:, np.newaxis, 2] * v[:, np.newaxis])
+
+                self.mark(points.reshape((-1, 3)))
+
+        self.levels = None
+
+    def mark(self, points):
+        cells = np.floor((points - self.bounds_min) / self.voxel_size).astype(np.int64)
+
+        valid = np.all((cells >= 0) & (cells < np.array(self.shape)), axis=1)
+        cells = cells[valid]
+
+        self.occupancy[cells[:, 0], cells[:, 1], cells[:, 2]] = 1.0
+
+    def build_levels(self):
+        """Builds the mip pyramid, down to a single cell."""
+
+        self.levels = [self.occupancy]
+
+        level = self.occupancy
+
+        while max(level.shape) > 1:
+            # Pad odd sizes with empty space, then average each 2×2×2 block.
+            padded = np.pad(level, [(0, size % 2) for size in level.shape], mode="constant")
+
+            shape = tuple(size // 2 for size in padded.shape)
+
+            # Doubling the average turns volume into (roughly) projected area: a thin wall through a block fills half of
+            # its children, but completely blocks anything passing through it.
+            level = np.minimum(padded.reshape((shape[0], 2, shape[1], 2, shape[2], 2)).mean(axis=(1, 3, 5)) * 2, 1.0).astype(np.float32)
+
+            self.levels.append(level)
+
+    def sample(self, positions, level_index):
+        """Returns the trilinearly-interpolated occupancy at `positions` (N×3) on mip level `level_index`."""
+
+        level_index = min(level_index, len(self.levels) - 1)
+
+        level = self.levels[level_index]
+        shape = np.array(level.shape)
+
+        cell_size = self.voxel_size * (2 ** level_index)
+
+        # Cell centers sit at half-cell offsets.
+        coords = ((positions - self.bounds_min) / cell_size) - 0.5
+
+        base = np.floor(coords)
+        fraction = (coords - base).astype(np.float32)
+        base = base.astype(np.int64)
+
+        result = np.zeros(len(positions), dtype=np.float32)
+
+        for dx in (0, 1):
+            for dy in (0, 1):
+                for dz in (0, 1):
+                    cell = base + (dx, dy, dz)
+
+                    # Outside the grid is empty.
+                    valid = np.all((cell >= 0) & (cell < shape), axis=1)
+
+                    weight = (fraction[:, 0] if dx else 1 - fraction[:, 0]) * (fraction[:, 1] if dy else 1 - fraction[:, 1]) * (fraction[:, 2] if dz else 1 - fraction[:, 2])
+
+                    values = np.zeros(len(positions), dtype=np.float32)
+                    values[valid] = level[cell[valid, 0], cell[valid, 1], cell[valid, 2]]
+
+                    result += weight * values
+
+        return result
+
+class VoxelTiles:
+    """
+Voxelizes `triangles` (T×3×3, world space) a tile at a time, as points ask for them, so no grid is ever much more than
+`max_grid_size` cells across no matter how big the receiver is. Each tile's grid reaches past the tile far enough that
+the cones of every point inside it stay inside the grid. A few of the most recently used grids are kept around;
+points sorted with `get_morton_order()` mostly ask for the same tile as the points before them.
+"""
+
+    # Grids are at most about this many cells along each side; tiles are as big as that allows.
+    max_grid_size = 192
+
+    # How far past its tile each grid reaches, as a multiple of `max_distance`. Cones sample coarse mip levels near the
+    # end, so this is a bit more than the cones themselves reach.
+    margin = 1.25
+
+    # Grid corners are snapped to multiples of this many voxels, so neighboring tiles share their mip cells and there
+    # are no seams between them.
+    alignment = 16
+
+    cache_size = 4
+
+    def __init__(self, triangles, voxel_size, max_distance, bounds=None):
+        self.triangles = np.asarray(triangles, dtype=np.float64).reshape((-1, 3, 3))
+        self.voxel_size = voxel_size
+        self.max_distance = max_distance
+
+        # `(min, max)` corners of the box every point asked about is in, if it's known up front. Grids don't reach any
+        # further past it than they need to, which saves a lot of empty space over flat receivers.
+        self.bounds = bounds
+
+        if len(self.triangles):
+            self.triangles_min = self.triangles.min(axis=1)
+            self.triangles_max = self.triangles.max(axis=1)
+        else:
+            self.triangles_min = np.zeros((0, 3))
+            self.triangles_max = np.zeros((0, 3))
+
+        # {tile key: VoxelGrid}, least recently used first.
+        self.grids = collections.OrderedDict()
+
+    def get_tile_size(self):
+        """Returns the size of each (cubic) tile, in world units."""
+        return max(self.max_distance * 0.5, (self.voxel_size * self.max_grid_size) - (self.max_distance * self.margin * 2))
+
+    def get_tile_keys(self, positions):
+        """Returns the key (N×3 integers) of the tile each of `positions` (N×3) is in."""
+        return np.floor(positions / self.get_tile_size()).astype(np.int64)
+
+    def get_grid(self, key):
+        """Returns the grid for the tile with `key`, voxelizing it if it isn't cached."""
+
+        key = tuple(int(n) for n in key)
+
+        if key in self.grids:
+            self.grids.move_to_end(key)
+
+            return self.grids[key]
+
+        tile_size = self.get_tile_size()
+        margin = self.max_distance * self.margin
+
+        snap = self.voxel_size * self.alignment
+
+        # Offset by half a voxel, so flat floors at round numbers run through the middle of a layer of cells instead of
+        # between two of them.
+        low = (np.floor(((np.array(key) * tile_size) - margin) / snap) * snap) - (self.voxel_size * 0.5)
+        high = (np.ceil((((np.array(key) + 1) * tile_size) + margin) / snap) * snap) - (self.voxel_size * 0.5)
+
+        if self.bounds != None:
+            low = np.maximum(low, (np.floor((np.asarray(self.bounds[0]) - margin) / snap) * snap) - (self.voxel_size * 0.5))
+            high = np.minimum(high, (np.ceil((np.asarray(self.bounds[1]) + margin) / snap) * snap) - (self.voxel_size * 0.5))
+
+        grid = VoxelGrid(low, high, self.voxel_size)
+
+        inside = np.all(self.triangles_max >= low, axis=1) & np.all(self.triangles_min <= high, axis=1)
+
+        grid.add_triangles(self.triangles[inside])
+        grid.build_levels()
+
+        self.grids[key] = grid
+
+        while len(self.grids) > self.cache_size:
+            self.grids.popitem(last=False)
+
+        return grid
+
+class VoxelConeEngine:
+    """
+Approximates ambient occlusion by marching a few wide cones through voxelized casters (`VoxelTiles`), instead of
+casting dozens of rays. Much faster for very large scenes, but coarse: detail smaller than a voxel is lost.
+
+The result uses the same convention as the ray-cast engine: each cone's occlusion is the falloff
+(`occlusion_from_distance()`) at the distances where it's blocked, weighted by how much of the cone is blocked there,
+and cones are weighted by how much of the hemisphere they stand in for.
+"""
+
+    # The hemisphere is split into bands between these angles from the normal, with this many cones in each band. Each
+    # cone is wide enough that, together, the cones cover the whole hemisphere; most of it is near the horizon, which is
+    # also where most occluders are.
+    cone_bands = [(0, 30, 1), (30, 60, 6), (60, 90, 9)]
+
+    # How many voxels off the surface cones start, so receivers don't occlude themselves.
+    start_offset = 1.0
+
+    # Added to the mip level. Coarse levels smear thin surfaces over big cells, so without this, the cones closest to
+    # the horizon pick up the surface the point is sitting on.
+    level_bias = -2.0
+
+    # Cells are kept this many times smaller than the cone's height above the point's surface, for the same reason.
+    clearance = 3.0
+
+    def __init__(self, tiles, max_distance, power):
+        self.tiles = tiles
+        self.max_distance = max_distance
+        self.power = power
+
+        voxel_size = tiles.voxel_size
+
+        # Per cone: the direction in tangent space (x: tangent, y: bitangent, z: normal), its weight, and the distances
+        # along it that we sample at. The steps only depend on the cone's width, so they're worked out once: each step is
+        # half the cone's width, but never smaller than half a voxel.
+        self.cones = []
+
+        for band, (low, high, count) in enumerate(self.cone_bands):
+            low_cos = math.cos(math.radians(low))
+            high_cos = math.cos(math.radians(high))
+
+            # Each cone covers its share of the band's solid angle, and points at the middle of it.
+            weight = (low_cos - high_cos) / count
+            tilt = math.acos((low_cos + high_cos) * 0.5) if count > 1 else 0.0
+
+            tan_angle = math.tan(math.acos(1.0 - weight))
+
+            steps = []
+
+            distance = voxel_size
+
+            while distance < max_distance:
+                diameter = max(voxel_size, 2 * distance * tan_angle)
+
+                step = max(voxel_size * 0.5, diameter * 0.5)
+
+                height = (voxel_size * self.start_offset) + (distance * math.cos(tilt))
+
+                level = max(0.0, min(math.log2(diameter / voxel_size) + self.level_bias, math.log2(height / (voxel_size * self.clearance))))
+
+                steps.append((distance, step, level))
+
+                distance += step
+
+            # Every other band is turned by half a cone, so the cones don't line up.
+            for i in range(count):
+                angle = ((i + (band % 2) * 0.5) / count) * math.pi * 2
+
+                direction = (math.cos(angle) * math.sin(tilt), math.sin(angle) * math.sin(tilt), math.cos(tilt))
+
+                self.cones.append((np.array(direction), weight, steps))
+
+    @classmethod
+    def get_cone_count(cls):
+        return sum(count for low, high, count in cls.cone_bands)
+
+    def compute(self, positions, normals):
+        """Returns the occlusion (0..1) for each of `positions` (N×3, world space) with `normals` (N×3)."""
+
+        positions = np.asarray(positions, dtype=np.float64)
+        normals = normalize(np.asarray(normals, dtype=np.float64))
+
+        occlusion = np.zeros(len(positions), dtype=np.float32)
+
+        if len(positions) == 0:
+            return occlusion
+
+        keys, tiles = np.unique(self.tiles.get_tile_keys(positions), axis=0, return_inverse=True)
+
+        for i, key in enumerate(keys):
+            indices = np.nonzero(tiles.reshape(-1) == i)[0]
+
+            occlusion[indices] = self.march(self.tiles.get_grid(key), positions[indices], normals[indices])
+
+        return occlusion
+
+    def march(self, grid, positions, normals):
+        """Marches the cones of `positions` (N×3) with `normals` (N×3, normalized) through `grid`."""
+
+        tangents, bitangents = get_tangent_frames(normals)
+
+        origins = positions + normals * (grid.voxel_size * self.start_offset)
+
+        occlusion = np.zeros(len(positions), dtype=np.float64)
+
+        for cone, weight, steps in self.cones:
+            direction = (tangents * cone[0]) + (bitangents * cone[1]) + (normals * cone[2])
+
+            # How much of the cone has been blocked so far.
+            blocked = np.zeros(len(positions), dtype=np.float64)
+
+            cone_occlusion = np.zeros(len(positions), dtype=np.float64)
+
+            for distance, step, level in steps:
+                lower = int(level)
+                blend = level - lower
+
+                density = grid.sample(origins + direction * distance, lower)
+
+                if blend > 0:
+                    density = (density * (1 - blend)) + (grid.sample(origins + direction * distance, lower + 1) * blend)
+
+                # Correct for the step length, since the density is per cell.
+                cell_size = grid.voxel_size * (2 ** level)
+                alpha = 1.0 - np.power(1.0 - np.clip(density, 0.0, 0.999), step / cell_size)
+
+                newly_blocked = (1.0 - blocked) * alpha
+
+                cone_occlusion += newly_blocked * occlusion_from_distance(distance, self.max_distance, self.power)
+                blocked += newly_blocked
+
+            occlusion += cone_occlusion * weight
+
+        return np.clip(occlusion, 0.0, 1.0).astype(np.float32)
+
+def disks_from_triangles(triangles, max_size=None):
+    """
+Returns `(centers, normals, areas)` for oriented disks standing in for each of `triangles` (T×3×3.) With `max_size`,
+triangles are split until none of their edges are longer than that first.
+"""
+
+    triangles = np.asarray(triangles, dtype=np.float64).reshape((-1, 3, 3))
+
+    if max_size != None:
+        triangles = split_triangles(triangles, max_size)
+
+    cross = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+
+    areas = np.linalg.norm(cross, axis=1) * 0.5
+
+    # Degenerate triangles can't occlude anything.
+    valid = areas > 0
+
+    return triangles[valid].mean(axis=1), normalize(cross[valid]), areas[valid]
+
+class DiskTree:
+    """
+An octree of oriented disks. Every node also stores an aggregate disk standing in for everything inside it, so that
+from far enough away, a whole cluster of disks can be treated as one.
+"""
+
+    leaf_size = 16
+    max_depth = 24
+
+    def __init__(self, centers, normals, areas):
+        centers = np.asarray(centers, dtype=np.float64)
+        normals = np.asarray(normals, dtype=np.float64)
+        areas = np.asarray(areas, dtype=np.float64)
+
+        # Per node: area-weighted center, total area, bounding sphere radius, the second moment of the area-weighted
+        # normals (see `get_projected_area()`), child node indices, and (for leaves) the range of disks inside.
+        self.node_centers = []
+        self.node_areas = []
+        self.node_radii = []
+        self.node_moments = []
+        self.node_children = []
+        self.node_ranges = []
+
+        self.order = []
+
+        if len(areas):
+            self.build(centers, normals, areas, np.arange(len(areas)), 0)
+
+        # Disks are reordered so every leaf's disks are contiguous.
+        order = np.array(self.order, dtype=np.int64)
+
+        self.centers = centers[order] if len(order) else centers
+        self.normals = normals[order] if len(order) else normals
+        self.areas = areas[order] if len(order) else areas
+
+        self.node_centers = np.array(self.node_centers)
+        self.node_areas = np.array(self.node_areas)
+        self.node_radii = np.array(self.node_radii)
+        self.node_moments = np.array(self.node_moments)
+
+    def build(self, centers, normals, areas, indices, depth):
+        node = len(self.node_areas)
+
+        area = areas[indices]
+        total_area = area.sum()
+
+        center = (centers[indices] * area[:, np.newaxis]).sum(axis=0) / total_area
+
+        # Covers every disk in the node, including the disk's own radius.
+        radius = (np.linalg.norm(centers[indices] - center, axis=1) + np.sqrt(area / math.pi)).max()
+
+        weighted = normals[indices] * np.sqrt(area)[:, np.newaxis]
+
+        self.node_centers.append(center)
+        self.node_areas.append(total_area)
+        self.node_radii.append(radius)
+        self.node_moments.append(weighted.T @ weighted)
+        self.node_children.append([])
+        self.node_ranges.append(None)
+
+        if len(indices) <= self.leaf_size or depth >= self.max_depth:
+            self.node_ranges[node] = (len(self.order), len(self.order) + len(indices))
+            self.order.extend(indices.tolist())
+
+            return node
+
+        # Split into octants around the middle of the disks' bounding box.
+        points = centers[indices]
+        middle = (points.min(axis=0) + points.max(axis=0)) * 0.5
+
+        octants = ((points[:, 0] > middle[0]).astype(np.int32)) | ((points[:, 1] > middle[1]).astype(np.int32) << 1) | ((points[:, 2] > middle[2]).astype(np.int32) << 2)
+
+        # Everything's in the same spot, so splitting won't help.
+        if np.all(octants == octants[0]):
+            self.node_ranges[node] = (len(self.order), len(self.order) + len(indices))
+            self.order.extend(indices.tolist())
+
+            return node
+
+        for octant in range(8):
+            child_indices = indices[octants == octant]
+
+            if len(child_indices):
+                self.node_children[node].append(self.build(centers, normals, areas, child_indices, depth + 1))
+
+        return node
+
+    @classmethod
+    def get_projected_area(cls, area, moment, direction):
+        """
+Returns the area of an aggregate disk as seen from `direction` (N×3, normalized.) For a single disk, or disks that
+are all parallel, this is exact (`area * |normal · direction|`); otherwise it's a slight overestimate.
+"""
+
+        return np.sqrt(area * np.maximum(np.einsum("ni,ij,nj->n", direction, moment, direction), 0.0))
+
+class DiskOcclusionEngine:
+    """
+Point-based ambient occlusion: casters are turned into oriented disks (one per triangle, once big ones are split up),
+clustered into a `DiskTree`, and each point sums how much of its hemisphere each disk covers. Nearby disks are
+evaluated individually; far-away clusters are replaced by their aggregate disk, so the cost grows with O(n log n)
+rather than with the number of samples times the number of casters. No rays are cast at all.
+
+The result uses the same convention as the ray-cast engine: each disk's coverage is weighted by
+`occlusion_from_distance()` at its distance. Disks can hide behind each other, so their coverage isn't just added up;
+it's combined as if they were scattered independently (`1 - (1 - a)(1 - b)...`), so a pile of disks in the same
+direction doesn't count several times over.
+"""
+
+    # Triangles are split until no edge is longer than this fraction of `max_distance`; a single disk at the middle of a
+    # big triangle is nothing like the triangle to a point right next to it.
+    max_disk_size = 1 / 6
+
+    @classmethod
+    def create_tree(cls, triangles, max_distance):
+        """Returns the `DiskTree` for `triangles` (T×3×3, world space), for baking out to `max_distance`."""
+        return DiskTree(*disks_from_triangles(triangles, max_distance * cls.max_disk_size))
+
+    def __init__(self, tree, max_distance, power, accuracy=2.0):
+        self.tree = tree
+        self.max_distance = max_distance
+        self.power = power
+
+        # A cluster is only used in place of its disks when it's at least this many times its radius away.
+        self.accuracy = accuracy
+
+    def get_occlusion(self, positions, normals, centers, projected_areas):
+        """
+Returns the occlusion from disks with `centers` (N×3) and `projected_areas` on each point, as `-log(1 - occlusion)`,
+so it can be summed over disks.
+"""
+
+        offset = centers - positions
+
+        distance = np.maximum(np.linalg.norm(offset, axis=1), 1e-9)
+        direction = offset / distance[:, np.newaxis]
+
+        # Disks below the horizon don't count; disks right on the horizon are faded out.
+        facing = np.clip(np.einsum("ni,ni->n", normals, direction) * 4, 0.0, 1.0)
+
+        # The fraction of the hemisphere covered by a disk facing the point: 1 - cos(half the angle it subtends).
+        coverage = 1.0 - (distance / np.sqrt((distance * distance) + (projected_areas / math.pi)))
+
+        occlusion = coverage * facing * occlusion_from_distance(distance, self.max_distance, self.power)
+
+        return -np.log1p(-np.minimum(occlusion, 0.999))
+
+    def compute(self, positions, normals):
+        """Returns the occlusion (0..1) for each of `positions` (N×3, world space) with `normals` (N×3)."""
+
+        positions = np.asarray(positions, dtype=np.float64)
+        normals = normalize(np.asarray(normals, dtype=np.float64))
+
+        tree = self.tree
+
+        occlusion = np.zeros(len(positions), dtype=np.float64)
+
+        if len(tree.node_areas) == 0:
+            return occlusion.astype(np.float32)
+
+        # Each entry is a node, plus the points that still need to look inside it.
+        stack = [(0, np.arange(len(positions)))]
+
+        while stack:
+            node, indices = stack.pop()
+
+            center = tree.node_centers[node]
+            radius = tree.node_radii[node]
+
+            offset = center - positions[indices]
+            distance = np.linalg.norm(offset, axis=1)
+
+            # Nothing in this node is within reach.
+            reachable = (distance - radius) < self.max_distance
+
+            indices = indices[reachable]
+            offset = offset[reachable]
+            distance = distance[reachable]
+
+            if len(indices) == 0:
+                continue
+
+            start_end = tree.node_ranges[node]
+
+            # Leaves with only a disk or two aren't worth approximating.
+            far = distance > (radius * self.accuracy)
+
+            if start_end != None and start_end[1] - start_end[0] <= 2:
+                far[:] = False
+
+            if np.any(far):
+                far_indices = indices[far]
+
+                direction = offset[far] / distance[far][:, np.newaxis]
+
+                projected_areas = DiskTree.get_projected_area(tree.node_areas[node], tree.node_moments[node], direction)
+
+                occlusion[far_indices] += self.get_occlusion(positions[far_indices], normals[far_indices], np.broadcast_to(center, (len(far_indices), 3)), projected_areas)
+
+            indices = indices[~far]
+
+            if len(indices) == 0:
+                continue
+
+            if start_end == None:
+                for child in tree.node_children[node]:
+                    stack.append((child, indices))
+
+                continue
+
+            # A leaf: every remaining point looks at every disk individually.
+            start, end = start_end
+
+            count = end - start
+
+            leaf_positions = np.repeat(positions[indices], count, axis=0)
+            leaf_normals = np.repeat(normals[indices], count, axis=0)
+
+            leaf_centers = np.tile(tree.centers[start:end], (len(indices), 1))
+            leaf_disk_normals = np.tile(tree.normals[start:end], (len(indices), 1))
+            leaf_areas = np.tile(tree.areas[start:end], len(indices))
+
+            leaf_offset = leaf_centers - leaf_positions
+            leaf_direction = leaf_offset / np.maximum(np.linalg.norm(leaf_offset, axis=1), 1e-9)[:, np.newaxis]
+
+            projected_areas = leaf_areas * np.abs(np.einsum("ni,ni->n", leaf_direction, leaf_disk_normals))
+
+            leaf_occlusion = self.get_occlusion(leaf_positions, leaf_normals, leaf_centers, projected_areas)
+
+            occlusion[indices] += leaf_occlusion.reshape((len(indices), count)).sum(axis=1)
+
+        return (1.0 - np.exp(-occlusion)).astype(np.float32)
+
+class AdjacencyMatrix:
+    """
+A sparse, row-normalized N×N matrix in coordinate form. Blender doesn't ship SciPy, so multiplication is done with
+`np.bincount()`, which is plenty fast for a handful of passes over a mesh.
+"""
+
+    def __init__(self, rows, columns, weights, size):
+        self.size = size
+
+        keep = weights > 0
+
+        self.rows = rows[keep]
+        self.columns = columns[keep]
+
+        row_sums = np.bincount(self.rows, weights=weights[keep], minlength=size)
+
+        # Rows with no neighbors stay all-zero; see `has_neighbors`.
+        self.has_neighbors = row_sums > 0
+
+        self.weights = weights[keep] / row_sums[self.rows]
+
+    def multiply(self, values):
+        """Returns this matrix times `values` (a length-N vector.)"""
+        return np.bincount(self.rows, weights=self.weights * values[self.columns], minlength=self.size)
+
+def get_mesh_edges(loop_vertices, loop_starts, loop_totals):
+    """
+Returns `(a, b)` arrays of loop index pairs that neighbor each other: loops next to each other around a polygon, and
+loops that share a vertex. Each pair appears once.
+"""
+
+    loop_vertices = np.asarray(loop_vertices)
+
+    # Around each polygon: every loop and the one after it.
+    polygon_index = np.repeat(np.arange(len(loop_starts)), loop_totals)
+    loops = np.arange(len(loop_vertices))
+
+    following = loops + 1
+    wraps = following == (np.asarray(loop_starts) + np.asarray(loop_totals))[polygon_index]
+    following[wraps] = np.asarray(loop_starts)[polygon_index[wraps]]
+
+    a = [loops]
+    b = [following]
+
+    # Every pair of loops sharing a vertex. Loops are grouped by vertex, then groups of the same size are paired up all
+    # at once.
+    order = np.argsort(loop_vertices, kind="stable")
+    sorted_vertices = loop_vertices[order]
+
+    group_starts = np.flatnonzero(np.concatenate([[True], sorted_vertices[1:] != sorted_vertices[:-1]])) if len(order) else np.zeros(0, dtype=np.int64)
+    group_sizes = np.diff(np.concatenate([group_starts, [len(order)]]))
+
+    for size in np.unique(group_sizes):
+        if size < 2:
+            continue
+
+        starts = group_starts[group_sizes == size]
+
+        first, second = np.triu_indices(size, 1)
+
+        a.append(order[(starts[:, np.newaxis] + first).ravel()])
+        b.append(order[(starts[:, np.newaxis] + second).ravel()])
+
+    return np.concatenate(a), np.concatenate(b)
+
+def denoise(values, positions, normals, edges, strength=0.5, iterations=4, normal_sharpness=20.0):
+    """
+Smooths `values` (one per point) over the mesh, in `iterations` vectorized passes. `edges` is an `(a, b)` pair of
+point index arrays. Neighbors with similar normals and short edges count the most; neighbors across hard edges barely
+count at all, so creases stay sharp. Each pass moves every value `strength` (0..1) of the way to its neighbors' average.
+"""
+
+    values = np.asarray(values, dtype=np.float64)
+
+    a, b = edges
+
+    if len(a) == 0 or iterations <= 0 or strength <= 0:
+        return values.astype(np.float32)
+
+    positions = np.asarray(positions, dtype=np.float64)
+    normals = normalize(np.asarray(normals, dtype=np.float64))
+
+    lengths = np.linalg.norm(positions[a] - positions[b], axis=1)
+    mean_length = max(lengths.mean(), 1e-9)
+
+    similarity = np.einsum("ni,ni->n", normals[a], normals[b])
+
+    # Loops sharing a vertex have a length of zero, and get the full length weight.
+    weights = np.exp(-(1.0 - similarity) * normal_sharpness) * (mean_length / (lengths + mean_length))
+
+    # Both directions, so the matrix is symmetric before normalizing.
+    matrix = AdjacencyMatrix(np.concatenate([a, b]), np.concatenate([b, a]), np.concatenate([weights, weights]), len(values))
+
+    strength = np.where(matrix.has_neighbors, min(1.0, strength), 0.0)
+
+    for i in range(iterations):
+        values = (values * (1.0 - strength)) + (matrix.multiply(values) * strength)
+
+    return values.astype(np.float32)
+
+class ComputeThread:
+    """
+Runs `compute(start, end)` over points `start` to `end`, `chunk_size` at a time, on a worker thread, writing each
+chunk's results into `out` (preallocated, and not touched by anything else until the thread is done.) The thread
+that started it can read `position` at any time: everything before it is finished.
+"""
+
+    def __init__(self, compute, out, start, end, chunk_size):
+        self.compute = compute
+        self.out = out
+
+        self.position = start
+        self.end = end
+
+        self.chunk_size = max(1, int(chunk_size))
+
+        self.cancelled = threading.Event()
+
+        # Whatever went wrong on the thread, to be raised again by whoever checks on it.
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run, name="Vertex Oven bake", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        try:
+            while self.position < self.end and not self.cancelled.is_set():
+                end = min(self.end, self.position + self.chunk_size)
+
+                self.out[self.position:end] = self.compute(self.position, end)
+
+                # Only once the chunk is written.
+                self.position = end
+        except Exception as e:
+            self.error = e
+
+    def is_running(self):
+        return self.thread.is_alive()
+
+    def cancel(self):
+        """Stops after the chunk that's being worked on, and waits for that."""
+
+        self.cancelled.set()
+        self.thread.join()
@@ -0,0 +1,509 @@
+# Blender Vertex Oven addon
+# Copyright (C) 2019 Forest Katsch (forestcgk@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# A quality-versus-cost harness for picking defaults. For each test scene, a high-sample ray cast bake is the reference;
+# every cheaper configuration (engine, sample count, distance, skipping small objects, ...) is then baked and timed,
+# and its error against the reference is measured over every loop. This doesn't need Blender:
+#
+#     python harness.py --csv results.csv --plot results.png
+#
+# The test scenes are generated, so they're the same on every machine. Each one has a single receiver and a lot of
+# casters of very different sizes, since that's what the "Skip small objects" heuristic is about.
+#
+# Ray casting is timed with a tree per caster, since that's how the bake dialog casts; `--trees flat` times it with
+# every caster in one tree instead. The reference is always baked with one tree.
+#
+# With `--check`, it instead bakes every scene with each approximate engine at its default settings, and fails if any of
+# them is further from the reference than its tolerance in `tolerances`:
+#
+#     python harness.py --check
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+try:
+    from . import engines
+    from . import kernels
+except ImportError:
+    import engines
+    import kernels
+
+class TestScene:
+    """A receiver and the objects casting onto it, as world-space triangles."""
+
+    def __init__(self, name, receiver, casters, max_distance):
+        self.name = name
+
+        # T×3×3 triangles.
+        self.receiver = receiver
+
+        # [(object name, T×3×3 triangles)]; the receiver is one of these too, just like with "Include Active Object".
+        self.casters = [("receiver", receiver)] + casters
+
+        self.max_distance = max_distance
+
+    def get_points(self):
+        """Returns `(positions, normals)` with a point at every corner of every receiver triangle, like loops."""
+
+        positions = self.receiver.reshape((-1, 3))
+
+        normals = engines.normalize(np.cross(self.receiver[:, 1] - self.receiver[:, 0], self.receiver[:, 2] - self.receiver[:, 0]))
+
+        return positions, np.repeat(normals, 3, axis=0)
+
+    def get_casters(self, max_distance, small_object_size=0):
+        """Returns the triangles of each caster close enough to reach the receiver, skipping objects this small or smaller."""
+
+        low = self.receiver.reshape((-1, 3)).min(axis=0) - max_distance
+        high = self.receiver.reshape((-1, 3)).max(axis=0) + max_distance
+
+        triangles = []
+
+        for name, caster in self.casters:
+            points = caster.reshape((-1, 3))
+
+            # The same as `Object.dimensions.length`.
+            if np.linalg.norm(points.max(axis=0) - points.min(axis=0)) <= small_object_size:
+                continue
+
+            if np.any(points.max(axis=0) < low) or np.any(points.min(axis=0) > high):
+                continue
+
+            triangles.append(caster)
+
+        return triangles
+
+    def get_caster_triangles(self, max_distance, small_object_size=0):
+        """Returns the triangles of every caster from `get_casters()` in one array."""
+
+        casters = self.get_casters(max_distance, small_object_size)
+
+        if len(casters) == 0:
+            return np.zeros((0, 3, 3))
+
+        return np.concatenate(casters)
+
+def make_box(center, size):
+    """Returns the 12 triangles of an axis-aligned box."""
+
+    center = np.asarray(center, dtype=np.float64)
+    half = np.asarray(size, dtype=np.float64) * 0.5
+
+    corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float64) * half + center
+
+    faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+
+    triangles = []
+
+    for a, b, c, d in faces:
+        triangles.append(corners[[a, b, c]])
+        triangles.append(corners[[a, c, d]])
+
+    return np.array(triangles)
+
+def make_grid(size, resolution, height=None):
+    """Returns a square grid of triangles centered on the origin, optionally displaced by `height(x, y)`."""
+
+    x, y = np.meshgrid(np.linspace(-size / 2, size / 2, resolution + 1), np.linspace(-size / 2, size / 2, resolution + 1))
+
+    z = np.zeros_like(x) if height == None else height(x, y)
+
+    vertices = np.stack([x, y, z], axis=-1)
+
+    quads = np.stack([vertices[:-1, :-1], vertices[:-1, 1:], vertices[1:, 1:], vertices[1:, :-1]], axis=2).reshape((-1, 4, 3))
+
+    return np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+
+def make_terrain_scene(resolution, random):
+    """Rolling terrain with rocks from pebbles to boulders scattered across it."""
+
+    height = lambda x, y: (0.5 * np.sin(x * 0.9) * np.cos(y * 0.7)) + (0.15 * np.sin(x * 3.1 + y * 2.3))
+
+    receiver = make_grid(10, resolution, height)
+
+    casters = []
+
+    for i in range(300):
+        x, y = random.uniform(-5, 5, 2)
+
+        # Mostly small, a few big.
+        size = np.clip(random.lognormal(-2.0, 0.9, 3), 0.01, 2.0)
+
+        casters.append(("rock {}".format(i), make_box((x, y, height(x, y) + size[2] * 0.3), size)))
+
+    return TestScene("terrain", receiver, casters, 3.0)
+
+def make_room_scene(resolution, random):
+    """A floor inside a room, with furniture and a lot of clutter on it."""
+
+    receiver = make_grid(6, resolution)
+
+    casters = [
+        ("walls", make_box((0, 0, 1.5), (6.2, 6.2, 3.0))[::-1]),
+        ("table", make_box((0.5, 0.5, 0.75), (2.0, 1.0, 0.05))),
+        ("shelf", make_box((-2.6, 0, 1.0), (0.4, 3.0, 2.0))),
+    ]
+
+    for x in (-0.45, 1.45):
+        for y in (0.05, 0.95):
+            casters.append(("table leg", make_box((x, y, 0.375), (0.05, 0.05, 0.75))))
+
+    for i in range(200):
+        x, y = random.uniform(-2.8, 2.8, 2)
+        size = random.uniform(0.02, 0.2, 3)
+
+        casters.append(("clutter {}".format(i), make_box((x, y, size[2] * 0.5), size)))
+
+    return TestScene("room", receiver, casters, 3.0)
+
+def make_city_scene(resolution, random):
+    """A city block: a street grid of tall buildings, with street furniture on the ground between them."""
+
+    receiver = make_grid(40, resolution)
+
+    casters = []
+
+    for x in np.linspace(-15, 15, 5):
+        for y in np.linspace(-15, 15, 5):
+            # Not quite 5 wide, so the walls don't run exactly through the receiver's vertices, where rays graze them.
+            casters.append(("building", make_box((x, y, 0), (4.8, 4.8, random.uniform(6, 40)))))
+
+    for i in range(500):
+        x, y = random.uniform(-20, 20, 2)
+        size = random.uniform(0.1, 0.8, 3)
+
+        casters.append(("prop {}".format(i), make_box((x, y, size[2] * 0.5), size)))
+
+    return TestScene("city", receiver, casters, 3.0)
+
+scene_makers = {
+    "terrain": make_terrain_scene,
+    "room": make_room_scene,
+    "city": make_city_scene,
+}
+
+def get_directions(sample_count, seed=0):
+    """Uniformly distributed directions on the sphere; they're reflected into each point's hemisphere."""
+    return engines.normalize(np.random.RandomState(seed).normal(0, 1, (sample_count, 3)))
+
+def bake(scene, config, backend, trees="flat"):
+    """
+Bakes `scene` with `config` and returns `(ao, seconds)`; the time includes building the engine. With `trees` set to
+"per-object", ray casting builds a tree for each caster and casts every ray against all of them, the way the bake
+dialog does; "flat" puts every caster in one tree, which is quicker and gives the same answer.
+"""
+
+    positions, normals = scene.get_points()
+
+    max_distance = config.get("max_distance", scene.max_distance)
+
+    start_time = time.time()
+
+    triangles = scene.get_caster_triangles(max_distance, config.get("small_object_size", 0))
+
+    engine = config.get("engine", "raycast")
+
+    if engine == "voxel":
+        tiles = engines.VoxelTiles(triangles, max_distance / config["voxel_resolution"], max_distance, (positions.min(axis=0), positions.max(axis=0)))
+
+        ao = engines.VoxelConeEngine(tiles, max_distance, config.get("power", 0.5)).compute(positions, normals)
+
+    elif engine == "disks":
+        tree = engines.DiskOcclusionEngine.create_tree(triangles, max_distance)
+
+        ao = engines.DiskOcclusionEngine(tree, max_distance, config.get("power", 0.5), config["disk_accuracy"]).compute(positions, normals)
+
+    elif trees == "per-object":
+        bvhs = [kernels.TriangleBVH(caster) for caster in scene.get_casters(max_distance, config.get("small_object_size", 0))]
+
+        directions = get_directions(config["sample_count"], config.get("seed", 0))
+
+        # A million rays at a time keeps memory in check for the NumPy backend.
+        chunk_size = max(1, 1000000 // len(directions))
+
+        ao = np.zeros(len(positions))
+
+        for start in range(0, len(positions), chunk_size):
+            end = min(len(positions), start + chunk_size)
+
+            origins, rays = kernels.get_hemisphere_rays(positions[start:end], normals[start:end], directions)
+
+            distance = np.full(len(origins), max_distance, dtype=np.float64)
+
+            for bvh in bvhs:
+                distance = np.minimum(distance, backend.intersect(bvh, origins, rays, max_distance))
+
+            ao[start:end] = engines.occlusion_from_distance(distance, max_distance, config.get("power", 0.5)).reshape((end - start, len(directions))).mean(axis=1)
+
+    else:
+        bvh = kernels.TriangleBVH(triangles)
+
+        ray_cast = kernels.RayCastEngine(bvh, max_distance, config.get("power", 0.5), backend)
+
+        directions = get_directions(config["sample_count"], config.get("seed", 0))
+
+        # A million rays at a time keeps memory in check for the NumPy backend.
+        chunk_size = max(1, 1000000 // len(directions))
+
+        ao = np.concatenate([ray_cast.compute(positions[start:start + chunk_size], normals[start:start + chunk_size], directions) for start in range(0, len(positions), chunk_size)])
+
+    return np.asarray(ao, dtype=np.float64), time.time() - start_time
+
+# {engine: (config, the most RMSE against the reference it may have on any test scene)}. For scale, ray casting with 8
+# samples is about 0.18 from the reference, and with 16 samples about 0.1.
+tolerances = {
+    "voxel": ({"engine": "voxel", "voxel_resolution": 32}, 0.2),
+    "disks": ({"engine": "disks", "disk_accuracy": 2.0}, 0.2),
+}
+
+def get_tolerance(config):
+    """Returns the most RMSE `config`'s engine may have (from `tolerances`), or `None` if it doesn't have a limit."""
+
+    engine = config.get("engine", "raycast")
+
+    if engine in tolerances:
+        return tolerances[engine][1]
+
+    return None
+
+def get_errors(ao, reference):
+    """Returns `{"rmse", "max", "p95", "p99"}` for the per-loop error of `ao` against `reference`."""
+
+    error = np.abs(ao - reference)
+
+    return {
+        "rmse": float(np.sqrt(np.mean(error * error))),
+        "max": float(error.max()),
+        "p95": float(np.percentile(error, 95)),
+        "p99": float(np.percentile(error, 99)),
+    }
+
+def get_default_configs():
+    """The configurations to compare: the engines, the sample counts and distances, and skipping small objects."""
+
+    configs = []
+
+    for sample_count in (8, 16, 32, 64, 128):
+        configs.append({"engine": "raycast", "sample_count": sample_count})
+
+    # A shorter distance is cheaper, but misses distant occluders.
+    for max_distance in (0.75, 1.5):
+        configs.append({"engine": "raycast", "sample_count": 32, "max_distance": max_distance})
+
+    # "Skip small objects", at the default sample count; 0.1 is the addon's default size.
+    for small_object_size in (0.05, 0.1, 0.25, 0.5, 1.0):
+        configs.append({"engine": "raycast", "sample_count": 32, "small_object_size": small_object_size})
+
+    for voxel_resolution in (16, 32, 64):
+        configs.append({"engine": "voxel", "voxel_resolution": voxel_resolution})
+
+    for disk_accuracy in (1.5, 2.0, 4.0):
+        configs.append({"engine": "disks", "disk_accuracy": disk_accuracy})
+
+    return configs
+
+def describe(config):
+    """Returns a short, human-readable name for `config`."""
+
+    engine = config.get("engine", "raycast")
+
+    if engine == "voxel":
+        text = "voxel {}".format(config["voxel_resolution"])
+    elif engine == "disks":
+        text = "disks {:g}".format(config["disk_accuracy"])
+    else:
+        text = "raycast {}".format(config["sample_count"])
+
+    if "max_distance" in config:
+        text += ", distance {:g}".format(config["max_distance"])
+
+    if config.get("small_object_size", 0) > 0:
+        text += ", skip < {:g}".format(config["small_object_size"])
+
+    return text
+
+def get_pareto_front(rows):
+    """Returns the rows that no other row beats on both time and RMSE, fastest first."""
+
+    front = []
+
+    for row in sorted(rows, key=lambda row: (row["seconds"], row["rmse"])):
+        if len(front) == 0 or row["rmse"] < front[-1]["rmse"]:
+            front.append(row)
+
+    return front
+
+def run(scene_names, configs, resolution=64, reference_samples=1024, backend_name="auto", seed=0, trees="per-object"):
+    """Runs every config on every scene and returns a list of result rows (dictionaries.)"""
+
+    backend = kernels.get_backend(backend_name)
+
+    # Compile (or whatever else a backend does the first time) before anything is timed.
+    box = kernels.TriangleBVH(make_box((0, 0, 0), (1, 1, 1)))
+
+    kernels.RayCastEngine(box, 1.0, 0.5, backend).compute(np.zeros((1, 3)), np.array([[0.0, 0.0, 1.0]]), get_directions(4))
+    backend.intersect(box, np.zeros((1, 3)), np.array([[0.0, 0.0, 1.0]]), 1.0)
+
+    rows = []
+
+    for scene_name in scene_names:
+        scene = scene_makers[scene_name](resolution, np.random.RandomState(seed))
+
+        print("Scene '{}': {} loops, {} casters".format(scene.name, len(scene.receiver) * 3, len(scene.casters)))
+
+        reference, reference_seconds = bake(scene, {"engine": "raycast", "sample_count": reference_samples, "seed": seed + 1}, backend)
+
+        print("  reference ({} samples): {:.2f} seconds".format(reference_samples, reference_seconds))
+
+        for config in configs:
+            ao, seconds = bake(scene, dict(config, seed=seed), backend, trees)
+
+            row = {"scene": scene.name, "config": describe(config), "seconds": seconds}
+            row.update(get_errors(ao, reference))
+
+            rows.append(row)
+
+            tolerance = get_tolerance(config)
+
+            # Anything past its engine's tolerance is wrong, not just rough; say so right next to the numbers.
+            if tolerance != None and row["rmse"] > tolerance:
+                warning = "  OUT OF TOLERANCE (at most {:.4f})".format(tolerance)
+            else:
+                warning = ""
+
+            print("  {:<32} {:8.3f}s  rmse {:.4f}  p95 {:.4f}  p99 {:.4f}  max {:.4f}{}".format(row["config"], seconds, row["rmse"], row["p95"], row["p99"], row["max"], warning))
+
+        print("  Best quality for the time (fastest first):")
+
+        for row in get_pareto_front([row for row in rows if row["scene"] == scene.name]):
+            print("    {:<30} {:8.3f}s  rmse {:.4f}".format(row["config"], row["seconds"], row["rmse"]))
+
+    return rows
+
+def check(scene_names, resolution=32, reference_samples=512, backend_name="auto", seed=0):
+    """Bakes every scene with each engine in `tolerances`, and returns a message for each one that's out of tolerance."""
+
+    backend = kernels.get_backend(backend_name)
+
+    failures = []
+
+    for scene_name in scene_names:
+        scene = scene_makers[scene_name](resolution, np.random.RandomState(seed))
+
+        reference, reference_seconds = bake(scene, {"engine": "raycast", "sample_count": reference_samples, "seed": seed + 1}, backend)
+
+        for engine, (config, tolerance) in tolerances.items():
+            ao, seconds = bake(scene, config, backend)
+
+            rmse = get_errors(ao, reference)["rmse"]
+
+            print("{:<10} {:<20} rmse {:.4f} (at most {:.4f})  {}".format(scene.name, describe(config), rmse, tolerance, "ok" if rmse <= tolerance else "FAILED"))
+
+            if rmse > tolerance:
+                failures.append("'{}' is {:.4f} from the reference on '{}', more than {:.4f}".format(describe(config), rmse, scene.name, tolerance))
+
+    return failures
+
+def write_csv(path, rows):
+    columns = ["scene", "config", "seconds", "rmse", "p95", "p99", "max"]
+
+    with open(path, "w") as f:
+        f.write(",".join(columns) + "\n")
+
+        for row in rows:
+            f.write(",".join('"{}"'.format(row[column]) if isinstance(row[column], str) else "{:.6g}".format(row[column]) for column in columns) + "\n")
+
+def write_plot(path, rows):
+    """Plots RMSE against time for every scene. Needs matplotlib, which Blender doesn't ship."""
+
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib isn't installed, so there's no plot; use the CSV instead")
+        return False
+
+    scene_names = sorted(set(row["scene"] for row in rows))
+
+    figure, axes = plt.subplots(1, len(scene_names), figsize=(6 * len(scene_names), 5), squeeze=False)
+
+    for axis, scene_name in zip(axes[0], scene_names):
+        scene_rows = [row for row in rows if row["scene"] == scene_name]
+
+        for row in scene_rows:
+            axis.scatter(row["seconds"], row["rmse"], s=12)
+            axis.annotate(row["config"], (row["seconds"], row["rmse"]), fontsize=6)
+
+        front = get_pareto_front(scene_rows)
+        axis.plot([row["seconds"] for row in front], [row["rmse"] for row in front], linestyle="--", linewidth=1)
+
+        axis.set_xscale("log")
+        axis.set_yscale("log")
+        axis.set_xlabel("seconds")
+        axis.set_ylabel("RMSE against the reference")
+        axis.set_title(scene_name)
+
+    figure.tight_layout()
+    figure.savefig(path, dpi=150)
+
+    return True
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Measures the quality and cost of Vertex Oven bake settings against a high-sample reference.")
+
+    parser.add_argument("--scenes", default=",".join(scene_makers.keys()), help="comma-separated test scenes ({})".format(", ".join(scene_makers.keys())))
+    parser.add_argument("--resolution", type=int, default=64, help="receiver grid resolution; the loop count is 6 times this squared")
+    parser.add_argument("--reference-samples", type=int, default=1024, help="samples per loop for the reference bake")
+    parser.add_argument("--backend", default="auto", choices=["auto"] + list(kernels.backends.keys()), help="the ray casting kernel backend")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", help="write every result to this CSV file")
+    parser.add_argument("--plot", help="plot RMSE against time to this image (needs matplotlib)")
+    parser.add_argument("--trees", default="per-object", choices=["per-object", "flat"], help="time ray casting with a tree per caster, like the bake dialog, or one tree for everything")
+    parser.add_argument("--check", action="store_true", help="only check that each approximate engine is close enough to the reference")
+
+    arguments = parser.parse_args(arguments)
+
+    scene_names = [name.strip() for name in arguments.scenes.split(",") if name.strip()]
+
+    for name in scene_names:
+        if name not in scene_makers:
+            parser.error("there's no test scene called '{}'".format(name))
+
+    if arguments.check:
+        failures = check(scene_names, backend_name=arguments.backend, seed=arguments.seed)
+
+        for failure in failures:
+            print(failure)
+
+        return 1 if failures else 0
+
+    rows = run(scene_names, get_default_configs(), arguments.resolution, arguments.reference_samples, arguments.backend, arguments.seed, arguments.trees)
+
+    if arguments.csv:
+        write_csv(arguments.csv, rows)
+
+    if arguments.plot:
+        write_plot(arguments.plot, rows)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,237 @@
+# Blender Vertex Oven addon
+# Copyright (C) 2019 Forest Katsch (forestcgk@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Sharded bake jobs. Blender exports a job directory; any number of worker processes (on any number of machines that
+# can see the directory) bake their share of it with the `kernels` backends, and Blender imports the results. Like `engines`,
+# nothing in here may import `bpy` or `mathutils`, so workers don't need Blender at all:
+#
+#     python jobs.py <job directory> --shard 0 --shard-count 4
+#
+# A job directory holds:
+#
+#     job.json               the work units (ranges of points on one receiver)
+#     scene.vosnap           a scene snapshot (see `snapshot`) with the options, casters, receivers and sample directions
+#     results/unit_<n>.npy   written by workers; the occlusion for each point in one work unit
+#
+# Workers memory-map the snapshot, so each one only reads the parts of the scene it needs.
+#
+# Every point's result only depends on the point, the casters and the directions, so it doesn't matter how the units
+# are split between workers, or how many times a worker is restarted.
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+try:
+    from . import kernels
+    from . import snapshot
+except ImportError:
+    import kernels
+    import snapshot
+
+job_version = 2
+
+# The number of points in each work unit.
+unit_size = 65536
+
+class JobError(Exception):
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+def save_atomic(path, array):
+    """Saves `array` to `path` (.npy) so that a crash never leaves a half-written file behind."""
+
+    temporary_path = path + ".tmp.npy"
+
+    np.save(temporary_path, array)
+
+    os.replace(temporary_path, path)
+
+def write_job(directory, options, casters, instances, receivers, directions):
+    """Writes a job to `directory`. The arguments are the same as `snapshot.write_snapshot()`'s."""
+
+    os.makedirs(os.path.join(directory, "results"), exist_ok=True)
+
+    # Results from an earlier job in the same directory won't match this one.
+    for filename in os.listdir(os.path.join(directory, "results")):
+        os.remove(os.path.join(directory, "results", filename))
+
+    snapshot.write_snapshot(get_snapshot_path(directory), options, casters, instances, receivers, directions)
+
+    units = []
+
+    for receiver_index, receiver in enumerate(receivers):
+        point_count = len(receiver["loop_indices"])
+
+        for start in range(0, point_count, unit_size):
+            units.append([receiver_index, start, min(point_count, start + unit_size)])
+
+    job = {
+        "version": job_version,
+        "units": units,
+    }
+
+    # The job file goes last; until it exists, workers won't start.
+    temporary_path = os.path.join(directory, "job.json.tmp")
+
+    with open(temporary_path, "w") as f:
+        json.dump(job, f, indent=2)
+
+    os.replace(temporary_path, os.path.join(directory, "job.json"))
+
+    return job
+
+def get_snapshot_path(directory):
+    return os.path.join(directory, "scene.vosnap")
+
+def open_snapshot(directory):
+    """Returns the job's `snapshot.Snapshot`."""
+
+    try:
+        return snapshot.Snapshot(get_snapshot_path(directory))
+    except snapshot.SnapshotError as e:
+        raise JobError(e.message)
+
+def read_job(directory):
+    path = os.path.join(directory, "job.json")
+
+    if not os.path.exists(path):
+        raise JobError("There's no bake job in '{}'".format(directory))
+
+    with open(path) as f:
+        job = json.load(f)
+
+    if job.get("version") != job_version:
+        raise JobError("The bake job in '{}' was made by a different version of Vertex Oven".format(directory))
+
+    return job
+
+def get_result_path(directory, unit):
+    return os.path.join(directory, "results", "unit_{:06d}.npy".format(unit))
+
+def get_shard_units(job, shard, shard_count):
+    """Returns the indices of the work units that belong to `shard` (0 to `shard_count` - 1.)"""
+
+    unit_count = len(job["units"])
+
+    # Contiguous runs, so each worker builds as few receivers' trees as possible.
+    return list(range((unit_count * shard) // shard_count, (unit_count * (shard + 1)) // shard_count))
+
+def get_missing_units(directory, job):
+    return [unit for unit in range(len(job["units"])) if not os.path.exists(get_result_path(directory, unit))]
+
+def run_worker(directory, shard=0, shard_count=1, backend_name="auto"):
+    """Bakes every work unit in `shard` that doesn't have a result yet. Returns the number of units baked."""
+
+    job = read_job(directory)
+
+    scene = open_snapshot(directory)
+
+    directions = np.asarray(scene.get_directions())
+
+    backend = kernels.get_backend(backend_name)
+
+    units = get_shard_units(job, shard, shard_count)
+
+    print("Shard {}/{}: {} work unit(s), using the {} backend".format(shard + 1, shard_count, len(units), backend.label))
+
+    engine = None
+    engine_receiver_index = None
+
+    baked_count = 0
+
+    for unit in units:
+        path = get_result_path(directory, unit)
+
+        # Already done, probably by an earlier run of this worker.
+        if os.path.exists(path):
+            continue
+
+        receiver_index, start, end = job["units"][unit]
+
+        if receiver_index != engine_receiver_index:
+            world_positions, world_normals = snapshot.get_world_points(scene, receiver_index)
+
+            engine = snapshot.create_engine(scene, world_positions, backend)
+            engine_receiver_index = receiver_index
+
+        start_time = time.time()
+
+        save_atomic(path, snapshot.bake_points(engine, world_positions[start:end], world_normals[start:end], directions))
+
+        baked_count += 1
+
+        print("Baked unit {} ('{}', points {}-{}) in {:.2f} seconds".format(unit, scene.receivers[receiver_index]["name"], start, end, time.time() - start_time))
+
+    return baked_count
+
+def read_results(directory, job, receiver_index):
+    """Returns the occlusion for every point on one receiver, assembled from its work units."""
+
+    # Units cover every point, in order.
+    point_count = max([end for unit_receiver_index, start, end in job["units"] if unit_receiver_index == receiver_index] + [0])
+
+    ao = np.zeros(point_count, dtype=np.float32)
+
+    for unit, (unit_receiver_index, start, end) in enumerate(job["units"]):
+        if unit_receiver_index != receiver_index:
+            continue
+
+        path = get_result_path(directory, unit)
+
+        if not os.path.exists(path):
+            raise JobError("Work unit {} hasn't been baked yet".format(unit))
+
+        result = np.load(path)
+
+        if len(result) != end - start:
+            raise JobError("The result for work unit {} is the wrong size".format(unit))
+
+        ao[start:end] = result
+
+    return ao
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Bakes part of a Vertex Oven bake job.")
+
+    parser.add_argument("directory", help="the job directory exported from Blender")
+    parser.add_argument("--shard", type=int, default=0, help="which share of the job to bake, from 0 to the shard count - 1")
+    parser.add_argument("--shard-count", type=int, default=1, help="how many shares the job is split into")
+    parser.add_argument("--backend", default="auto", choices=["auto"] + list(kernels.backends.keys()), help="the ray casting kernel backend")
+
+    arguments = parser.parse_args(arguments)
+
+    if arguments.shard_count < 1 or not (0 <= arguments.shard < arguments.shard_count):
+        parser.error("--shard must be between 0 and --shard-count - 1")
+
+    try:
+        run_worker(arguments.directory, arguments.shard, arguments.shard_count, arguments.backend)
+    except JobError as e:
+        print(e.message)
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,610 @@
+# Blender Vertex Oven addon
+# Copyright (C) 2019 Forest Katsch (forestcgk@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Ray casting kernels. Like `engines`, nothing in here may import `bpy` or `mathutils`. Casters are flattened into a
+# single `TriangleBVH`, and a `KernelBackend` casts every ray against it. The NumPy backend always works; the Numba
+# backend is JIT-compiled, and is only available if Numba can be imported from Blender's Python.
+#
+# To check that every available backend agrees, run this file directly (`python kernels.py`), or call
+# `check_conformance()` from Blender's Python console.
+
+import sys
+import time
+import threading
+
+import numpy as np
+
+try:
+    from . import engines
+except ImportError:
+    import engines
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Rays start this far above the surface, so they don't hit the triangle they started on.
+ray_offset = 0.00005
+
+# `bake_ao()` can be called while the bake dialog's worker thread is running a parallel kernel, so every call to one
+# holds this. Numba's "workqueue" threading layer can't run two at once, and the others would only split the same cores.
+kernel_lock = threading.Lock()
+
+class TriangleBVH:
+    """
+A bounding volume hierarchy over a triangle soup, stored as flat arrays so any backend can walk it. Nodes are split at
+the median along their longest axis; the two children of a node are always next to each other.
+"""
+
+    leaf_size = 8
+
+    def __init__(self, triangles):
+        triangles = np.asarray(triangles, dtype=np.float64).reshape((-1, 3, 3))
+
+        centroids = triangles.mean(axis=1)
+        lows = triangles.min(axis=1)
+        highs = triangles.max(axis=1)
+
+        order = np.arange(len(triangles))
+
+        # Per node: bounds, the index of the first child (-1 for leaves), the axis the children were split along, and
+        # (for leaves) the range of triangles.
+        node_min = []
+        node_max = []
+        node_children = []
+        node_axes = []
+        node_start = []
+        node_count = []
+
+        def add_node():
+            node_min.append(None)
+            node_max.append(None)
+            node_children.append(-1)
+            node_axes.append(0)
+            node_start.append(0)
+            node_count.append(0)
+
+            return len(node_min) - 1
+
+        stack = []
+
+        if len(triangles):
+            stack.append((add_node(), 0, len(triangles)))
+
+        while stack:
+            node, start, end = stack.pop()
+
+            indices = order[start:end]
+
+            node_min[node] = lows[indices].min(axis=0)
+            node_max[node] = highs[indices].max(axis=0)
+
+            if end - start <= self.leaf_size:
+                node_start[node] = start
+                node_count[node] = end - start
+
+                continue
+
+            points = centroids[indices]
+            axis = np.argmax(points.max(axis=0) - points.min(axis=0))
+
+            middle = (end - start) // 2
+
+            order[start:end] = indices[np.argpartition(points[:, axis], middle)]
+
+            child = add_node()
+            add_node()
+
+            node_children[node] = child
+            node_axes[node] = axis
+
+            stack.append((child, start, start + middle))
+            stack.append((child + 1, start + middle, end))
+
+        self.node_min = np.array(node_min, dtype=np.float64).reshape((-1, 3))
+        self.node_max = np.array(node_max, dtype=np.float64).reshape((-1, 3))
+        self.node_children = np.array(node_children, dtype=np.int64)
+        self.node_axes = np.array(node_axes, dtype=np.int64)
+        self.node_start = np.array(node_start, dtype=np.int64)
+        self.node_count = np.array(node_count, dtype=np.int64)
+
+        # Triangles are reordered so every leaf's triangles are contiguous, and stored the way ray tests want them.
+        triangles = triangles[order]
+
+        self.v0 = np.ascontiguousarray(triangles[:, 0])
+        self.e1 = np.ascontiguousarray(triangles[:, 1] - triangles[:, 0])
+        self.e2 = np.ascontiguousarray(triangles[:, 2] - triangles[:, 0])
+
+    def __len__(self):
+        return len(self.v0)
+
+def intersect_triangles(origins, directions, v0, e1, e2):
+    """
+Möller-Trumbore, for N rays against N triangles (pairwise.) Returns the distance along each ray to its triangle, or
+infinity if it misses. Both sides of a triangle count, just like Blender's `BVHTree.ray_cast()`.
+"""
+
+    p = np.cross(directions, e2)
+    determinant = np.einsum("ni,ni->n", e1, p)
+
+    valid = np.abs(determinant) > 1e-12
+    inverse_determinant = 1.0 / np.where(valid, determinant, 1.0)
+
+    s = origins - v0
+    u = np.einsum("ni,ni->n", s, p) * inverse_determinant
+
+    q = np.cross(s, e1)
+    v = np.einsum("ni,ni->n", directions, q) * inverse_determinant
+
+    t = np.einsum("ni,ni->n", e2, q) * inverse_determinant
+
+    hit = valid & (u >= 0) & (v >= 0) & ((u + v) <= 1) & (t > 0)
+
+    return np.where(hit, t, np.inf)
+
+def get_hemisphere_rays(positions, normals, directions):
+    """
+Returns `(origins, directions)` with one ray per point per direction (N×S rays, point-major.) Directions below a
+point's surface are reflected above it, the same as `BakeAO.calculate_vertex_ao()`.
+"""
+
+    dots = normals @ directions.T
+
+    rays = directions[np.newaxis, :, :] - ((2 * np.minimum(dots, 0))[:, :, np.newaxis] * normals[:, np.newaxis, :])
+
+    origins = np.repeat(positions + (normals * ray_offset), len(directions), axis=0)
+
+    return origins, rays.reshape((-1, 3))
+
+class KernelBackend:
+    """
+The interface every backend implements. `intersect()` is the only thing a backend has to provide; backends that can
+do better than building every ray up front (like the JIT-compiled one) can override `compute()` too.
+"""
+
+    name = None
+    label = None
+
+    # Roughly how many rays to cast each time the bake operator updates.
+    rays_per_update = 50000
+
+    # Whether the backend lets go of the GIL while it casts. Only then is it worth running on a worker thread; otherwise
+    # Blender would be just as stuck waiting for it.
+    releases_gil = False
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def prepare(self):
+        """Called on the main thread before the backend is used from a worker thread."""
+        pass
+
+    def intersect(self, bvh, origins, directions, max_distance):
+        """Returns the distance to the nearest triangle in `bvh` along each ray, or `max_distance` if it's further."""
+        raise NotImplementedError
+
+    def compute(self, bvh, positions, normals, directions, max_distance, power):
+        """
+Returns the occlusion (0..1) for each of `positions` (N×3, world space) with `normals` (N×3, normalized), averaged
+over the sample `directions` (S×3.)
+"""
+
+        origins, rays = get_hemisphere_rays(positions, normals, directions)
+
+        distance = self.intersect(bvh, origins, rays, max_distance)
+
+        return engines.occlusion_from_distance(distance, max_distance, power).reshape((len(positions), len(directions))).mean(axis=1)
+
+class NumpyBackend(KernelBackend):
+    """Walks the tree once for a whole packet of rays, testing every ray that reaches a leaf against all of its triangles."""
+
+    name = "numpy"
+    label = "NumPy"
+
+    def intersect(self, bvh, origins, directions, max_distance):
+        nearest = np.full(len(origins), max_distance, dtype=np.float64)
+
+        if len(bvh) == 0:
+            return nearest
+
+        # Axis-aligned rays would divide by zero.
+        inverse = 1.0 / np.where(np.abs(directions) < 1e-12, np.copysign(1e-12, directions), directions)
+
+        # Each entry is a node, plus the rays that still need to look inside it.
+        stack = [(0, np.arange(len(origins)))]
+
+        while stack:
+            node, indices = stack.pop()
+
+            low = (bvh.node_min[node] - origins[indices]) * inverse[indices]
+            high = (bvh.node_max[node] - origins[indices]) * inverse[indices]
+
+            near = np.minimum(low, high).max(axis=1)
+            far = np.maximum(low, high).min(axis=1)
+
+            # Rays that miss the box, or have already hit something closer.
+            indices = indices[(near <= far) & (far >= 0) & (near < nearest[indices])]
+
+            if len(indices) == 0:
+                continue
+
+            child = bvh.node_children[node]
+
+            if child >= 0:
+                stack.append((child + 1, indices))
+                stack.append((child, indices))
+
+                continue
+
+            start = bvh.node_start[node]
+            count = bvh.node_count[node]
+
+            rays = np.repeat(indices, count)
+            triangles = np.tile(np.arange(start, start + count), len(indices))
+
+            distance = intersect_triangles(origins[rays], directions[rays], bvh.v0[triangles], bvh.e1[triangles], bvh.e2[triangles])
+
+            nearest[indices] = np.minimum(nearest[indices], distance.reshape((len(indices), count)).min(axis=1))
+
+        return nearest
+
+if numba != None:
+
+    @numba.njit(nogil=True, cache=True)
+    def nearest_hit_numba(ox, oy, oz, dx, dy, dz, max_distance, stack, node_min, node_max, node_children, node_axes, node_start, node_count, v0, e1, e2):
+        ix = 1.0 / dx if abs(dx) > 1e-12 else (1e12 if dx >= 0 else -1e12)
+        iy = 1.0 / dy if abs(dy) > 1e-12 else (1e12 if dy >= 0 else -1e12)
+        iz = 1.0 / dz if abs(dz) > 1e-12 else (1e12 if dz >= 0 else -1e12)
+
+        nearest = max_distance
+
+        stack[0] = 0
+        top = 1
+
+        while top > 0:
+            top -= 1
+            node = stack[top]
+
+            tx0 = (node_min[node, 0] - ox) * ix
+            tx1 = (node_max[node, 0] - ox) * ix
+            ty0 = (node_min[node, 1] - oy) * iy
+            ty1 = (node_max[node, 1] - oy) * iy
+            tz0 = (node_min[node, 2] - oz) * iz
+            tz1 = (node_max[node, 2] - oz) * iz
+
+            near = max(min(tx0, tx1), min(ty0, ty1), min(tz0, tz1))
+            far = min(max(tx0, tx1), max(ty0, ty1), max(tz0, tz1))
+
+            if near > far or far < 0 or near >= nearest:
+                continue
+
+            child = node_children[node]
+
+            if child >= 0:
+                # The first child has the lower half along the split axis; visit whichever side the ray starts in
+                # first, so nearby hits are found early and cut off the rest of the walk.
+                axis = node_axes[node]
+
+                if (dx, dy, dz)[axis] < 0:
+                    stack[top] = child
+                    stack[top + 1] = child + 1
+                else:
+                    stack[top] = child + 1
+                    stack[top + 1] = child
+
+                top += 2
+
+                continue
+
+            for triangle in range(node_start[node], node_start[node] + node_count[node]):
+                e1x, e1y, e1z = e1[triangle, 0], e1[triangle, 1], e1[triangle, 2]
+                e2x, e2y, e2z = e2[triangle, 0], e2[triangle, 1], e2[triangle, 2]
+
+                px = (dy * e2z) - (dz * e2y)
+                py = (dz * e2x) - (dx * e2z)
+                pz = (dx * e2y) - (dy * e2x)
+
+                determinant = (e1x * px) + (e1y * py) + (e1z * pz)
+
+                if abs(determinant) <= 1e-12:
+                    continue
+
+                inverse_determinant = 1.0 / determinant
+
+                sx = ox - v0[triangle, 0]
+                sy = oy - v0[triangle, 1]
+                sz = oz - v0[triangle, 2]
+
+                u = ((sx * px) + (sy * py) + (sz * pz)) * inverse_determinant
+
+                if u < 0:
+                    continue
+
+                qx = (sy * e1z) - (sz * e1y)
+                qy = (sz * e1x) - (sx * e1z)
+                qz = (sx * e1y) - (sy * e1x)
+
+                v = ((dx * qx) + (dy * qy) + (dz * qz)) * inverse_determinant
+
+                if v < 0 or u + v > 1:
+                    continue
+
+                t = ((e2x * qx) + (e2y * qy) + (e2z * qz)) * inverse_determinant
+
+                if t > 0 and t < nearest:
+                    nearest = t
+
+        return nearest
+
+    @numba.njit(nogil=True, parallel=True, cache=True)
+    def intersect_numba(origins, directions, max_distance, node_min, node_max, node_children, node_axes, node_start, node_count, v0, e1, e2):
+        nearest = np.empty(origins.shape[0])
+
+        for i in numba.prange(origins.shape[0]):
+            stack = np.empty(128, dtype=np.int64)
+
+            nearest[i] = nearest_hit_numba(origins[i, 0], origins[i, 1], origins[i, 2], directions[i, 0], directions[i, 1], directions[i, 2], max_distance, stack, node_min, node_max, node_children, node_axes, node_start, node_count, v0, e1, e2)
+
+        return nearest
+
+    @numba.njit(nogil=True, parallel=True, cache=True)
+    def compute_numba(positions, normals, directions, max_distance, power, offset, node_min, node_max, node_children, node_axes, node_start, node_count, v0, e1, e2):
+        occlusion = np.empty(positions.shape[0])
+
+        for i in numba.prange(positions.shape[0]):
+            stack = np.empty(128, dtype=np.int64)
+
+            nx, ny, nz = normals[i, 0], normals[i, 1], normals[i, 2]
+
+            ox = positions[i, 0] + (nx * offset)
+            oy = positions[i, 1] + (ny * offset)
+            oz = positions[i, 2] + (nz * offset)
+
+            total = 0.0
+
+            for sample in range(directions.shape[0]):
+                dx, dy, dz = directions[sample, 0], directions[sample, 1], directions[sample, 2]
+
+                # Make sure the samples are in a hemisphere.
+                dot = (dx * nx) + (dy * ny) + (dz * nz)
+
+                if dot < 0:
+                    dx -= 2 * dot * nx
+                    dy -= 2 * dot * ny
+                    dz -= 2 * dot * nz
+
+                distance = nearest_hit_numba(ox, oy, oz, dx, dy, dz, max_distance, stack, node_min, node_max, node_children, node_axes, node_start, node_count, v0, e1, e2)
+
+                falloff = min(1.0, max(0.0, 1.0 - (distance / max_distance)))
+
+                total += falloff ** power
+
+            occlusion[i] = total / directions.shape[0]
+
+        return occlusion
+
+class NumbaBackend(KernelBackend):
+    """
+JIT-compiled with Numba: every ray walks the tree on its own, in parallel, without holding the GIL and without any
+temporary arrays. The first bake in each Blender session pays a few seconds of compilation (later ones use the cache.)
+
+It uses whichever threading layer Numba is set up with; nothing here changes that for anyone else.
+"""
+
+    name = "numba"
+    label = "Numba"
+
+    rays_per_update = 500000
+
+    releases_gil = True
+
+    # Whether a parallel kernel has run on the main thread yet.
+    is_prepared = False
+
+    @classmethod
+    def is_available(cls):
+        return numba != None
+
+    def prepare(self):
+        # The TBB threading layer (the default, where it's installed) hangs Python on exit if it's first started from
+        # another thread. Starting it here costs one tiny kernel call (and compiling, the first time.)
+        if NumbaBackend.is_prepared:
+            return
+
+        bvh = TriangleBVH(np.array([[[0, 0, 0], [1, 0, 0], [0, 1, 0]]], dtype=np.float64))
+
+        self.intersect(bvh, np.array([[0.25, 0.25, 1.0]]), np.array([[0.0, 0.0, -1.0]]), 2.0)
+
+        NumbaBackend.is_prepared = True
+
+    def get_tree_arrays(self, bvh):
+        return (bvh.node_min, bvh.node_max, bvh.node_children, bvh.node_axes, bvh.node_start, bvh.node_count, bvh.v0, bvh.e1, bvh.e2)
+
+    def intersect(self, bvh, origins, directions, max_distance):
+        if len(bvh) == 0:
+            return np.full(len(origins), max_distance, dtype=np.float64)
+
+        with kernel_lock:
+            return intersect_numba(np.ascontiguousarray(origins, dtype=np.float64), np.ascontiguousarray(directions, dtype=np.float64), float(max_distance), *self.get_tree_arrays(bvh))
+
+    def compute(self, bvh, positions, normals, directions, max_distance, power):
+        if len(bvh) == 0:
+            return np.zeros(len(positions), dtype=np.float64)
+
+        with kernel_lock:
+            return compute_numba(np.ascontiguousarray(positions, dtype=np.float64), np.ascontiguousarray(normals, dtype=np.float64), np.ascontiguousarray(directions, dtype=np.float64), float(max_distance), float(power), ray_offset, *self.get_tree_arrays(bvh))
+
+# {name: backend class}. Fastest first; `get_backend("auto")` picks the first one that's available.
+backends = {}
+
+def register_backend(backend, first=False):
+    """Makes `backend` (a `KernelBackend` subclass) available to `get_backend()`."""
+
+    global backends
+
+    if first:
+        backends = dict([(backend.name, backend)] + list(backends.items()))
+    else:
+        backends[backend.name] = backend
+
+register_backend(NumbaBackend)
+register_backend(NumpyBackend)
+
+def get_backend(name="auto"):
+    """Returns an instance of the backend called `name`, or the fastest available one; falls back to NumPy."""
+
+    if name in backends and backends[name].is_available():
+        return backends[name]()
+
+    if name != "auto":
+        print("The '{}' kernel backend isn't available; falling back to the fastest one that is".format(name))
+
+    for backend in backends.values():
+        if backend.is_available():
+            return backend()
+
+    return NumpyBackend()
+
+class RayCastEngine:
+    """Casts rays from every point against a `TriangleBVH` of the casters near the receiver, with a `KernelBackend`."""
+
+    def __init__(self, bvh, max_distance, power, backend):
+        self.bvh = bvh
+        self.max_distance = max_distance
+        self.power = power
+        self.backend = backend
+
+    def compute(self, positions, normals, directions):
+        """Returns the occlusion (0..1) for each of `positions` (N×3, world space) with `normals` (N×3), over `directions` (S×3.)"""
+
+        positions = np.asarray(positions, dtype=np.float64)
+        normals = engines.normalize(np.asarray(normals, dtype=np.float64))
+        directions = np.asarray(directions, dtype=np.float64).reshape((-1, 3))
+
+        return self.backend.compute(self.bvh, positions, normals, directions, self.max_distance, self.power).astype(np.float32)
+
+def intersect_brute_force(triangles, origins, directions, max_distance, chunk_size=256):
+    """Every ray against every triangle, with no tree at all. Only useful as a reference."""
+
+    triangles = np.asarray(triangles, dtype=np.float64).reshape((-1, 3, 3))
+
+    nearest = np.full(len(origins), max_distance, dtype=np.float64)
+
+    if len(triangles) == 0:
+        return nearest
+
+    v0 = triangles[:, 0]
+    e1 = triangles[:, 1] - v0
+    e2 = triangles[:, 2] - v0
+
+    for start in range(0, len(origins), chunk_size):
+        end = min(len(origins), start + chunk_size)
+
+        rays = np.repeat(np.arange(start, end), len(triangles))
+        indices = np.tile(np.arange(len(triangles)), end - start)
+
+        distance = intersect_triangles(origins[rays], directions[rays], v0[indices], e1[indices], e2[indices])
+
+        nearest[start:end] = np.minimum(nearest[start:end], distance.reshape((end - start, len(triangles))).min(axis=1))
+
+    return nearest
+
+def get_test_scene(seed=0, triangle_count=2000, point_count=400, sample_count=32):
+    """
+Returns `(triangles, positions, normals, directions)` for a small, cluttered scene: a floor covered in randomly
+placed and rotated triangles, with points to bake scattered across the floor.
+"""
+
+    random = np.random.RandomState(seed)
+
+    floor = np.array([
+        [[-4, -4, 0], [4, -4, 0], [4, 4, 0]],
+        [[-4, -4, 0], [4, 4, 0], [-4, 4, 0]],
+    ], dtype=np.float64)
+
+    centers = random.uniform((-3, -3, 0.05), (3, 3, 2), (triangle_count, 1, 3))
+    clutter = centers + random.normal(0, 0.2, (triangle_count, 3, 3))
+
+    triangles = np.concatenate([floor, clutter])
+
+    positions = np.zeros((point_count, 3))
+    positions[:, :2] = random.uniform(-3, 3, (point_count, 2))
+
+    normals = np.zeros((point_count, 3))
+    normals[:, 2] = 1
+
+    directions = engines.normalize(random.normal(0, 1, (sample_count, 3)))
+
+    return triangles, positions, normals, directions
+
+def check_conformance(seed=0, max_distance=1.5, power=0.5, tolerance=1e-6):
+    """
+Runs every available backend on the same scene, and checks the hit distances against a brute-force reference and
+the occlusion against each other. Returns `{backend name: (max distance error, max occlusion error, seconds)}` and
+raises `AssertionError` if any backend disagrees by more than `tolerance`.
+"""
+
+    triangles, positions, normals, directions = get_test_scene(seed)
+
+    bvh = TriangleBVH(triangles)
+
+    origins, rays = get_hemisphere_rays(positions, normals, directions)
+
+    reference_distance = intersect_brute_force(triangles, origins, rays, max_distance)
+    reference_occlusion = engines.occlusion_from_distance(reference_distance, max_distance, power).reshape((len(positions), len(directions))).mean(axis=1)
+
+    results = {}
+
+    for name, backend in backends.items():
+        if not backend.is_available():
+            print("{}: not available".format(backend.label))
+            continue
+
+        backend = backend()
+
+        # The first call might compile something; that shouldn't count.
+        backend.intersect(bvh, origins[:1], rays[:1], max_distance)
+        backend.compute(bvh, positions[:1], normals[:1], directions, max_distance, power)
+
+        start_time = time.time()
+
+        distance = backend.intersect(bvh, origins, rays, max_distance)
+        occlusion = backend.compute(bvh, positions, normals, directions, max_distance, power)
+
+        elapsed = time.time() - start_time
+
+        distance_error = np.abs(distance - reference_distance).max()
+        occlusion_error = np.abs(occlusion - reference_occlusion).max()
+
+        results[name] = (distance_error, occlusion_error, elapsed)
+
+        print("{}: max distance error {:.2e}, max occlusion error {:.2e} ({:.3f} seconds)".format(backend.label, distance_error, occlusion_error, elapsed))
+
+    for name, (distance_error, occlusion_error, elapsed) in results.items():
+        assert distance_error <= tolerance and occlusion_error <= tolerance, "The '{}' kernel backend doesn't match the reference".format(name)
+
+    return results
+
+if __name__ == "__main__":
+    try:
+        check_conformance()
+    except AssertionError as e:
+        print(e)
+        sys.exit(1)
+
+    print("Every available backend matches the reference")
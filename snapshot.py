@@ -0,0 +1,363 @@
+# Blender Vertex Oven addon
+# Copyright (C) 2019 Forest Katsch (forestcgk@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Scene snapshots: everything a bake needs, in one binary file that can be memory-mapped, so the bake itself can run
+# outside Blender. Like `engines`, nothing in here may import `bpy` or `mathutils`. To bake a snapshot to per-loop
+# arrays (one per receiver, in an .npz file):
+#
+#     python snapshot.py <snapshot> <output.npz>
+#
+# The layout is:
+#
+#     8 bytes          magic ("VOSNAP" and the format version, as two bytes)
+#     8 bytes          the length of the header, as a little-endian uint64
+#     header           JSON: the options, the receivers, and where each array is
+#     arrays           each one starts on a 64-byte boundary, in C order
+#
+# The arrays are:
+#
+#     directions                 S×3 float64, the sample directions; every point uses all of them
+#     caster_vertices            object-space vertices of every caster's geometry, one after another (float32)
+#     caster_indices             triangles (T×3 int32), indexing into their own caster's vertices
+#     caster_vertex_offsets      where each caster's vertices start (and end) in `caster_vertices`
+#     caster_index_offsets       where each caster's triangles start (and end) in `caster_indices`
+#     instance_casters           which caster each instance places
+#     instance_matrices          each instance's world matrix (I×4×4 float64)
+#     receiver_<n>_positions     object-space positions of each point to bake (float32)
+#     receiver_<n>_normals       object-space normals of each point (float32)
+#     receiver_<n>_vertex_indices, receiver_<n>_loop_indices
+#     receiver_<n>_matrix        the receiver's world matrix (4×4 float64)
+#
+# Instances of the same geometry only store it once, so scenes full of duplicates stay small.
+
+import os
+import sys
+import json
+import struct
+import argparse
+
+import numpy as np
+
+try:
+    from . import engines
+    from . import kernels
+except ImportError:
+    import engines
+    import kernels
+
+snapshot_magic = b"VOSNAP"
+snapshot_version = 1
+
+alignment = 64
+
+class SnapshotError(Exception):
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+def write_snapshot(path, options, casters, instances, receivers, directions):
+    """
+Writes a snapshot to `path`. `options` is a dictionary of bake options; `casters` is a list of `(vertices, triangles)`
+in object space (V×3 and T×3); `instances` is a list of `(caster index, matrix)`; `receivers` is a list of dictionaries
+with "name", "loop_count", "positions", "normals", "vertex_indices", "loop_indices" and "matrix"; `directions` is S×3.
+"""
+
+    arrays = [("directions", np.asarray(directions, dtype=np.float64).reshape((-1, 3)))]
+
+    vertex_counts = [len(vertices) for vertices, triangles in casters]
+    index_counts = [len(triangles) for vertices, triangles in casters]
+
+    arrays.append(("caster_vertices", np.concatenate([np.asarray(vertices, dtype=np.float32).reshape((-1, 3)) for vertices, triangles in casters] + [np.zeros((0, 3), dtype=np.float32)])))
+    arrays.append(("caster_indices", np.concatenate([np.asarray(triangles, dtype=np.int32).reshape((-1, 3)) for vertices, triangles in casters] + [np.zeros((0, 3), dtype=np.int32)])))
+
+    arrays.append(("caster_vertex_offsets", np.concatenate([[0], np.cumsum(vertex_counts, dtype=np.int64)]).astype(np.int64)))
+    arrays.append(("caster_index_offsets", np.concatenate([[0], np.cumsum(index_counts, dtype=np.int64)]).astype(np.int64)))
+
+    arrays.append(("instance_casters", np.array([caster_index for caster_index, matrix in instances], dtype=np.int32)))
+    arrays.append(("instance_matrices", np.array([matrix for caster_index, matrix in instances], dtype=np.float64).reshape((-1, 4, 4))))
+
+    receiver_entries = []
+
+    for receiver_index, receiver in enumerate(receivers):
+        prefix = "receiver_{}_".format(receiver_index)
+
+        arrays.append((prefix + "positions", np.asarray(receiver["positions"], dtype=np.float32).reshape((-1, 3))))
+        arrays.append((prefix + "normals", np.asarray(receiver["normals"], dtype=np.float32).reshape((-1, 3))))
+        arrays.append((prefix + "vertex_indices", np.asarray(receiver["vertex_indices"], dtype=np.int32)))
+        arrays.append((prefix + "loop_indices", np.asarray(receiver["loop_indices"], dtype=np.int32)))
+        arrays.append((prefix + "matrix", np.array(receiver["matrix"], dtype=np.float64).reshape((4, 4))))
+
+        receiver_entries.append({
+            "name": receiver["name"],
+            "loop_count": receiver["loop_count"],
+            "point_count": len(receiver["loop_indices"]),
+        })
+
+    # Work out where everything goes. The header holds the offsets, and the offsets depend on how long the header is, so
+    # go around until they agree.
+    entries = {}
+
+    header = {
+        "version": snapshot_version,
+        "options": options,
+        "receivers": receiver_entries,
+        "arrays": entries,
+    }
+
+    data_start = 0
+
+    while True:
+        offset = data_start
+
+        for name, array in arrays:
+            entries[name] = {"offset": offset, "dtype": array.dtype.newbyteorder("<").str, "shape": list(array.shape)}
+
+            offset += array.nbytes
+            offset += (-offset) % alignment
+
+        header_bytes = json.dumps(header).encode("utf-8")
+
+        header_end = 16 + len(header_bytes)
+        header_end += (-header_end) % alignment
+
+        if header_end <= data_start:
+            break
+
+        data_start = header_end
+
+    # Write to a temporary file first, so a crash never leaves half a snapshot behind.
+    temporary_path = path + ".tmp"
+
+    with open(temporary_path, "wb") as f:
+        f.write(snapshot_magic + struct.pack("<H", snapshot_version))
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+
+        for name, array in arrays:
+            f.write(b"\0" * (entries[name]["offset"] - f.tell()))
+            f.write(np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<")).tobytes())
+
+    os.replace(temporary_path, path)
+
+    return header
+
+class Snapshot:
+    """A snapshot file, memory-mapped. Arrays are read-only views straight into the file; nothing is copied until it's used."""
+
+    def __init__(self, path):
+        self.path = path
+
+        try:
+            self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        except (OSError, ValueError):
+            raise SnapshotError("Can't read the snapshot '{}'".format(path))
+
+        if len(self.data) < 16 or bytes(self.data[:6]) != snapshot_magic:
+            raise SnapshotError("'{}' isn't a Vertex Oven snapshot".format(path))
+
+        version, = struct.unpack("<H", bytes(self.data[6:8]))
+
+        if version != snapshot_version:
+            raise SnapshotError("The snapshot '{}' was made by a different version of Vertex Oven".format(path))
+
+        header_size, = struct.unpack("<Q", bytes(self.data[8:16]))
+
+        self.header = json.loads(bytes(self.data[16:16 + header_size]).decode("utf-8"))
+
+        self.options = self.header["options"]
+        self.receivers = self.header["receivers"]
+
+        # The object-space bounds of each caster, worked out the first time they're needed.
+        self.caster_bounds = None
+
+    def get_array(self, name):
+        entry = self.header["arrays"][name]
+
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+
+        count = int(np.prod(shape, dtype=np.int64))
+
+        return self.data[entry["offset"]:entry["offset"] + (count * dtype.itemsize)].view(dtype).reshape(shape)
+
+    def get_directions(self):
+        return self.get_array("directions")
+
+    def get_receiver(self, receiver_index):
+        """Returns the arrays for one receiver as a dictionary."""
+
+        prefix = "receiver_{}_".format(receiver_index)
+
+        return {key: self.get_array(prefix + key) for key in ["positions", "normals", "vertex_indices", "loop_indices", "matrix"]}
+
+    def get_caster(self, caster_index):
+        """Returns `(vertices, triangles)` for one caster, in object space."""
+
+        vertex_offsets = self.get_array("caster_vertex_offsets")
+        index_offsets = self.get_array("caster_index_offsets")
+
+        vertices = self.get_array("caster_vertices")[vertex_offsets[caster_index]:vertex_offsets[caster_index + 1]]
+        triangles = self.get_array("caster_indices")[index_offsets[caster_index]:index_offsets[caster_index + 1]]
+
+        return vertices, triangles
+
+    def get_caster_bounds(self):
+        if self.caster_bounds == None:
+            self.caster_bounds = []
+
+            for caster_index in range(len(self.get_array("caster_vertex_offsets")) - 1):
+                vertices, triangles = self.get_caster(caster_index)
+
+                if len(vertices):
+                    self.caster_bounds.append((vertices.min(axis=0).astype(np.float64), vertices.max(axis=0).astype(np.float64)))
+                else:
+                    self.caster_bounds.append(None)
+
+        return self.caster_bounds
+
+    def get_world_triangles(self, low=None, high=None):
+        """Returns every instance's triangles in world space (T×3×3), or just those of instances overlapping `low`-`high`."""
+
+        instance_casters = self.get_array("instance_casters")
+        instance_matrices = self.get_array("instance_matrices")
+
+        caster_bounds = self.get_caster_bounds()
+
+        triangles = []
+
+        for caster_index, matrix in zip(instance_casters, instance_matrices):
+            bounds = caster_bounds[caster_index]
+
+            if bounds == None:
+                continue
+
+            if low is not None:
+                corners = np.array([[x, y, z] for x in (bounds[0][0], bounds[1][0]) for y in (bounds[0][1], bounds[1][1]) for z in (bounds[0][2], bounds[1][2])])
+                corners = (corners @ matrix[:3, :3].T) + matrix[:3, 3]
+
+                if np.any(corners.max(axis=0) < low) or np.any(corners.min(axis=0) > high):
+                    continue
+
+            vertices, indices = self.get_caster(caster_index)
+
+            coords = (vertices.astype(np.float64) @ matrix[:3, :3].T) + matrix[:3, 3]
+
+            triangles.append(coords[indices])
+
+        if len(triangles) == 0:
+            return np.zeros((0, 3, 3))
+
+        return np.concatenate(triangles)
+
+def create_engine(snapshot, world_positions, backend):
+    """Returns a `kernels.RayCastEngine` for points at `world_positions`, with only the triangles that can reach them."""
+
+    options = snapshot.options
+
+    max_distance = options["max_distance"]
+
+    # Rays start a little above the surface.
+    margin = max_distance + (kernels.ray_offset * 2)
+
+    if len(world_positions):
+        triangles = snapshot.get_world_triangles(world_positions.min(axis=0) - margin, world_positions.max(axis=0) + margin)
+    else:
+        triangles = np.zeros((0, 3, 3))
+
+    return kernels.RayCastEngine(kernels.TriangleBVH(triangles), max_distance, options["power"], backend)
+
+def get_world_points(snapshot, receiver_index):
+    """Returns `(positions, normals)` in world space for one receiver."""
+
+    receiver = snapshot.get_receiver(receiver_index)
+
+    return engines.to_world(receiver["positions"], receiver["normals"], receiver["matrix"])
+
+def bake_points(engine, world_positions, world_normals, directions):
+    """Returns the occlusion at each point, keeping each call to the kernel to a reasonable number of rays."""
+
+    chunk_size = max(1, 1000000 // max(1, len(directions)))
+
+    ao = np.empty(len(world_positions), dtype=np.float32)
+
+    for start in range(0, len(world_positions), chunk_size):
+        end = min(len(world_positions), start + chunk_size)
+
+        ao[start:end] = engine.compute(world_positions[start:end], world_normals[start:end], directions)
+
+    return ao
+
+def get_loop_ao(snapshot, receiver_index, ao):
+    """Turns one receiver's per-point results into a per-loop array. Loops that weren't baked are NaN."""
+
+    receiver = snapshot.get_receiver(receiver_index)
+
+    loop_ao = np.full(snapshot.receivers[receiver_index]["loop_count"], np.nan, dtype=np.float32)
+    loop_ao[receiver["loop_indices"]] = ao
+
+    return loop_ao
+
+def bake(snapshot, backend_name="auto"):
+    """Bakes every receiver in `snapshot`. Returns a list of per-loop arrays, one per receiver (see `get_loop_ao()`.)"""
+
+    backend = kernels.get_backend(backend_name)
+
+    directions = np.asarray(snapshot.get_directions())
+
+    results = []
+
+    for receiver_index, entry in enumerate(snapshot.receivers):
+        world_positions, world_normals = get_world_points(snapshot, receiver_index)
+
+        engine = create_engine(snapshot, world_positions, backend)
+
+        print("Baking '{}' ({} points against {} triangles, using the {} backend)".format(entry["name"], len(world_positions), len(engine.bvh), backend.label))
+
+        results.append(get_loop_ao(snapshot, receiver_index, bake_points(engine, world_positions, world_normals, directions)))
+
+    return results
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Bakes a Vertex Oven scene snapshot to per-loop arrays.")
+
+    parser.add_argument("snapshot", help="the snapshot file exported from Blender")
+    parser.add_argument("output", help="the .npz file to write, with a per-loop array for each receiving object (unbaked loops are NaN); import it with Vertex Oven > Import Baked Snapshot")
+    parser.add_argument("--backend", default="auto", choices=["auto"] + list(kernels.backends.keys()), help="the ray casting kernel backend")
+
+    arguments = parser.parse_args(arguments)
+
+    try:
+        snapshot = Snapshot(arguments.snapshot)
+    except SnapshotError as e:
+        print(e.message)
+        return 1
+
+    results = bake(snapshot, arguments.backend)
+
+    # Object names can be anything, so they're stored alongside the arrays. The options say where Blender writes them.
+    arrays = {"receiver_{}".format(i): ao for i, ao in enumerate(results)}
+
+    np.savez(arguments.output, names=np.array([entry["name"] for entry in snapshot.receivers]), options=np.array(json.dumps(snapshot.options)), **arrays)
+
+    print("Wrote {} receiver(s) to '{}'".format(len(results), arguments.output))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))